@@ -1,10 +1,24 @@
-from PIL import Image
-import google.generativeai as genai
+import json
 
-model = genai.GenerativeModel("gemini-2.5-flash")
+from src import run_settings
+from src.response_cache import cache
+from src.preprocess import settings_tag
+from src.image_handle import as_handle
+from src.llm_client import generate
+from src.backends import get_backend
+from src.telemetry import telemetry
+from src.yolo_formatter import repair_annotation
+from src.postprocess import postprocess_objects
+from src.config import POSTPROCESS_METHOD
 
-def correct_annotation(image_path, annotation_json):
-    img = Image.open(image_path)
+MODEL_NAME = "gemini-2.5-flash"
+
+# Duplicate-box removal after repair: none | nms | soft_nms | wbf
+# (process default; a job's run settings override it)
+POSTPROCESS = POSTPROCESS_METHOD
+
+def correct_annotation(image, annotation_json):
+    handle = as_handle(image)
 
     prompt = """
 You are a Correction Agent.
@@ -29,5 +43,39 @@ Return ONLY JSON:
 
 
 
-    response = model.generate_content([prompt, img, annotation_json])
-    return response.text
+    image_bytes = handle.bytes
+
+    # Keyed on the input annotation too, so a new perception result is re-corrected
+    key = cache.make_key(image_bytes, prompt, f"{get_backend().name}:{MODEL_NAME}|{settings_tag()}", annotation_json)
+    with telemetry.span("correction_llm", image=handle.name):
+        cached = cache.get(key)
+        if cached is not None:
+            telemetry.annotate(cache="hit")
+            return cached
+
+        blob, stats = handle.upload()
+        telemetry.annotate(cache="miss", upload_bytes=stats["sent_bytes"])
+        response = generate(MODEL_NAME, [prompt, blob, annotation_json])
+        cache.put(key, response.text)
+        return response.text
+
+
+def local_correct(image, annotation_json):
+    """
+    Fast path: repair the perception output locally, without a model call,
+    then drop duplicate / overlapping boxes (POSTPROCESS).
+    Returns the corrected JSON string, or None when the LLM correction
+    agent is needed.
+    """
+    # Pixel boxes from the model refer to the uploaded (downscaled) image;
+    # the size comes from the header, pixels are never decoded here
+    handle = as_handle(image)
+    with telemetry.span("correction_local", image=handle.name) as span:
+        fixed = repair_annotation(annotation_json, handle.upload_size)
+        span.set(repaired=fixed is not None)
+        if fixed is None:
+            return None
+        method = run_settings.get("postprocess", POSTPROCESS)
+        objects = postprocess_objects(fixed["objects"], method)
+        span.set(postprocess=method, boxes_in=len(fixed["objects"]), boxes_out=len(objects))
+        return json.dumps({**fixed, "objects": objects})
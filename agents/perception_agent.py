@@ -1,6 +1,34 @@
-import google.generativeai as genai
-from PIL import Image
 import json
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.config import (
+    TILING_ENABLED, TILE_SIZE, TILE_OVERLAP, TILE_MIN_SIDE, TILE_CONCURRENCY,
+    TILE_INCLUDE_FULL, TILE_MERGE_THRESHOLD,
+    CASCADE_ENABLED, CASCADE_CHEAP_MODEL, CASCADE_STRONG_MODEL, CASCADE_SAMPLES, CASCADE_TEMPERATURE,
+)
+from src import run_settings
+from src.response_cache import cache
+from src.preprocess import settings_tag
+from src.image_handle import as_handle
+from src.llm_client import generate
+from src.backends import get_backend
+from src.telemetry import telemetry
+from src.tiling import tile_grid, crop_tile, to_global
+from src.postprocess import merge_objects
+from src.json_stream import ObjectStream, parse_annotation, parse_json
+from src.cascade import assess, candidate_texts, routing
+from src.yolo_formatter import repair_annotation
+
+MODEL_NAME = "gemini-2.5-flash"  # or 1.5-pro
+
+# Sliced mode for large images (process default; a job's run settings
+# override it, see src/run_settings.py)
+TILING = TILING_ENABLED
+
+# Cheap model first, strong model only for images that fail the local checks
+CASCADE = CASCADE_ENABLED
 
 
 prompt = """
@@ -32,30 +60,298 @@ Correct format:
 """
 
 # Main function your main.py will call
-def annotate_image(image_path):
-    img = Image.open(image_path)
+def annotate_image(image, on_object=None):
+    """
+    image: path or src.image_handle.ImageHandle
+    on_object(obj): when given, the response is streamed and every box is
+    passed on as soon as it is complete (cache hits replay theirs). If the
+    stream breaks, on_object(None) says to drop the boxes passed on so far
+    and the answer of the blocking retry is passed on instead. The
+    return value is the full raw JSON either way. Tiled images report
+    nothing early: their boxes are only final after the seam merge.
+    """
+    handle = as_handle(image)
+    if run_settings.get("tiling", TILING) and max(handle.size) > TILE_MIN_SIDE:
+        return annotate_tiled(handle)
+    with telemetry.span("perception", image=handle.name):
+        return _perceive(handle, on_object)
+
+
+def annotate_tiled(image, tile=TILE_SIZE, overlap=TILE_OVERLAP, include_full=TILE_INCLUDE_FULL):
+    """
+    Sliced inference: overlapping tiles are annotated concurrently, their
+    tile-local boxes mapped back to full-image coordinates, and duplicates
+    along the seams merged with per-label NMS. With include_full the whole
+    frame is annotated as well, so objects larger than a tile survive.
+    Each tile is cached on its own bytes like a normal image.
+    """
+    handle = as_handle(image)
+    size = handle.size
+    windows = tile_grid(size, tile, overlap)
+    if include_full:
+        windows.append(None)
+
+    with telemetry.span("perception_tiled", image=handle.name, tiles=len(windows)) as span:
+        with ThreadPoolExecutor(max_workers=max(1, TILE_CONCURRENCY)) as pool:
+            # copy_context: tile spans nest under this one in the worker threads
+            futures = [
+                pool.submit(contextvars.copy_context().run, _annotate_window, handle, window)
+                for window in windows
+            ]
+            objects = [obj for fut in futures for obj in fut.result()]
+
+        # Intersection over the smaller box: a box cut at a seam lies
+        # inside the complete box from the neighbouring tile
+        merged = merge_objects(objects, TILE_MERGE_THRESHOLD, metric="ios")
+        span.set(boxes=len(objects), merged=len(merged))
+    return json.dumps({"objects": merged})
+
+
+def _annotate_window(handle, window):
+    """Annotates one tile (or the full frame when window is None) -> global objects."""
+    sub = handle if window is None else crop_tile(handle, window)
+    tile = "full" if window is None else "{},{}".format(*window[:2])
+    with telemetry.span("perception", tile=tile):
+        raw = _perceive(sub)
+    fixed = repair_annotation(raw, sub.upload_size)
+    if fixed is None:
+        return []
+    if window is None:
+        return fixed["objects"]
+    return [to_global(obj, window, handle.size) for obj in fixed["objects"]]
+
+
+def _cache_key(handle, model=MODEL_NAME):
+    # Same image + prompt + model -> reuse the previous response
+    return cache.make_key(handle.bytes, prompt, f"{get_backend().name}:{model}|{settings_tag()}")
+
+
+def _perceive(handle, on_object=None):
+    if run_settings.get("cascade", CASCADE):
+        return _annotate_cascade(handle, on_object)
+    return _annotate(handle, on_object)
+
+
+def _parse_complete(text):
+    """Parsed answer, or None when it is missing or only salvaged from a cut-off answer."""
+    stream = ObjectStream()
+    stream.feed(text or "")
+    data = stream.result()
+    return None if stream.salvaged else data
+
+
+def _replay(raw, on_object):
+    if on_object is not None:
+        data = parse_annotation(raw)
+        for obj in data.get("objects", []) if isinstance(data, dict) else data or []:
+            on_object(obj)
+
+
+# Cached under the cascade key when the cheap answer was rejected
+ESCALATED = "escalated"
+
+
+def _annotate_cascade(handle, on_object=None):
+    """
+    Cascade: CASCADE_SAMPLES candidates from the cheap model in one request,
+    checked locally (src/cascade.assess: schema, box count, box sanity,
+    agreement between the samples). Accepted -> the fused samples;
+    otherwise (or when the cheap call fails) the image is escalated to the
+    strong model. The cascade key caches the accepted annotation, or a
+    marker for a rejected one, so next time an escalated image skips the
+    cheap call and goes straight to the strong model (and its cache).
+    """
+    key = _cache_key(handle, f"cascade:{CASCADE_CHEAP_MODEL}x{CASCADE_SAMPLES}")
+    cached = cache.get(key)
+    if cached == ESCALATED:
+        telemetry.annotate(route="escalated")
+        return _annotate(handle, on_object, model=CASCADE_STRONG_MODEL)
+    if cached is not None:
+        telemetry.annotate(cache="hit", route="accepted")
+        _replay(cached, on_object)
+        return cached
+
+    with telemetry.span("perception_cheap", model=CASCADE_CHEAP_MODEL) as span:
+        blob, stats = handle.upload()
+        telemetry.add("upload_bytes", stats["sent_bytes"])
+        try:
+            response = generate(CASCADE_CHEAP_MODEL, [prompt, blob], generation_config={
+                "candidate_count": CASCADE_SAMPLES, "temperature": CASCADE_TEMPERATURE,
+            })
+            decision = assess([_parse_complete(text) for text in candidate_texts(response)], handle.upload_size)
+        except Exception as e:
+            decision = {"accept": False, "reason": "error", "agreement": None}
+            span.set(cheap_error=f"{type(e).__name__}: {e}")
+        route = "accepted" if decision["accept"] else "escalated"
+        span.set(route=route, reason=decision["reason"], agreement=decision["agreement"])
+
+    routing.record(route, decision["reason"])
+    telemetry.incr("annotator_cascade_routes_total", "Perception cascade decisions",
+                   route=route, reason=decision["reason"])
+    telemetry.annotate(route=route)
+    if decision["accept"]:
+        result = json.dumps(decision["annotation"])
+        cache.put(key, result)
+        _replay(result, on_object)
+        return result
+    if decision["reason"] != "error":  # a failed call is retried next run
+        cache.put(key, ESCALATED)
+    return _annotate(handle, on_object, model=CASCADE_STRONG_MODEL)
+
+
+def _stream(contents, on_object, model=MODEL_NAME):
+    """Streamed generate; calls on_object per completed box, returns the full text."""
+    start = time.perf_counter()
+    stream = ObjectStream()
+    for chunk in generate(model, contents, stream=True):
+        try:
+            text = chunk.text
+        except ValueError:
+            continue  # chunk without text parts (e.g. the final usage chunk)
+        for obj in stream.feed(text):
+            if len(stream.objects) == 1:
+                telemetry.annotate(first_box_ms=round((time.perf_counter() - start) * 1000, 1))
+            on_object(obj)
+    return stream.text
+
+
+def _annotate(handle, on_object=None, model=MODEL_NAME):
+    key = _cache_key(handle, model)
+    cached = cache.get(key)
+    if cached is not None:
+        telemetry.annotate(cache="hit")
+        _replay(cached, on_object)
+        return cached
+
+    # Downscaled, re-encoded upload (normalized boxes stay valid)
+    blob, stats = handle.upload()
+    telemetry.annotate(cache="miss", upload_bytes=stats["sent_bytes"])
 
     # Send prompt + image to LLM
-    model = genai.GenerativeModel("gemini-2.5-flash")  # or 1.5-pro
-    response = model.generate_content(
-        [prompt, img],
-        stream=False,
-    )
-
-    raw_text = response.text
-
-    # Ensure we extract only JSON
-    try:
-        # If model returned a JSON chunk directly
-        data = json.loads(raw_text)
-        return json.dumps(data)
-    except Exception:
-        # Try to extract JSON using regex fallback
-        import re
-        match = re.search(r"(\{[\s\S]*\})", raw_text)
-        if match:
-            return match.group(0)
-
-    # Fallback (rare)
+    if on_object is None:
+        raw_text = generate(model, [prompt, blob], stream=False).text
+    else:
+        try:
+            raw_text = _stream([prompt, blob], on_object, model)
+        except Exception as e:
+            # Broken stream: the blocking call (with retries) decides and
+            # replaces whatever boxes were already passed on
+            telemetry.annotate(stream_error=type(e).__name__)
+            on_object(None)
+            raw_text = generate(model, [prompt, blob], stream=False).text
+            _replay(raw_text, on_object)
+
+    # Ensure we extract only JSON (bracket-balanced, chatter skipped;
+    # a truncated answer keeps the boxes that did complete)
+    stream = ObjectStream()
+    stream.feed(raw_text or "")
+    data = stream.result()
+    if data is not None:
+        result = json.dumps(data)
+        if not stream.salvaged:  # partial answers are retried next run
+            cache.put(key, result)
+        return result
+
+    # Fallback (rare) - not cached so the next run retries
     return '{"objects":[]}'
 
+
+# Packed mode: several small images in one request
+
+packed_prompt = """
+You are an Image Annotation Agent.
+
+You will receive several images. Each image is preceded by a line "Image <index>:".
+Annotate EVERY image independently.
+
+For each image, detect objects and output NORMALIZED bounding boxes
+relative to THAT image:
+- bbox_norm = [x_norm, y_norm, width_norm, height_norm]
+- All values are floats between 0 and 1
+
+Important:
+- One entry per image, with the same index as its "Image <index>:" line.
+- DO NOT return pixel values.
+- DO NOT return code blocks or markdown.
+- Return ONLY JSON.
+
+Correct format:
+{
+  "images": [
+    {
+      "index": 0,
+      "objects": [
+        { "label": "LABEL", "bbox_norm": [x_norm, y_norm, width_norm, height_norm] }
+      ]
+    }
+  ]
+}
+"""
+
+
+def _split_packed(raw_text, count):
+    """index -> objects list for every well-formed section of a packed answer."""
+    data = parse_json(raw_text, accept=lambda value: isinstance(value, dict) and "images" in value)
+
+    sections = {}
+    for section in data.get("images", []) if isinstance(data, dict) else []:
+        if not isinstance(section, dict):
+            continue
+        index, objects = section.get("index"), section.get("objects")
+        if isinstance(index, int) and 0 <= index < count and isinstance(objects, list) \
+                and all(isinstance(o, dict) for o in objects):
+            sections.setdefault(index, objects)
+    return sections
+
+
+def annotate_packed(images):
+    """
+    Annotates several (small) images with ONE request: the prompt is sent
+    once and the answer is split back by index. Cached images are skipped;
+    any image whose section is missing or malformed falls back to its own
+    annotate_image call. Returns one raw JSON string per image, in order.
+    """
+    handles = [as_handle(image) for image in images]
+    results = [None] * len(handles)
+    keys = [_cache_key(handle) for handle in handles]
+
+    todo = []
+    for i, key in enumerate(keys):
+        cached = cache.get(key)
+        if cached is not None:
+            results[i] = cached
+        else:
+            todo.append(i)
+
+    if len(todo) == 1:
+        results[todo[0]] = annotate_image(handles[todo[0]])
+        return results
+
+    if todo:
+        with telemetry.span("perception_packed", images=len(todo)) as span:
+            contents = [packed_prompt]
+            for n, i in enumerate(todo):
+                blob, stats = handles[i].upload()
+                telemetry.add("upload_bytes", stats["sent_bytes"])
+                contents += [f"Image {n}:", blob]
+            try:
+                sections = _split_packed(generate(MODEL_NAME, contents).text, len(todo))
+            except Exception as e:
+                # The whole pack failed (after retries): every image goes single
+                span.set(pack_error=f"{type(e).__name__}: {e}")
+                sections = {}
+
+            missing = []
+            for n, i in enumerate(todo):
+                if n in sections:
+                    results[i] = json.dumps({"objects": sections[n]})
+                    cache.put(keys[i], results[i])
+                else:
+                    missing.append(i)
+            span.set(fallbacks=len(missing))
+
+        for i in missing:
+            results[i] = annotate_image(handles[i])
+
+    return results
+
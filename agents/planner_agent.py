@@ -1,54 +1,70 @@
-# agents/planner_agent.py (Dynamic Version)
+# agents/planner_agent.py (Local + optional LLM Version)
 
 import json
-import re # Add import for JSON extraction fallback
-import google.generativeai as genai
-# Import API key configuration
-from src.config import GOOGLE_API_KEY 
+from functools import lru_cache
+from src.config import PLANNER_MODE
+from src.json_stream import parse_json
+from src.llm_client import generate
+from src.telemetry import telemetry
 
-if not GOOGLE_API_KEY:
-    raise RuntimeError("GOOGLE_API_KEY is missing for Planner Agent.")
-genai.configure(api_key=GOOGLE_API_KEY)
+MODEL_NAME = "gemini-2.5-flash" # Use a Gemini model
 
-model = genai.GenerativeModel("gemini-2.5-flash") # Use a Gemini model
+# Canonical order of every step the pipeline knows about
+STEP_ORDER = [
+    "load_image",
+    "run_perception_agent",
+    "run_correction_agent",
+    "evaluate_annotation",
+    "convert_to_yolo",
+    "visualize_boxes",
+    "save_results",
+]
 
-def make_plan(image_path, options):
+# Optional step -> option that enables it
+OPTIONAL_STEPS = {
+    "evaluate_annotation": "run_iou",
+    "visualize_boxes": "show_boxes",
+    "save_results": "auto_save",
+}
+
+
+def _options_key(options):
+    return tuple(bool(options.get(name, True)) for name in ("run_iou", "show_boxes", "auto_save"))
+
+
+def build_plan(options):
     """
-    Generates a dynamic execution plan based on user options using an LLM.
-    
-    options: {
-        "run_iou": bool,
-        "show_boxes": bool,
-        "auto_save": bool
-    }
+    Deterministic local planner: the plan only depends on the three
+    boolean options, so no model call is needed.
     """
-    
-    # Define available steps for the LLM to choose from
-    all_steps = [
-        "load_image",
-        "run_perception_agent",
-        "run_correction_agent",
-        "convert_to_yolo"
+    return [
+        step for step in STEP_ORDER
+        if step not in OPTIONAL_STEPS or options.get(OPTIONAL_STEPS[step], True)
     ]
-    if options.get('run_iou', True):
-        all_steps.append("evaluate_annotation")
-    if options.get('show_boxes', True):
-        all_steps.append("visualize_boxes")
-    if options.get('auto_save', True):
-        all_steps.append("save_results")
+
+
+@lru_cache(maxsize=8)
+def _llm_plan(run_iou, show_boxes, auto_save):
+    """
+    Asks Gemini to order the steps. Memoized per options tuple, so each
+    combination costs at most one call per process.
+    Returns a tuple of steps, or None if the answer is unusable.
+    """
+    # Define available steps for the LLM to choose from
+    all_steps = build_plan({"run_iou": run_iou, "show_boxes": show_boxes, "auto_save": auto_save})
 
     # 1. Define the planning prompt
     prompt = f"""
     You are a high-level Planner Agent for an image annotation pipeline.
     Your task is to generate the optimal sequence of steps for the current run.
-    
+
     The pipeline must always include: load_image, run_perception_agent, run_correction_agent, and convert_to_yolo.
-    
+
     Available optional steps, determined by user settings:
     - evaluate_annotation (IoU)
     - visualize_boxes
     - save_results
-    
+
     The final chronological plan should include the following steps (order them logically):
     {all_steps}
 
@@ -56,28 +72,55 @@ def make_plan(image_path, options):
 
     Return ONLY JSON:
     {{
-      "plan": ["step_1", "step_2", ...],
-      "image": "{image_path}"
+      "plan": ["step_1", "step_2", ...]
     }}
     """
-    
+
     # 2. Call the LLM to generate the plan
-    response = model.generate_content(prompt)
+    response = generate(MODEL_NAME, prompt)
 
     raw_text = response.text
 
-    # Basic JSON extraction fallback (as used in your other agents)
-    try:
-        plan_data = json.loads(raw_text)
-        return json.dumps(plan_data)
-    except Exception:
-        # Try to extract JSON using regex fallback
-        match = re.search(r"(\{[\s\S]*\})", raw_text)
-        if match:
-            return match.group(0)
-
-    # Fallback plan in case the LLM fails
+    # First JSON object in the answer (chatter around it is skipped)
+    plan_data = parse_json(raw_text, accept=lambda value: isinstance(value, dict) and "plan" in value)
+
+    # Only accept a plan that is a permutation of the allowed steps
+    plan = plan_data.get("plan") if isinstance(plan_data, dict) else None
+    if not isinstance(plan, list) or sorted(plan) != sorted(all_steps):
+        return None
+    return tuple(plan)
+
+
+def make_plan(image_path, options, use_llm=None):
+    """
+    Generates the execution plan for the current run.
+
+    options: {
+        "run_iou": bool,
+        "show_boxes": bool,
+        "auto_save": bool
+    }
+    use_llm: None -> PLANNER_MODE from config ("local" by default)
+    """
+    if use_llm is None:
+        use_llm = PLANNER_MODE == "llm"
+
+    with telemetry.span("planner", image=image_path) as span:
+        plan, planner = None, "local"
+        if use_llm:
+            try:
+                plan = _llm_plan(*_options_key(options))
+                planner = "llm"
+            except Exception:
+                plan = None
+
+        # Local plan (default, and fallback when the LLM fails)
+        if plan is None:
+            plan, planner = build_plan(options), "local"
+        span.set(planner=planner)
+
     return json.dumps({
-        "plan": ["load_image", "run_perception_agent", "run_correction_agent", "evaluate_annotation", "convert_to_yolo", "save_results"],
-        "image": image_path
-    })
\ No newline at end of file
+        "plan": list(plan),
+        "image": image_path,
+        "planner": planner
+    })
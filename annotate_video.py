@@ -0,0 +1,60 @@
+# annotate_video.py — YOLO labels for every frame of a video
+#
+# Usage:
+#   python annotate_video.py --video data/clip.mp4 --out annotations/video
+#   python annotate_video.py --video data/clip.mp4 --stride 15
+#
+# Only keyframes (every --stride frames, or scene changes when --stride
+# is 0) go through the agents; boxes in between are tracked by IoU and
+# linearly interpolated, so LLM calls grow with scene changes instead of
+# frame count. Writes labels/<stem>_<frame>.txt, classes.txt,
+# keyframes.json and tracks.jsonl (see src/video.py).
+
+import argparse
+import logging
+import os
+
+import src.llm_client as llm_client
+from src.config import VIDEO_STRIDE, VIDEO_SCENE_THRESHOLD, VIDEO_MIN_GAP, VIDEO_MAX_GAP
+from src.memory_bank import remember
+from src.telemetry import telemetry
+from src.video import SceneDetector, annotate_video, video_info
+from src.yolo_export import ClassMap
+
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate a video from keyframes")
+    parser.add_argument("--video", required=True, help="video file")
+    parser.add_argument("--out", default="annotations/video", help="output directory")
+    parser.add_argument("--stride", type=int, default=VIDEO_STRIDE,
+                        help="annotate every Nth frame (0 = scene-change keyframes)")
+    parser.add_argument("--scene-threshold", type=float, default=VIDEO_SCENE_THRESHOLD,
+                        help="histogram distance that starts a new scene")
+    parser.add_argument("--min-gap", type=int, default=VIDEO_MIN_GAP, help="min frames between keyframes")
+    parser.add_argument("--max-gap", type=int, default=VIDEO_MAX_GAP, help="max frames between keyframes")
+    parser.add_argument("--concurrency", type=int, default=None, help="keyframes annotated in parallel")
+    parser.add_argument("--classes", default=None, help="optional classes.txt fixing the class order")
+    args = parser.parse_args()
+
+    info = video_info(args.video)
+    logger.info(f"{args.video}: {info['frames']} frames, {info['width']}x{info['height']} @ {info['fps']:.2f} fps")
+
+    out_dir = os.path.join(args.out, os.path.splitext(os.path.basename(args.video))[0])
+    detector = SceneDetector(args.scene_threshold, args.min_gap, args.max_gap)
+    class_map = ClassMap.load(args.classes) if args.classes else None
+    summary = annotate_video(args.video, out_dir, stride=args.stride, detector=detector,
+                             concurrency=args.concurrency, class_map=class_map)
+    summary["llm_calls"] = llm_client.client.stats()["calls"]
+
+    remember("last_video", summary)
+    logger.info(f"{summary['frames']} frames labelled from {summary['keyframes']} keyframes "
+                f"({summary['failed_keyframes']} failed), {summary['tracks']} tracks, "
+                f"{summary['llm_calls']} LLM calls → {out_dir}")
+    logger.info(f"Telemetry: {telemetry.summary()['totals']}")
+
+
+if __name__ == "__main__":
+    main()
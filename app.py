@@ -4,7 +4,7 @@ import os
 import json
 import logging
 from datetime import datetime
-from PIL import Image
+from functools import partial
 import streamlit as st
 
 
@@ -14,28 +14,63 @@ logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
 
-from src.config import GOOGLE_API_KEY
-import google.generativeai as genai
-
-if not GOOGLE_API_KEY:
-    raise RuntimeError("GOOGLE_API_KEY is missing.")
-
-genai.configure(api_key=GOOGLE_API_KEY)
-logger.info("Gemini API key loaded ✔ (hidden)")
+from src.config import PLANNER_MODE
+from src.backends import get_backend
 
 
 # Import Agents & Utilities
 
 from agents.planner_agent import make_plan
-from agents.perception_agent import annotate_image
-from agents.correction_agent import correct_annotation
+import agents.perception_agent as perception_agent
+import agents.correction_agent as correction_agent
 
 from src.yolo_formatter import convert_to_yolo
-from src.eval import iou
+from src.json_stream import parse_json
+from src.eval import evaluate_annotation
 from src.tools import save_text
-from src.visualize import draw_boxes
-from src.session_service import InMemorySessionService
-from src.memory_bank import recall, remember
+from src.visualize import render_batch
+from src.session_service import get_session_service
+from src.memory_bank import recall, remember, history as memory_history
+from src.jobs import JobManager
+from src import run_settings
+from src.image_handle import ImageHandle
+from src.response_cache import cache as response_cache
+from src.llm_client import client as llm_client
+from src.cascade import routing as cascade_routing
+from src.telemetry import telemetry, serve_metrics
+
+
+# Shared resources: created once per server process, not on every rerun
+
+@st.cache_resource
+def load_backend():
+    # Gemini (API key required) or the offline fake backend (LLM_BACKEND=fake)
+    backend = get_backend()
+    logger.info(f"Model backend: {backend.name} ✔")
+    # Prometheus /metrics endpoint when TELEMETRY_PORT is set
+    serve_metrics()
+    return backend
+
+
+@st.cache_resource
+def load_session_service():
+    return get_session_service()
+
+
+@st.cache_resource
+def load_job_manager():
+    return JobManager()
+
+
+@st.cache_data(show_spinner=False)
+def cached_plan(run_iou, show_boxes, auto_save, use_llm):
+    """Plan per options tuple; reruns with unchanged options don't re-plan."""
+    options = {"run_iou": run_iou, "show_boxes": show_boxes, "auto_save": auto_save}
+    return make_plan("data/ui/sample", options, use_llm=use_llm)
+
+
+backend = load_backend()
+jobs = load_job_manager()
 
 
 # Streamlit Setup
@@ -51,17 +86,55 @@ mode = st.sidebar.radio("Mode", ["Single Image", "Batch"])
 show_boxes = st.sidebar.checkbox("Show Bounding Boxes", True)
 run_iou = st.sidebar.checkbox("Compute IoU (gt_sample.json required)", True)
 auto_save = st.sidebar.checkbox("Auto-Save Results", True)
+use_llm_planner = st.sidebar.checkbox("Use LLM Planner", PLANNER_MODE == "llm")
+# Run settings belong to this session: they are snapshotted into each job
+# (src/run_settings.py) instead of being written to module globals
+use_cache = st.sidebar.checkbox("Use Response Cache", response_cache.enabled)
+tiling = st.sidebar.checkbox(
+    "Tiled inference for large images", perception_agent.TILING,
+    help="Annotate overlapping tiles of high-resolution images and merge the boxes (more calls, better recall on small objects).",
+)
+cascade = st.sidebar.checkbox(
+    "Model cascade", perception_agent.CASCADE,
+    help="A cheap model annotates first; images that fail the local checks go to the strong model.",
+)
+_methods = ["none", "nms", "soft_nms", "wbf"]
+postprocess = st.sidebar.selectbox(
+    "Duplicate box removal", _methods,
+    index=_methods.index(correction_agent.POSTPROCESS) if correction_agent.POSTPROCESS in _methods else 1,
+)
 
 st.sidebar.markdown("---")
 st.sidebar.header("Memory")
 if st.sidebar.button("Show last IoU"):
     st.sidebar.write(recall("last_iou"))
+if st.sidebar.button("Show IoU history"):
+    st.sidebar.json(memory_history("last_iou", limit=10))
+if st.sidebar.button("Show cache stats"):
+    st.sidebar.json(response_cache.stats())
+if st.sidebar.button("Show API client stats"):
+    st.sidebar.json(llm_client.stats())
+if st.sidebar.button("Show telemetry"):
+    st.sidebar.json(telemetry.summary())
+if st.sidebar.button("Show job stats"):
+    st.sidebar.json(jobs.stats())
+if st.sidebar.button("Show cascade routing"):
+    st.sidebar.json(cascade_routing.snapshot())
 
 # Create Session
 
-session = InMemorySessionService()
-sid = session.create_session("streamlit_user")
-session.add_event(sid, "UI session started")
+# One bounded, process-wide service; one session per browser session
+# (reruns reuse it instead of creating a new one every time)
+session = load_session_service()
+if "sid" not in st.session_state:
+    st.session_state.sid = session.create_session("streamlit_user")
+    session.add_event(st.session_state.sid, "UI session started")
+sid = st.session_state.sid
+
+
+def session_events():
+    snapshot = session.get_session(sid)
+    return snapshot["events"] if snapshot else []
 
 
 # Layout Columns
@@ -101,8 +174,8 @@ with left:
     }
     
     try:
-        # Pass the image path (placeholder) and the dynamic options to the Planner Agent
-        plan_json = make_plan("data/ui/sample", planner_options) 
+        # Local plan by default; cached per options tuple across reruns
+        plan_json = cached_plan(run_iou, show_boxes, auto_save, use_llm_planner)
         st.json(json.loads(plan_json))
     except Exception as e:
         st.error("Planner failed.")
@@ -121,113 +194,90 @@ with right:
 
 # Helper: Process image
 
-def process_image(image_path):
-    session.add_event(sid, f"Processing {image_path}")
-
-    # 1. Perception
-    try:
-        raw = annotate_image(image_path)
-        session.add_event(sid, "Perception completed")
-    except Exception as e:
-        logger.error(f"Perception agent failed: {e}")
-        return {"error": f"Perception failed: {e}"}
-
-    
-    # 2. Correction
-    
-    try:
-        corrected = correct_annotation(image_path, raw)
-    except Exception as e:
-        logger.error(f"Correction agent failed: {e}")
-        return {"error": f"Correction failed: {e}"}
+def finish_image(handle, raw, corrected, options, sid):
+    """
+    Local stages (IoU, YOLO) for one image whose perception and
+    correction calls have already completed. Runs on the job worker thread,
+    so the sidebar options are passed in instead of read from the script.
+    handle is the shared ImageHandle, so the file is decoded at most once.
+    """
+    session.add_event(sid, f"Annotated {handle.path}")
 
     # Parse JSON safely
-    try:
-        corrected_json = json.loads(corrected)
-    except Exception:
-        import re
-        match = re.search(r"(\{[\s\S]*\})", corrected)
-        corrected_json = json.loads(match.group(0)) if match else {"objects": []}
+    corrected_json = parse_json(corrected, {"objects": []}, accept=lambda value: isinstance(value, dict))
 
     # 3. IoU Evaluation
     iou_score = None
-    if run_iou and os.path.exists("annotations/gt_sample.json"):
+    metrics = None
+    if options["run_iou"] and os.path.exists("annotations/gt_sample.json"):
         try:
-            # Open image to get dimensions for normalized -> pixel conversion
-            img = Image.open(image_path)
-            W, H = img.size
-            
             with open("annotations/gt_sample.json") as f:
                 gt = json.load(f)
-                
-            # PRED: Extract normalized coordinates
-            x_norm, y_norm, w_norm, h_norm = corrected_json["objects"][0]["bbox_norm"]
-            
-            # PRED: Convert normalized prediction (x_norm, y_norm, w_norm, h_norm) to pixel (x, y, w, h)
-            pred = [
-                x_norm * W, 
-                y_norm * H, 
-                w_norm * W, 
-                h_norm * H
-            ]
-
-            # GT: Assuming ground truth is in pixel format [x, y, w, h] as expected by eval.py:iou()
-            truth = gt["objects"][0]["bbox"]
-            
-            iou_score = iou(pred, truth)
+
+            # All predictions vs all GT boxes (label-aware Hungarian matching);
+            # normalized predictions are converted with the header size
+            with telemetry.span("iou", image=handle.name):
+                metrics = evaluate_annotation(corrected_json, gt, handle.size)
+            iou_score = metrics["mean_iou"]
             
             remember("last_iou", iou_score)
-            session.add_event(sid, f"IoU: {iou_score}")
+            session.add_event(
+                sid, f"IoU: {iou_score} (P={metrics['precision']}, R={metrics['recall']})"
+            )
         except Exception as e:
             logger.error(f"IoU failed: {e}")
 
     # 4. YOLO Conversion
     try:
-        yolo_txt = convert_to_yolo(json.dumps(corrected_json), image_path)
+        with telemetry.span("yolo", image=handle.name):
+            yolo_txt = convert_to_yolo(json.dumps(corrected_json))
     except Exception as e:
         logger.error("YOLO conversion failed.")
         yolo_txt = ""
 
-    # 5. Visualization
-    boxed = None
-    if show_boxes:
-        try:
-            boxed = draw_boxes(image_path, corrected_json)
-        except Exception:
-            logger.warning("Box drawing failed.")
-
-    # 6. Save
-    base = os.path.splitext(os.path.basename(image_path))[0]
-    if auto_save:
-        os.makedirs("annotations", exist_ok=True)
-        save_text(f"annotations/{base}_raw.json", raw)
-        save_text(f"annotations/{base}_corrected.json", json.dumps(corrected_json, indent=2))
-        save_text(f"annotations/{base}.txt", yolo_txt)
+    # 5. Visualization: thumbnails are rendered after the batch (render_batch),
+    #    so no full-size annotated copy is kept per image
 
     return {
         "raw": raw,
         "corrected": corrected_json,
         "iou": iou_score,
+        "metrics": metrics,
         "yolo": yolo_txt,
-        "image": boxed
     }
 
 
+def save_image(handle, result, options):
+    """
+    6. Save: writes one image's outputs. The job runs it for fresh and
+    result-cache hits alike, so auto_save doesn't depend on the cache.
+    """
+    if not options["auto_save"]:
+        return
+    base = os.path.splitext(handle.name)[0]
+    with telemetry.span("save", image=handle.name):
+        os.makedirs("annotations", exist_ok=True)
+        save_text(f"annotations/{base}_raw.json", result["raw"])
+        save_text(f"annotations/{base}_corrected.json", json.dumps(result["corrected"], indent=2))
+        save_text(f"annotations/{base}.txt", result["yolo"])
+
+
 # RUN PIPELINE
 
 if run_btn:
-    results = []
+    images = []
     
     if mode == "Single Image":
         if uploaded:
             img_path = f"data/ui/{uploaded.name}"
+            data = bytes(uploaded.getbuffer())
             with open(img_path, "wb") as f:
-                f.write(uploaded.getbuffer())
-            results.append((img_path, process_image(img_path)))
+                f.write(data)
+            # Keep the uploaded bytes in the handle: no re-read from disk
+            images.append(ImageHandle(img_path, data=data))
 
         elif sample != "-- none --":
-            img_path = os.path.join("data/ui", sample)
-            results.append((img_path, process_image(img_path)))
+            images.append(os.path.join("data/ui", sample))
 
         else:
             st.error("Upload or select an image to run.")
@@ -235,46 +285,140 @@ if run_btn:
         if uploaded:
             for f in uploaded:
                 img_path = f"data/ui/{f.name}"
+                data = bytes(f.getbuffer())
                 with open(img_path, "wb") as out:
-                    out.write(f.getbuffer())
-                results.append((img_path, process_image(img_path)))
+                    out.write(data)
+                images.append(ImageHandle(img_path, data=data))
         elif sample != "-- none --":
-            img_path = os.path.join("data/ui", sample)
-            results.append((img_path, process_image(img_path)))
+            images.append(os.path.join("data/ui", sample))
         else:
             st.error("Upload or select images for batch mode.")
 
-    
+    if images:
+        options = {"run_iou": run_iou, "auto_save": auto_save}
+        settings = run_settings.snapshot(tiling=tiling, cascade=cascade, postprocess=postprocess,
+                                         use_cache=use_cache)
+        # Everything that changes an image's result; part of the result-cache key
+        settings_key = f"{run_iou}|{tiling}|{cascade}|{postprocess}"
+        job_id = jobs.submit(images, partial(finish_image, options=options, sid=sid), settings_key,
+                             save=partial(save_image, options=options), settings=settings)
+        session.add_event(sid, f"Job {job_id} started for {len(images)} image(s)")
+        # Kept in the URL too, so a browser refresh reattaches to the running job
+        st.session_state.job_id = job_id
+        st.query_params["job"] = job_id
+
+
+# JOB PROGRESS (polled; the job itself runs on a background worker)
+
+job_id = st.session_state.get("job_id") or st.query_params.get("job")
+
+
+@st.fragment(run_every=1.0)
+def job_progress(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        st.warning("Job not found (the server may have restarted).")
+        return
+    snap = job.snapshot()
+    if job.active:
+        st.progress(snap["done"] / max(1, snap["total"]),
+                    text=f"Annotating {snap['done']}/{snap['total']} ({snap['elapsed']}s)")
+        # Boxes streamed in for the images still being annotated
+        for name, boxes in snap["live"].items():
+            labels = ", ".join(str(b.get("label", "?")) for b in boxes[:8])
+            st.caption(f"{name}: {len(boxes)} box(es) so far — {labels}{'…' if len(boxes) > 8 else ''}")
+        if st.button("Cancel job"):
+            jobs.cancel(job_id)
+    elif st.session_state.get("shown_job") != job_id:
+        # Finished since the last full run: rerun the page once to show the results
+        st.session_state.shown_job = job_id
+        st.rerun(scope="app")
+
+
+def show_results(snap):
+    results = snap["results"]
+    if snap["error"]:
+        st.error(f"Job failed: {snap['error']}")
+    if not results:
+        return
+    st.info(
+        f"Job {snap['status']} in {snap['elapsed']}s: LLM correction (slow path) used for "
+        f"{snap['slow']} of {len(results)} image(s), {snap['cached']} served from cache, "
+        f"{snap['duplicates']} near-duplicate(s) reused another image's boxes."
+    )
+
     # DISPLAY RESULTS
-    
-    for img_path, res in results:
-        with st.expander(f"Results — {os.path.basename(img_path)}", expanded=True):
+
+    previews = {}  # result index -> placeholder filled once its thumbnail is rendered
+    for i, (img_path, res) in enumerate(results):
+        with st.expander(f"Results — {os.path.basename(img_path)}", expanded=len(results) <= 10):
             if "error" in res:
                 st.error(res["error"])
                 continue
 
+            if res.get("duplicate_of"):
+                st.caption(f"Near-duplicate of {os.path.basename(res['duplicate_of'])}: boxes reused.")
+
             st.subheader("Corrected Annotation")
             st.json(res["corrected"])
 
-            if res["image"] is not None:
+            if show_boxes:
                 st.subheader("Annotated Image")
-                st.image(res["image"], use_container_width=True)
+                previews[i] = st.empty()
+                previews[i].caption("Rendering preview…")
 
             st.subheader("YOLO Output")
             st.code(res["yolo"])
 
             if res["iou"] is not None:
-                st.success(f"IoU: {res['iou']}")
-
-    session_box.text("\n".join([f"{e['ts']}: {e['event']}" 
-                                for e in session.get_session(sid)["events"]]))
-
-    st.success("Done ✔")
+                m = res["metrics"]
+                st.success(
+                    f"Mean IoU: {res['iou']} | Precision: {m['precision']} | "
+                    f"Recall: {m['recall']} ({m['tp']} TP, {m['fp']} FP, {m['fn']} FN)"
+                )
+
+            if res.get("upload"):
+                up = res["upload"]
+                st.caption(
+                    f"Upload: {up['orig_bytes']:,} → {up['sent_bytes']:,} bytes "
+                    f"({up['saved_bytes']:,} saved, {up['sent_size'][0]}×{up['sent_size'][1]})"
+                )
+
+    # Thumbnails are rendered on a process pool and shown as each one
+    # finishes; they are kept per job, so reruns don't render them again
+    if st.session_state.get("previews_job") != snap["id"]:
+        st.session_state.previews_job = snap["id"]
+        st.session_state.previews = {}
+    rendered = st.session_state.previews
+    for i, placeholder in previews.items():
+        if i in rendered:
+            placeholder.image(rendered[i], use_container_width=True)
+    todo = [(i, results[i][0], results[i][1]["corrected"]) for i in previews if i not in rendered]
+    if todo:
+        with telemetry.span("visualize", images=len(todo)):
+            for i, preview, error in render_batch(todo):
+                if preview is None:
+                    previews[i].warning(f"Preview failed: {error}")
+                else:
+                    rendered[i] = preview
+                    previews[i].image(preview, use_container_width=True)
+
+
+if job_id:
+    job_progress(job_id)
+    job = jobs.get(job_id)
+    if job is not None and not job.active:
+        st.session_state.shown_job = job_id
+        show_results(job.snapshot())
+        st.success("Done ✔")
+
+session_box.text("\n".join([f"{e['ts']}: {e['event']}"
+                            for e in session_events()]))
 
 # VIEW SESSION LOGS
 
 with st.expander("Session Log"):
-    for e in session.get_session(sid)["events"]:
+    for e in session_events():
         st.write(f"- {e['ts']}: {e['event']}")
 
 
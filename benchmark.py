@@ -0,0 +1,79 @@
+# benchmark.py — per-stage latency / throughput benchmark (offline fake backend)
+#
+# Usage:
+#   python benchmark.py --sizes 640x480 1920x1080 --concurrency 1 4 16 --images 64 \
+#       --out benchmarks/results.json [--baseline benchmarks/previous.json]
+#
+# Reports p50/p95/p99 per stage (ms), images/sec and peak RSS for every
+# (image size, concurrency) combination. No API key is needed; model calls
+# go to the fake backend with the given latency, so the numbers isolate
+# the pipeline's own overhead and scheduling.
+
+import argparse
+import json
+import logging
+import os
+from datetime import datetime
+
+from src.benchmark import STAGES, compare, run_suite
+
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def parse_size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage pipeline benchmark against a fake model backend")
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[(640, 480), (1920, 1080)],
+                        help="image sizes as WxH")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--images", type=int, default=32, help="synthetic images per run")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency mean (s)")
+    parser.add_argument("--latency-sigma", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake 503 rate")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fake 429 rate")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--llm-planner", action="store_true", help="time the LLM planner instead of the local one")
+    parser.add_argument("--cascade", action="store_true", help="perception through the cheap/strong model cascade")
+    parser.add_argument("--out", default="benchmarks/results.json", help="JSON report path")
+    parser.add_argument("--baseline", default=None, help="earlier report to compare against")
+    args = parser.parse_args()
+
+    backend = {
+        "latency_mean": args.latency,
+        "latency_sigma": args.latency_sigma,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "seed": args.seed,
+    }
+    report = run_suite(args.sizes, args.concurrency, args.images, backend,
+                       use_llm_planner=args.llm_planner, log=logger.info, cascade=args.cascade)
+    report["timestamp"] = datetime.now().isoformat()
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f))
+        for row in report["comparison"]:
+            worst = max(((v, k) for k, v in row.items() if k.endswith("_p95_ratio")), default=None)
+            if worst is None:
+                continue  # no stage timed in both reports
+            logger.info(f"{row['image_size'][0]}x{row['image_size'][1]} c={row['concurrency']}: "
+                        f"throughput x{row.get('throughput_ratio')}, worst p95 {worst[1]} x{worst[0]}")
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for run in report["runs"]:
+        W, H = run["image_size"]
+        stages = ", ".join(f"{s} {run['stages'][s].get('p50')}/{run['stages'][s].get('p95')}" for s in STAGES)
+        logger.info(f"{W}x{H} c={run['concurrency']} p50/p95 ms: {stages}")
+    logger.info(f"Report saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
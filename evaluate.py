@@ -0,0 +1,136 @@
+# evaluate.py — dataset-level mAP over a directory of predictions
+#
+# Usage:
+#   python evaluate.py --pred annotations --gt data/gt --images data/ui --out annotations/eval_report.json
+#
+# For every GT file <name>.json the matching prediction is
+# <name>_corrected.json or <name>.json in --pred. Predictions use
+# normalized "bbox_norm"; GT may use "bbox_norm" or pixel "bbox"
+# (pixel GT needs "width"/"height" in the file or the image in --images).
+
+import argparse
+import json
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+from src.eval import MAPAccumulator
+
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def iter_pairs(gt_dir, pred_dir):
+    """Yields (stem, gt_path, pred_path | None) one file at a time."""
+    with os.scandir(gt_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".json"):
+                continue
+            stem = entry.name[:-5]
+            pred_path = None
+            for name in (f"{stem}_corrected.json", f"{stem}.json"):
+                candidate = os.path.join(pred_dir, name)
+                if os.path.exists(candidate):
+                    pred_path = candidate
+                    break
+            yield stem, entry.path, pred_path
+
+
+def image_size(gt, stem, images_dir):
+    """(W, H) from the GT file, or from the image header in images_dir."""
+    if "width" in gt and "height" in gt:
+        return gt["width"], gt["height"]
+    if "image_size" in gt:
+        return tuple(gt["image_size"])
+    if images_dir:
+        for ext in IMAGE_EXTS:
+            path = os.path.join(images_dir, stem + ext)
+            if os.path.exists(path):
+                with Image.open(path) as img:
+                    return img.size
+    return None
+
+
+def to_normalized(objects, size):
+    """Boxes of GT objects as normalized [x, y, w, h] rows."""
+    boxes = []
+    for obj in objects:
+        if "bbox_norm" in obj:
+            boxes.append(obj["bbox_norm"])
+        elif "bbox" in obj:
+            if size is None:
+                raise ValueError("pixel GT box but image size unknown")
+            W, H = size
+            x, y, w, h = obj["bbox"]
+            boxes.append([x / W, y / H, w / W, h / H])
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def evaluate_dir(gt_dir, pred_dir, images_dir=None):
+    acc = MAPAccumulator()
+    missing, skipped = 0, 0
+
+    for stem, gt_path, pred_path in iter_pairs(gt_dir, pred_dir):
+        with open(gt_path, "r", encoding="utf-8") as f:
+            gt = json.load(f)
+        gt_objs = [o for o in gt.get("objects", []) if "bbox" in o or "bbox_norm" in o]
+
+        preds = []
+        if pred_path is None:
+            missing += 1
+        else:
+            with open(pred_path, "r", encoding="utf-8") as f:
+                preds = [o for o in json.load(f).get("objects", []) if "bbox_norm" in o]
+
+        try:
+            gt_boxes = to_normalized(gt_objs, image_size(gt, stem, images_dir))
+        except ValueError as e:
+            logger.warning(f"{stem}: {e} → skipped")
+            skipped += 1
+            continue
+
+        # Gemini gives no confidence; use it when present, else 1.0
+        acc.add_image(
+            [o["bbox_norm"] for o in preds],
+            [o.get("label", "") for o in preds],
+            [o.get("score", o.get("confidence", 1.0)) for o in preds],
+            gt_boxes,
+            [o.get("label", "") for o in gt_objs],
+        )
+
+    report = acc.summary()
+    report.update(missing_predictions=missing, skipped=skipped)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dataset-level mAP@0.5 and mAP@0.5:0.95")
+    parser.add_argument("--pred", default="annotations", help="directory of prediction JSON files")
+    parser.add_argument("--gt", required=True, help="directory of ground-truth JSON files")
+    parser.add_argument("--images", default=None, help="image directory (for pixel GT without size)")
+    parser.add_argument("--out", default="annotations/eval_report.json", help="JSON report path")
+    args = parser.parse_args()
+
+    report = evaluate_dir(args.gt, args.pred, args.images)
+    report.update(
+        timestamp=datetime.now().isoformat(),
+        pred_dir=args.pred,
+        gt_dir=args.gt,
+    )
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    logger.info(f"{report['images']} images: mAP@0.5 = {report['map50']:.4f}, "
+                f"mAP@0.5:0.95 = {report['map50_95']:.4f}")
+    logger.info(f"Report saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# export_yolo.py — build a YOLO training dataset from annotated images
+#
+# Usage:
+#   python export_yolo.py --images data/images --annotations annotations/batch --out datasets/annotator
+#
+# Reads <stem>_corrected.json next to each image's relative path in
+# --annotations (the layout written by `main.py --input`), then writes
+# images/ + labels/ with a deterministic train/val split, classes.txt
+# and data.yaml. Class ids from an existing classes.txt are kept.
+
+import argparse
+import logging
+
+from src.memory_bank import remember
+from src.yolo_export import ClassMap, export_dataset, iter_annotated
+
+logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export annotations as a YOLO dataset")
+    parser.add_argument("--images", required=True, help="image directory")
+    parser.add_argument("--annotations", default="annotations/batch", help="directory with *_corrected.json")
+    parser.add_argument("--out", default="datasets/annotator", help="dataset output directory")
+    parser.add_argument("--val", type=float, default=0.2, help="validation fraction")
+    parser.add_argument("--classes", default=None, help="optional classes.txt fixing the class order")
+    args = parser.parse_args()
+
+    class_map = ClassMap.load(args.classes) if args.classes else None
+    summary = export_dataset(
+        iter_annotated(args.images, args.annotations),
+        args.out,
+        val_fraction=args.val,
+        class_map=class_map,
+    )
+
+    remember("last_export", summary)
+    logger.info(f"Exported {summary['train']} train / {summary['val']} val images, "
+                f"{summary['objects']} objects, {len(summary['classes'])} classes → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
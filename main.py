@@ -1,22 +1,31 @@
 
+import argparse
 import json
 import logging
+import sys
+from collections import Counter
 from datetime import datetime
-from PIL import Image
 
-from src.config import GOOGLE_API_KEY
-import google.generativeai as genai
+from tqdm import tqdm
+
+from src.backends import get_backend
 
 # Agents & utilities
+import agents.perception_agent as perception_agent
 from agents.perception_agent import annotate_image
-from agents.correction_agent import correct_annotation
+from agents.correction_agent import correct_annotation, local_correct
 from agents.planner_agent import make_plan
 
 from src.yolo_formatter import convert_to_yolo
+from src.json_stream import parse_json
+from src.image_handle import ImageHandle
 from src.tools import save_text
 from src.session_service import InMemorySessionService
 from src.memory_bank import remember, recall
-from src.eval import iou
+from src.eval import evaluate_annotation
+from src.telemetry import telemetry
+from src.cascade import routing as cascade_routing
+from src.stream_pipeline import Manifest, iter_images, skip_done, run_stream
 
 logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
@@ -24,11 +33,82 @@ logger = logging.getLogger(__name__)
 
 #   0. Configure LLM
 
-if not GOOGLE_API_KEY:
-    raise RuntimeError("GOOGLE_API_KEY is missing.")
-
-genai.configure(api_key=GOOGLE_API_KEY)
-logger.info("API key loaded ✔")
+# Gemini (API key required) or the offline fake backend (LLM_BACKEND=fake)
+backend = get_backend()
+logger.info(f"Model backend: {backend.name} ✔")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Agentic annotation pipeline")
+    parser.add_argument("--input", help="image directory or glob (e.g. 'data/**/*.jpg'); "
+                                        "without it the single sample image is annotated")
+    parser.add_argument("--out", default="annotations/batch", help="output directory for directory mode")
+    parser.add_argument("--concurrency", type=int, default=None, help="Gemini calls in flight")
+    parser.add_argument("--no-resume", action="store_true", help="ignore the checkpoint manifest")
+    parser.add_argument("--tiled", action="store_true", help="sliced inference for large images (see TILE_* settings)")
+    parser.add_argument("--pack", type=int, default=None,
+                        help="small images per perception request (default PACK_SIZE, 1 = off)")
+    parser.add_argument("--cascade", action="store_true",
+                        help="cheap model first, strong model only when local checks fail (see CASCADE_*)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="annotate one image per group of near-duplicates (see DEDUP_DISTANCE)")
+    return parser.parse_args()
+
+
+def run_directory(args):
+    """
+    Streams every image under args.input through perception → correction →
+    YOLO. Finished images are checkpointed in <out>/manifest.jsonl, so a
+    re-run skips them without calling Gemini again.
+    """
+    manifest = Manifest(f"{args.out}/manifest.jsonl", resume=not args.no_resume)
+
+    # Only paths are listed up front (for the progress total); images are
+    # read and decoded lazily inside the pipeline window.
+    todo = list(skip_done(iter_images(args.input), manifest))
+    logger.info(f"{len(manifest.done)} image(s) already done, {len(todo)} to annotate.")
+
+    ok = failed = slow = duplicates = 0
+    try:
+        with tqdm(total=len(todo), unit="img") as bar:
+            for record in run_stream(todo, args.out, manifest, args.concurrency, args.pack,
+                                     dedup=args.dedup or None):
+                if record["status"] == "ok":
+                    ok += 1
+                    slow += record["slow_path"]
+                    duplicates += "duplicate_of" in record
+                else:
+                    failed += 1
+                    logger.warning(f"{record['rel']}: {record['error']}")
+                bar.update(1)
+                bar.set_postfix(ok=ok, failed=failed, slow=slow, dup=duplicates)
+    finally:
+        manifest.close()
+
+    summary = {
+        "input": args.input,
+        "out": args.out,
+        "timestamp": datetime.now().isoformat(),
+        "annotated": ok,
+        "failed": failed,
+        "llm_corrections": slow,
+        "duplicates": duplicates,
+    }
+    remember("last_batch", summary)
+    logger.info(f"Directory run finished: {summary}")
+    logger.info(f"Telemetry: {telemetry.summary()['totals']}")
+    if perception_agent.CASCADE:
+        logger.info(f"Cascade routing: {cascade_routing.snapshot()}")
+
+
+ARGS = parse_args()
+if ARGS.tiled:
+    perception_agent.TILING = True
+if ARGS.cascade:
+    perception_agent.CASCADE = True
+if ARGS.input:
+    run_directory(ARGS)
+    sys.exit(0)
 
 
 IMAGE_PATH = "data/sample.jpeg"
@@ -39,6 +119,10 @@ YOLO_OUT = "annotations/final.txt"
 
 
 
+# Shared image handle: read and decoded once for all stages
+image = ImageHandle(IMAGE_PATH)
+
+
 # 1. Create Session
 
 session = InMemorySessionService()
@@ -79,7 +163,10 @@ except Exception as e:
 
 try:
     session.add_event(sid, "Running perception agent…")
-    raw = annotate_image(IMAGE_PATH)
+    # Streamed: each box is logged as soon as it is complete
+    raw = annotate_image(image, on_object=lambda obj: logger.info(
+        "Stream broken, boxes so far are void" if obj is None
+        else f"Box: {obj.get('label')} {obj.get('bbox_norm', obj.get('bbox'))}"))
     save_text(RAW_OUT, raw)
     session.add_event(sid, "Perception agent completed.")
     logger.info("Perception agent output saved.")
@@ -91,19 +178,18 @@ except Exception as e:
 # 4. CORRECTION (Agent #3)
 
 try:
-    session.add_event(sid, "Running correction agent…")
-    corrected = correct_annotation(IMAGE_PATH, raw)
+    # Local repair first; the LLM correction agent is the slow path
+    corrected = local_correct(image, raw)
+    if corrected is None:
+        session.add_event(sid, "Running correction agent…")
+        corrected = correct_annotation(image, raw)
+        corrected = local_correct(image, corrected) or corrected
+        logger.info("Local repair failed → used LLM correction agent.")
+    else:
+        session.add_event(sid, "Local correction applied.")
 
 
-    try:
-        corrected_json = json.loads(corrected)
-    except Exception:
-        import re
-        match = re.search(r"(\{[\s\S]*\})", corrected)
-        if match:
-            corrected_json = json.loads(match.group(0))
-        else:
-            corrected_json = {"objects": []}
+    corrected_json = parse_json(corrected, {"objects": []}, accept=lambda value: isinstance(value, dict))
 
     save_text(CORR_OUT, json.dumps(corrected_json, indent=2))
     session.add_event(sid, "Correction completed.")
@@ -116,39 +202,27 @@ except Exception as e:
 
 # 5. EVALUATION (IoU)
 
-# Note: Ensure 'from PIL import Image' is at the top of your main.py file.
-# The IMAGE_PATH and GT_PATH variables are assumed to be defined earlier.
+# The GT_PATH variable is assumed to be defined earlier.
 
 iou_score = None
 
 try:
     if corrected_json.get("objects"):
-        # 1. Open image to get dimensions for normalized -> pixel conversion
-        img = Image.open(IMAGE_PATH)
-        W, H = img.size
-        
         with open(GT_PATH, "r") as f:
             gt = json.load(f)
 
-        # 2. PRED: Extract normalized coordinates
-        x_norm, y_norm, w_norm, h_norm = corrected_json["objects"][0]["bbox_norm"]
-        
-        # 3. PRED: Convert normalized prediction (x_norm, y_norm, w_norm, h_norm) to pixel (x, y, w, h)
-        pred_bbox = [
-            x_norm * W,
-            y_norm * H,
-            w_norm * W,
-            h_norm * H
-        ]
-
-        # 4. GT: Assuming ground truth is in pixel format [x, y, w, h] as expected by eval.py:iou()
-        # If your ground truth is also normalized, you would need to convert it here too.
-        gt_bbox = gt["objects"][0]["bbox"] 
-
-        iou_score = iou(pred_bbox, gt_bbox)
+        # Every predicted box vs every GT box (pixels, label-aware matching).
+        # Normalized predictions are converted with the header size.
+        with telemetry.span("iou", image=image.name):
+            metrics = evaluate_annotation(corrected_json, gt, image.size)
+        iou_score = metrics["mean_iou"]
+        logger.info(
+            f"Precision = {metrics['precision']:.4f}, Recall = {metrics['recall']:.4f} "
+            f"({metrics['tp']} TP, {metrics['fp']} FP, {metrics['fn']} FN)"
+        )
         session.add_event(sid, f"IoU: {iou_score}")
         remember("last_iou", iou_score)
-        logger.info(f"IoU Score = {iou_score:.4f}")
+        logger.info(f"Mean IoU = {iou_score:.4f}")
     else:
         logger.warning("No predicted objects for IoU.")
 except FileNotFoundError:
@@ -161,7 +235,8 @@ except Exception as e:
 # 6. YOLO CONVERSION
 
 try:
-    yolo_txt = convert_to_yolo(json.dumps(corrected_json), IMAGE_PATH)
+    with telemetry.span("yolo", image=image.name):
+        yolo_txt = convert_to_yolo(json.dumps(corrected_json))
     save_text(YOLO_OUT, yolo_txt)
     session.add_event(sid, "YOLO conversion completed.")
     logger.info("YOLO output saved.")
@@ -171,11 +246,17 @@ except Exception as e:
 
 
 # 7. SAVE SESSION TO MEMORY BANK
+# A compact summary: the full output is in CORR_OUT, and every run adds a row
+objects = corrected_json.get("objects", [])
 remember("last_run", {
     "session_id": sid,
     "timestamp": datetime.now().isoformat(),
-    "events": session.get_session(sid)["events"],
-    "final_output": corrected_json
+    "image": IMAGE_PATH,
+    "events": len(session.get_session(sid)["events"]),
+    "objects": len(objects),
+    "labels": dict(Counter(obj.get("label", "") for obj in objects)),
+    "iou": iou_score,
+    "output": CORR_OUT,
 })
 
 logger.info("Annotation pipeline completed successfully.")
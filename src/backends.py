@@ -0,0 +1,242 @@
+# backends.py
+#
+# Model backends the agents call through (via src/llm_client.py).
+#   LLM_BACKEND=gemini  real Gemini API (default)
+#   LLM_BACKEND=fake    offline fake with configurable latency, error rate
+#                       and synthetic boxes, for load tests and benchmarks
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from src.config import (
+    GOOGLE_API_KEY, LLM_BACKEND, FAKE_LATENCY_MEAN, FAKE_LATENCY_SIGMA,
+    FAKE_ERROR_RATE, FAKE_THROTTLE_RATE, FAKE_MAX_BOXES, FAKE_SEED, FAKE_HARD_RATE,
+)
+
+
+class GeminiBackend:
+    """google.generativeai behind the backend interface."""
+    name = "gemini"
+
+    def __init__(self, api_key=GOOGLE_API_KEY):
+        import google.generativeai as genai
+
+        if not api_key:
+            raise RuntimeError("GOOGLE_API_KEY is missing.")
+        genai.configure(api_key=api_key)
+        self._genai = genai
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model(self, model_name):
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = self._genai.GenerativeModel(model_name)
+            return self._models[model_name]
+
+    def generate(self, model_name, contents, **kwargs):
+        return self.model(model_name).generate_content(contents, **kwargs)
+
+
+class FakeAPIError(Exception):
+    """Synthetic API failure; .code mirrors the HTTP status (429 / 503)."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeResponse:
+    """
+    Quacks like a Gemini response: .text, .usage_metadata, iterable chunks.
+    chunk_delay (seconds) is slept before every chunk after the first, so a
+    streamed answer arrives piece by piece.
+    """
+
+    def __init__(self, text, prompt_tokens, chunk_size=64, chunk_delay=0.0, candidates=None):
+        self.text = text
+        texts = candidates or [text]
+        response_tokens = sum(max(1, len(t) // 4) for t in texts)
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=response_tokens,
+            total_token_count=prompt_tokens + response_tokens,
+        )
+        self.candidates = [
+            SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=t)])) for t in texts
+        ]
+        self._chunk_size = chunk_size
+        self._chunk_delay = chunk_delay
+
+    def __iter__(self):
+        for i in range(0, len(self.text), self._chunk_size):
+            if i and self._chunk_delay:
+                time.sleep(self._chunk_delay)
+            yield SimpleNamespace(text=self.text[i:i + self._chunk_size])
+
+
+class FakeBackend:
+    """
+    Offline stand-in for Gemini.
+
+    latency:   lognormal with the given mean (seconds) and sigma
+    errors:    error_rate -> 503, throttle_rate -> 429 (raised as FakeAPIError)
+    output:    synthetic normalized boxes; with a seed the boxes depend only
+               on (seed, image bytes), so runs are reproducible
+    tiers:     "lite" models answer faster, "pro" models slower; a lite
+               model guesses differently per candidate on hard_rate of the
+               images (generation_config candidate_count > 1 returns several)
+    """
+    name = "fake"
+    first_chunk_share = 0.3   # stream=True: share of the latency before the first chunk
+    model_speed = {"lite": 0.4, "pro": 2.5}   # latency factor by model-name substring
+
+    def __init__(self, latency_mean=FAKE_LATENCY_MEAN, latency_sigma=FAKE_LATENCY_SIGMA,
+                 error_rate=FAKE_ERROR_RATE, throttle_rate=FAKE_THROTTLE_RATE,
+                 max_boxes=FAKE_MAX_BOXES, seed=FAKE_SEED, hard_rate=FAKE_HARD_RATE,
+                 labels=("person", "car", "dog", "box")):
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_boxes = max_boxes
+        self.seed = seed
+        self.hard_rate = hard_rate
+        self.labels = labels
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sample_latency(self, rng):
+        if self.latency_mean <= 0:
+            return 0.0
+        # lognormal parameterized by its mean
+        mu = math.log(self.latency_mean) - self.latency_sigma ** 2 / 2
+        return rng.lognormvariate(mu, self.latency_sigma)
+
+    def _output_rng(self, contents):
+        """Boxes depend only on (seed, payload) when seeded."""
+        if self.seed is None:
+            with self._lock:
+                return random.Random(self._rng.random())
+        h = hashlib.sha256(str(self.seed).encode())
+        for part in contents:
+            if isinstance(part, dict) and "data" in part:
+                h.update(part["data"])
+            elif isinstance(part, str):
+                h.update(part.encode("utf-8"))
+        return random.Random(h.hexdigest())
+
+    def generate(self, model_name, contents, **kwargs):
+        if not isinstance(contents, (list, tuple)):
+            contents = [contents]
+
+        # Latency and failures come from one seeded stream, so a retry
+        # of the same request gets a fresh draw
+        with self._lock:
+            self.calls += 1
+            latency = self._sample_latency(self._rng)
+            roll = self._rng.random()
+
+        # Longer answers take longer: each extra image in a packed request
+        # adds a fraction of the base latency
+        images = sum(1 for p in contents if isinstance(p, dict) and "data" in p)
+        latency *= 1 + 0.2 * max(0, images - 1)
+        latency *= next((f for tier, f in self.model_speed.items() if tier in model_name), 1.0)
+        stream = kwargs.get("stream", False)
+        time.sleep(latency * self.first_chunk_share if stream else latency)
+        if roll < self.throttle_rate:
+            raise FakeAPIError(429, "fake: resource exhausted")
+        if roll < self.throttle_rate + self.error_rate:
+            raise FakeAPIError(503, "fake: service unavailable")
+
+        prompt = contents[0] if isinstance(contents[0], str) else ""
+        cheap = "lite" in model_name
+        n = max(1, int((kwargs.get("generation_config") or {}).get("candidate_count", 1)))
+        # every candidate starts from the same per-request state, so an
+        # easy image gets the same boxes from every tier
+        state = self._output_rng(contents).getstate()
+        texts = []
+        for k in range(n):
+            rng = random.Random()
+            rng.setstate(state)
+            texts.append(self._answer(prompt, contents, rng, cheap, k))
+        text = texts[0]
+        prompt_tokens = sum(len(p) // 4 if isinstance(p, str) else 258 for p in contents)
+        if not stream:
+            return FakeResponse(text, prompt_tokens, candidates=texts)
+        # the rest of the latency is spread over the chunks
+        chunks = max(1, -(-len(text) // 64))
+        delay = latency * (1 - self.first_chunk_share) / max(1, chunks - 1)
+        return FakeResponse(text, prompt_tokens, chunk_delay=delay)
+
+    def _answer(self, prompt, contents, rng, cheap=False, candidate=0):
+        # Planner: echo the allowed steps in order
+        if "Planner Agent" in prompt:
+            match = re.search(r"\[[^\]]*\]", prompt.split("order them logically", 1)[-1])
+            steps = json.loads(match.group(0).replace("'", '"')) if match else []
+            return json.dumps({"plan": steps})
+
+        # Correction: return the input annotation (last text part) unchanged
+        if "Correction Agent" in prompt and isinstance(contents[-1], str):
+            return contents[-1]
+
+        # Packed perception: one section per image, each as if sent alone
+        blobs = [p for p in contents if isinstance(p, dict) and "data" in p]
+        if "several images" in prompt:
+            return json.dumps({"images": [
+                {"index": i, "objects": self._boxes(self._output_rng([blob]))}
+                for i, blob in enumerate(blobs)
+            ]})
+
+        # Perception: synthetic boxes
+        objects = self._boxes(rng)
+        if cheap:
+            if rng.random() < self.hard_rate:
+                # hard image: the cheap tier guesses, differently per candidate
+                objects = self._boxes(random.Random(f"{rng.random()}:{candidate}"))
+            else:
+                jitter = random.Random(candidate)
+                for obj in objects:
+                    obj["bbox_norm"] = [round(min(1.0, max(0.0, v + jitter.uniform(-0.005, 0.005))), 4)
+                                        for v in obj["bbox_norm"]]
+        return json.dumps({"objects": objects})
+
+    def _boxes(self, rng):
+        objects = []
+        for _ in range(rng.randint(1, max(1, self.max_boxes))):
+            w, h = rng.uniform(0.05, 0.4), rng.uniform(0.05, 0.4)
+            x, y = rng.uniform(0, 1 - w), rng.uniform(0, 1 - h)
+            objects.append({
+                "label": rng.choice(self.labels),
+                "bbox_norm": [round(x, 4), round(y, 4), round(w, 4), round(h, 4)],
+            })
+        return objects
+
+
+BACKENDS = {"gemini": GeminiBackend, "fake": FakeBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Process-wide backend selected by LLM_BACKEND (created on first use)."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = BACKENDS[LLM_BACKEND]()
+        return _backend
+
+
+def set_backend(backend):
+    """Swaps the process-wide backend (benchmarks, load tests)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    return backend
@@ -0,0 +1,300 @@
+# batch_runner.py
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import agents.perception_agent as perception_agent
+from agents.perception_agent import annotate_image, annotate_packed
+from agents.correction_agent import correct_annotation, local_correct
+from src import run_settings
+from src.config import BATCH_CONCURRENCY, PACK_SIZE, PACK_MAX_SIDE, DEDUP_ENABLED
+from src.dedup import Deduper
+from src.image_handle import as_handle
+
+
+def _offload(loop, executor, settings, fn, *args):
+    """run_in_executor under the run's settings (worker threads don't inherit the context)."""
+    return loop.run_in_executor(executor, run_settings.call, settings, fn, *args)
+
+
+async def _annotate_one(loop, executor, semaphore, image, on_object=None, settings=None):
+    """
+    Runs perception -> (local repair | correction agent) for a single image.
+    A semaphore slot is held only while a Gemini call is in flight,
+    so the limit applies to requests, not to images.
+    Errors are captured in the result instead of being raised.
+    """
+    handle = as_handle(image)
+    result = {"image": handle.path, "handle": handle}
+    on_box = partial(on_object, handle) if on_object is not None else None
+    try:
+        async with semaphore:
+            raw = await _offload(loop, executor, settings, annotate_image, handle, on_box)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return [result]
+    return [await _correct_one(loop, executor, semaphore, handle, raw, settings)]
+
+
+async def _annotate_pack(loop, executor, semaphore, handles, settings=None):
+    """Perception for several small images in one request, then per-image correction."""
+    try:
+        async with semaphore:
+            raws = await _offload(loop, executor, settings, annotate_packed, handles)
+    except Exception as e:
+        return [{"image": h.path, "handle": h, "error": f"{type(e).__name__}: {e}"} for h in handles]
+    return list(await asyncio.gather(*(
+        _correct_one(loop, executor, semaphore, handle, raw, settings) for handle, raw in zip(handles, raws)
+    )))
+
+
+async def _correct_one(loop, executor, semaphore, handle, raw, settings=None):
+    result = {"image": handle.path, "handle": handle, "raw": raw}
+    try:
+        # Local repair first; the correction agent only runs when it fails
+        corrected = await _offload(loop, executor, settings, local_correct, handle, raw)
+        result["slow_path"] = corrected is None
+        if corrected is None:
+            async with semaphore:
+                llm_out = await _offload(loop, executor, settings, correct_annotation, handle, raw)
+            # Clamp / clean the LLM answer as well when possible
+            corrected = await _offload(loop, executor, settings, local_correct, handle, llm_out) or llm_out
+        result["corrected"] = corrected
+
+        # Bytes saved by preprocessing (None when every call was a cache hit)
+        result["upload"] = handle.upload_stats
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def _small(handle):
+    try:
+        return max(handle.upload_size) <= PACK_MAX_SIDE
+    except Exception:
+        return False  # unreadable: goes single, so the error is reported per image
+
+
+_END = object()
+
+
+class _Ahead:
+    """
+    Bounded thread stage: a background thread iterates `items` and runs
+    prepare(item) on each (disk reads, hashing), staying at most `depth`
+    items ahead of the event loop. The loop only awaits get(), so
+    per-image work never blocks it. get() returns _END when done and
+    re-raises an error from the input iterable.
+    """
+
+    def __init__(self, loop, items, prepare, depth):
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=depth)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(items, prepare), daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop).result()
+
+    def _run(self, items, prepare):
+        try:
+            for item in items:
+                if self._closed.is_set():
+                    return
+                self._put(prepare(item))
+            self._put(_END)
+        except Exception as e:
+            if not self._closed.is_set():
+                self._put(e)
+
+    async def get(self):
+        item = await self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        """Stops the thread after its current item (frees the queue it may wait on)."""
+        self._closed.set()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+
+def _prepare(image, gate, pack):
+    """
+    Thread-stage work per input image: the handle, its hash (with dedup)
+    and whether it fits a packed request (sized from the header only).
+    """
+    handle = as_handle(image)
+    h = gate.hash(handle) if gate else None
+    return handle, h, pack > 1 and _small(handle)
+
+
+async def _units(ahead, gate, pack):
+    """
+    Groups the prepared input into work units: runs of up to `pack` small
+    images (upload side <= PACK_MAX_SIDE) become one packed request,
+    everything else stays single. Near-duplicates held by the dedup gate
+    are left out. Order within the input is otherwise preserved.
+    """
+    group = []
+    while (item := await ahead.get()) is not _END:
+        handle, h, small = item
+        if gate is not None and gate.admit(handle, h) is None:
+            continue
+        if small:
+            group.append(handle)
+            if len(group) >= pack:
+                yield group
+                group = []
+        else:
+            yield [handle]
+    if group:
+        yield group
+
+
+async def iter_batch(image_paths, concurrency=None, pack=None, dedup=None, on_object=None, cancel=None,
+                     settings=None):
+    """
+    Async generator that yields one result dict per image in COMPLETION order:
+        {"image": path, "handle": ImageHandle, "raw": str, "corrected": str,
+         "slow_path": bool, "upload": dict | None}
+        {"image": path, "handle": ImageHandle, "error": str}   # failed image, batch keeps going
+
+    image_paths may be any iterable of paths or ImageHandles (including a
+    generator). The handle is passed on so downstream stages reuse the
+    decoded image; call handle.release() once an image is finished.
+    Only a window of 2 * concurrency requests is scheduled at a time.
+    pack > 1 (default PACK_SIZE) sends up to `pack` small images per
+    perception request (agents/perception_agent.annotate_packed). Packing
+    is off while the model cascade is on: packed answers can't be checked
+    and routed per image.
+    dedup (default DEDUP_ENABLED) annotates one image per group of
+    near-duplicates; the others reuse its result and carry "duplicate_of"
+    (src/dedup.py).
+    on_object(handle, obj) streams perception and receives every box as
+    soon as it is complete, before the image's result (called from worker
+    threads; packed requests don't stream). obj None means the stream
+    broke: drop that image's boxes so far, its retry sends them again.
+    cancel (threading.Event) is checked before every unit is scheduled:
+    once set, only the requests already in flight finish.
+    settings (src/run_settings.snapshot) are the run settings every agent
+    call runs under; None keeps the process defaults.
+    """
+    concurrency = max(1, concurrency or BATCH_CONCURRENCY)
+    pack = PACK_SIZE if pack is None else pack
+    if (settings or {}).get("cascade", perception_agent.CASCADE):
+        pack = 1
+    dedup = DEDUP_ENABLED if dedup is None else dedup
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    gate = Deduper() if dedup else None
+    # Hashing and sizing run in their own thread, a window ahead; only
+    # the index lookup (gate.admit) and grouping happen on the loop
+    ahead = _Ahead(loop, image_paths, partial(_prepare, gate=gate, pack=pack), 2 * concurrency)
+    units = _units(ahead, gate, pack)
+    pending = set()
+
+    async def schedule():
+        while len(pending) < 2 * concurrency:
+            if cancel is not None and cancel.is_set():
+                return
+            unit = await anext(units, None)
+            if unit is None:
+                return
+            if len(unit) == 1:
+                coro = _annotate_one(loop, executor, semaphore, unit[0], on_object, settings)
+            else:
+                coro = _annotate_pack(loop, executor, semaphore, unit, settings)
+            pending.add(asyncio.ensure_future(coro))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            await schedule()
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.discard(task)
+                    for result in task.result():
+                        yield result
+                        for duplicate in gate.resolve(result) if gate else ():
+                            yield duplicate
+                await schedule()
+                for duplicate in gate.drain() if gate else ():
+                    yield duplicate
+        finally:
+            await units.aclose()
+            ahead.close()
+            for task in pending:
+                task.cancel()
+
+
+def run_batch(image_paths, concurrency=None, on_result=None):
+    """
+    Synchronous entry point for scripts and Streamlit.
+    on_result(result) is called as soon as each image finishes, so downstream
+    stages (IoU, YOLO, visualization) can start before the batch is done.
+    Returns all results in completion order.
+    """
+    async def _run():
+        results = []
+        async for result in iter_batch(image_paths, concurrency):
+            if on_result is not None:
+                on_result(result)
+            results.append(result)
+        return results
+
+    return asyncio.run(_run())
+
+
+def stream_batch(image_paths, concurrency=None, buffer=None, pack=None, dedup=None, on_object=None,
+                 cancel=None, settings=None):
+    """
+    Synchronous generator over iter_batch for generator pipelines.
+    The event loop runs in a background thread; results are handed over
+    through a bounded queue, so a slow consumer applies backpressure
+    instead of letting results pile up in memory.
+    """
+    concurrency = max(1, concurrency or BATCH_CONCURRENCY)
+    results = queue.Queue(maxsize=buffer or 2 * concurrency)
+    done = object()
+    stop = threading.Event()
+
+    async def _produce():
+        loop = asyncio.get_running_loop()
+        agen = iter_batch(image_paths, concurrency, pack, dedup, on_object, cancel, settings)
+        try:
+            async for result in agen:
+                await loop.run_in_executor(None, results.put, result)
+                if stop.is_set():
+                    break
+        finally:
+            await agen.aclose()
+
+    def _run():
+        try:
+            asyncio.run(_produce())
+        except Exception as e:
+            results.put({"image": None, "error": f"{type(e).__name__}: {e}"})
+        finally:
+            results.put(done)
+
+    worker = threading.Thread(target=_run, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        # consumer stopped early: let the producer finish its current item
+        stop.set()
+        while worker.is_alive():
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
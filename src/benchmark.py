@@ -0,0 +1,252 @@
+# benchmark.py
+#
+# Per-stage latency / throughput benchmark of the annotation pipeline
+# against the offline fake backend (see src/backends.py):
+#
+#   planner -> perception -> correction -> iou -> yolo -> visualize -> save
+#
+# Every (image size, concurrency) configuration runs in a fresh spawned
+# process, so its peak RSS is not inflated by the runs before it.
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+STAGES = ["planner", "perception", "correction", "iou", "yolo", "visualize", "save"]
+PERCENTILES = (50, 95, 99)
+
+
+def make_images(directory, count, size, seed=0):
+    """Writes `count` synthetic JPEGs of size (W, H): noise plus a few shapes."""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    W, H = size
+    paths = []
+    for i in range(count):
+        # low-res noise upscaled, so the JPEG size is realistic (not pure noise)
+        base = np_rng.integers(0, 256, size=(max(1, H // 16), max(1, W // 16), 3), dtype=np.uint8)
+        img = Image.fromarray(base).resize((W, H), Image.BILINEAR)
+        draw = ImageDraw.Draw(img)
+        for _ in range(rng.randint(1, 5)):
+            x, y = rng.randrange(W), rng.randrange(H)
+            w, h = rng.randint(W // 20 + 1, W // 3 + 1), rng.randint(H // 20 + 1, H // 3 + 1)
+            color = tuple(rng.randrange(256) for _ in range(3))
+            draw.rectangle([x, y, x + w, y + h], fill=color)
+        path = os.path.join(directory, f"bench_{i:05d}.jpg")
+        img.save(path, "JPEG", quality=90)
+        paths.append(path)
+    return paths
+
+
+def _synthetic_gt(annotation, rng):
+    """GT = predicted boxes jittered by a few percent, so matching does real work."""
+    objects = []
+    for obj in annotation.get("objects", []):
+        x, y, w, h = obj["bbox_norm"]
+        jitter = lambda v: min(1.0, max(0.0, v + rng.uniform(-0.02, 0.02)))
+        objects.append({"label": obj.get("label", ""), "bbox_norm": [jitter(x), jitter(y), w, h]})
+    return {"objects": objects}
+
+
+def _process_one(path, out_dir, options, use_llm_planner):
+    """Runs every stage for one image; returns {stage: seconds} (+ "error")."""
+    from agents.correction_agent import correct_annotation, local_correct
+    from agents.perception_agent import annotate_image
+    from agents.planner_agent import make_plan
+    from src.eval import evaluate_annotation
+    from src.image_handle import ImageHandle
+    from src.tools import save_text
+    from src.visualize import render_preview
+    from src.yolo_formatter import convert_to_yolo
+
+    timings = {}
+    handle = ImageHandle(path)
+
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            timings[stage] = time.perf_counter() - start
+
+    try:
+        timed("planner", make_plan, path, options, use_llm_planner)
+        raw = timed("perception", annotate_image, handle)
+
+        def _correct():
+            corrected = local_correct(handle, raw)
+            if corrected is None:
+                corrected = correct_annotation(handle, raw)
+                corrected = local_correct(handle, corrected) or corrected
+            return json.loads(corrected)
+
+        corrected_json = timed("correction", _correct)
+        gt = _synthetic_gt(corrected_json, random.Random(path))
+        timed("iou", evaluate_annotation, corrected_json, gt, handle.size)
+        yolo_txt = timed("yolo", convert_to_yolo, json.dumps(corrected_json))
+        preview = timed("visualize", render_preview, path, corrected_json)
+
+        def _save():
+            stem = os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0])
+            save_text(f"{stem}_corrected.json", json.dumps(corrected_json, indent=2))
+            save_text(f"{stem}.txt", yolo_txt)
+            with open(f"{stem}_preview.jpg", "wb") as f:
+                f.write(preview)
+
+        timed("save", _save)
+    except Exception as e:
+        timings["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        handle.release()
+    return timings
+
+
+def summarize(samples):
+    """p50/p95/p99/mean in milliseconds for a list of seconds."""
+    if not samples:
+        return {"count": 0}
+    arr = np.asarray(samples) * 1000.0
+    summary = {f"p{p}": round(float(np.percentile(arr, p)), 3) for p in PERCENTILES}
+    summary.update(mean=round(float(arr.mean()), 3), count=len(samples))
+    return summary
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unsupported)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_config(config):
+    """
+    One benchmark run (called in a fresh process). config keys:
+      images, concurrency, out_dir, backend (FakeBackend kwargs),
+      use_llm_planner, cascade
+    """
+    import agents.perception_agent as perception_agent
+    import src.llm_client as llm_client
+    from src.backends import FakeBackend, set_backend
+    from src.cascade import routing
+    from src.response_cache import cache
+
+    set_backend(FakeBackend(**config["backend"]))
+    cache.enabled = False  # every call must reach the backend
+    perception_agent.CASCADE = config.get("cascade", False)
+    # No rate limits: the benchmark measures the pipeline, not the quota
+    llm_client.client = llm_client.LLMClient(
+        rpm=0, tpm=0, max_concurrency=max(16, config["concurrency"]),
+        backoff_base=0.05, backoff_max=1.0,
+    )
+
+    options = {"run_iou": True, "show_boxes": True, "auto_save": True}
+    os.makedirs(config["out_dir"], exist_ok=True)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config["concurrency"]) as pool:
+        results = list(pool.map(
+            lambda p: _process_one(p, config["out_dir"], options, config["use_llm_planner"]),
+            config["images"],
+        ))
+    wall = time.perf_counter() - start
+
+    ok = [r for r in results if "error" not in r]
+    return {
+        "images": len(results),
+        "errors": len(results) - len(ok),
+        "wall_s": round(wall, 3),
+        "images_per_sec": round(len(ok) / wall, 3) if wall > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "llm": llm_client.client.stats(),
+        "routing": routing.snapshot() if perception_agent.CASCADE else None,
+        "stages": {stage: summarize([r[stage] for r in results if stage in r]) for stage in STAGES},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_suite(sizes, concurrencies, count, backend, use_llm_planner=False, work_dir=None, log=print,
+              cascade=False):
+    """
+    Runs every (size, concurrency) combination and returns the report dict.
+    sizes: list of (W, H); backend: FakeBackend keyword arguments.
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix="annotator_bench_")
+    ctx = multiprocessing.get_context("spawn")
+    runs = []
+    try:
+        for W, H in sizes:
+            images = make_images(os.path.join(work_dir, f"images_{W}x{H}"), count, (W, H))
+            for concurrency in concurrencies:
+                config = {
+                    "images": images,
+                    "concurrency": concurrency,
+                    "out_dir": os.path.join(work_dir, f"out_{W}x{H}_c{concurrency}"),
+                    "backend": backend,
+                    "use_llm_planner": use_llm_planner,
+                    "cascade": cascade,
+                }
+                with ctx.Pool(1) as pool:
+                    result = pool.apply(run_config, (config,))
+                result = {"image_size": [W, H], "concurrency": concurrency, **result}
+                runs.append(result)
+                log(f"{W}x{H} c={concurrency}: {result['images_per_sec']} img/s, "
+                    f"perception p95 {result['stages']['perception'].get('p95')} ms, "
+                    f"peak RSS {result['peak_rss_mb']} MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "images_per_run": count,
+        "backend": backend,
+        "cascade": cascade,
+        "runs": runs,
+    }
+
+
+def compare(report, baseline):
+    """
+    Per run (matched on size + concurrency): throughput and p95 ratios
+    current / baseline. > 1 on latency or < 1 on throughput is a regression.
+    """
+    key = lambda r: (tuple(r["image_size"]), r["concurrency"])
+    base = {key(r): r for r in baseline.get("runs", [])}
+    rows = []
+    for run in report["runs"]:
+        old = base.get(key(run))
+        if old is None:
+            continue
+        row = {"image_size": run["image_size"], "concurrency": run["concurrency"]}
+        if run.get("images_per_sec") and old.get("images_per_sec"):
+            row["throughput_ratio"] = round(run["images_per_sec"] / old["images_per_sec"], 3)
+        for stage in STAGES:
+            new_p95 = run["stages"].get(stage, {}).get("p95")
+            old_p95 = old["stages"].get(stage, {}).get("p95")
+            if new_p95 is not None and old_p95:
+                row[f"{stage}_p95_ratio"] = round(new_p95 / old_p95, 3)
+        rows.append(row)
+    return rows
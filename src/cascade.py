@@ -0,0 +1,121 @@
+# cascade.py
+#
+# Local quality gate for the perception cascade (agents/perception_agent):
+#
+#   cheap model, N samples -> schema / box count / box sanity / agreement
+#     -> accept (fused samples) | escalate to the strong model
+#
+# Every check runs on normalized boxes in a few microseconds; nothing
+# here calls a model.
+import threading
+from collections import Counter
+
+import numpy as np
+
+from src.config import (
+    CASCADE_MIN_BOXES, CASCADE_MAX_BOXES, CASCADE_MIN_AREA, CASCADE_MIN_AGREEMENT,
+    CASCADE_AGREEMENT_IOU,
+)
+from src.eval import iou_matrix, label_mask, match_hungarian
+from src.postprocess import fuse_annotations
+from src.yolo_formatter import repair_annotation
+
+
+def candidate_texts(response):
+    """Text of every candidate in a model response (candidate_count > 1)."""
+    texts = []
+    for candidate in getattr(response, "candidates", None) or []:
+        parts = getattr(getattr(candidate, "content", None), "parts", None) or []
+        texts.append("".join(getattr(part, "text", "") or "" for part in parts))
+    return texts or [response.text]
+
+
+def agreement(objs_a, objs_b, iou_threshold=CASCADE_AGREEMENT_IOU):
+    """F1 of a same-label one-to-one IoU matching between two samples (1.0 when both are empty)."""
+    if not objs_a and not objs_b:
+        return 1.0
+    if not objs_a or not objs_b:
+        return 0.0
+    ious = iou_matrix([o["bbox_norm"] for o in objs_a], [o["bbox_norm"] for o in objs_b])
+    ious = np.where(label_mask([o.get("label", "") for o in objs_a],
+                               [o.get("label", "") for o in objs_b]), ious, 0.0)
+    matched = len(match_hungarian(ious, iou_threshold))
+    return 2 * matched / (len(objs_a) + len(objs_b))
+
+
+def _sample_problem(data, image_size):
+    """Why one sample is unusable, or None. Returns (problem, repaired objects)."""
+    if data is None:
+        return "schema", None
+    fixed = repair_annotation(data, image_size)
+    if fixed is None:
+        return "schema", None
+    raw_objects = data.get("objects", []) if isinstance(data, dict) else data
+    objects = fixed["objects"]
+    if isinstance(raw_objects, list) and len(objects) < len(raw_objects):
+        return "schema", objects    # some boxes were unusable as returned
+    if not CASCADE_MIN_BOXES <= len(objects) <= CASCADE_MAX_BOXES:
+        return "box_count", objects
+    for obj in objects:
+        _, _, w, h = obj["bbox_norm"]
+        if w * h < CASCADE_MIN_AREA:
+            return "box_sanity", objects
+    if len(objects) > 1:
+        ious = iou_matrix([o["bbox_norm"] for o in objects], [o["bbox_norm"] for o in objects])
+        np.fill_diagonal(ious, 0.0)
+        if (ious > 0.95).any():
+            return "box_sanity", objects   # repeated boxes: a degenerate answer
+    return None, objects
+
+
+def assess(samples, image_size=None, min_agreement=CASCADE_MIN_AGREEMENT):
+    """
+    samples: parsed cheap-tier answers (dict / list / None).
+    Returns {"accept": bool, "reason": str, "agreement": float | None,
+    "annotation": fused {"objects": [...]} when accepted}.
+    """
+    repaired = []
+    for data in samples:
+        problem, objects = _sample_problem(data, image_size)
+        if problem is not None:
+            return {"accept": False, "reason": problem, "agreement": None}
+        repaired.append(objects)
+
+    score = None
+    if len(repaired) > 1:
+        score = min(agreement(repaired[0], other) for other in repaired[1:])
+        if score < min_agreement:
+            return {"accept": False, "reason": "disagreement", "agreement": round(score, 3)}
+
+    annotation = fuse_annotations([{"objects": objs} for objs in repaired]) if len(repaired) > 1 \
+        else {"objects": repaired[0]}
+    return {"accept": True, "reason": "ok", "agreement": None if score is None else round(score, 3),
+            "annotation": annotation}
+
+
+class RoutingStats:
+    """Process-wide routing counters: accepted / escalated, by reason."""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, route, reason):
+        with self._lock:
+            self._counts[(route, reason)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        accepted = sum(n for (route, _), n in counts.items() if route == "accepted")
+        return {
+            "images": total,
+            "accepted": accepted,
+            "escalated": total - accepted,
+            "accept_rate": round(accepted / total, 3) if total else None,
+            "reasons": {f"{route}:{reason}": n for (route, reason), n in sorted(counts.items())},
+        }
+
+
+routing = RoutingStats()
@@ -8,3 +8,105 @@ load_dotenv(ENV_PATH)
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+
+# Max number of Gemini calls in flight during batch runs
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# Disk cache for Gemini responses (set RESPONSE_CACHE=0 to bypass)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_MAX_MB = int(os.getenv("RESPONSE_CACHE_MAX_MB", "256"))
+RESPONSE_CACHE_MAX_AGE_DAYS = int(os.getenv("RESPONSE_CACHE_MAX_AGE_DAYS", "30"))
+
+# Planner mode: "local" (deterministic, no API call) or "llm"
+PLANNER_MODE = os.getenv("PLANNER_MODE", "local").lower()
+
+# Image preprocessing before upload (resize + re-encode, metadata stripped)
+PREPROCESS_ENABLED = os.getenv("PREPROCESS", "1") != "0"
+PREPROCESS_MAX_SIDE = int(os.getenv("PREPROCESS_MAX_SIDE", "1536"))  # 0 = no resize
+PREPROCESS_FORMAT = os.getenv("PREPROCESS_FORMAT", "JPEG").upper()  # JPEG | WEBP | PNG
+PREPROCESS_QUALITY = int(os.getenv("PREPROCESS_QUALITY", "85"))
+
+# Session service limits (long-lived Streamlit / Cloud Run processes)
+SESSION_MAX_EVENTS = int(os.getenv("SESSION_MAX_EVENTS", "200"))      # per session
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))                   # idle seconds
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+SESSION_FLUSH_DIR = os.getenv("SESSION_FLUSH_DIR", "")                # "" = no flushing
+
+# Gemini rate limits and retries (shared by all agents, see src/llm_client.py)
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))                  # requests / minute (0 = unlimited)
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))             # tokens / minute (0 = unlimited)
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1.0"))   # seconds
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "60.0"))    # seconds
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+
+# Model backend: "gemini" (real API) or "fake" (offline, for load tests)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+FAKE_LATENCY_MEAN = float(os.getenv("FAKE_LATENCY_MEAN", "0.8"))    # seconds
+FAKE_LATENCY_SIGMA = float(os.getenv("FAKE_LATENCY_SIGMA", "0.5"))  # lognormal sigma
+FAKE_ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0.0"))        # 503s
+FAKE_THROTTLE_RATE = float(os.getenv("FAKE_THROTTLE_RATE", "0.0"))  # 429s
+FAKE_MAX_BOXES = int(os.getenv("FAKE_MAX_BOXES", "5"))
+FAKE_SEED = int(os.getenv("FAKE_SEED")) if os.getenv("FAKE_SEED") else None
+FAKE_HARD_RATE = float(os.getenv("FAKE_HARD_RATE", "0.3"))     # images a "lite" model gets wrong
+
+# Telemetry: per-stage spans (JSON lines) and Prometheus metrics
+TELEMETRY_ENABLED = os.getenv("TELEMETRY", "1") != "0"
+# File exporters are opt-in, e.g. TELEMETRY_JSONL=annotations/telemetry.jsonl (git-ignored)
+TELEMETRY_JSONL = os.getenv("TELEMETRY_JSONL", "")                                   # "" = off
+TELEMETRY_JSONL_MAX_MB = float(os.getenv("TELEMETRY_JSONL_MAX_MB", "50"))            # rotated to <path>.1 beyond
+TELEMETRY_PROM_FILE = os.getenv("TELEMETRY_PROM_FILE", "")                           # "" = off
+TELEMETRY_PROM_INTERVAL = float(os.getenv("TELEMETRY_PROM_INTERVAL", "5"))          # seconds between rewrites
+TELEMETRY_PORT = int(os.getenv("TELEMETRY_PORT", "0"))                              # /metrics endpoint, 0 = off
+
+# Tiled (sliced) perception for high-resolution images
+TILING_ENABLED = os.getenv("TILING", "0") != "0"
+TILE_SIZE = int(os.getenv("TILE_SIZE", "1024"))                  # tile side in pixels
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))           # fraction of the tile side
+TILE_MIN_SIDE = int(os.getenv("TILE_MIN_SIDE", "2048"))          # only tile images larger than this
+TILE_CONCURRENCY = int(os.getenv("TILE_CONCURRENCY", "4"))       # tile calls in flight per image
+TILE_INCLUDE_FULL = os.getenv("TILE_INCLUDE_FULL", "1") != "0"   # also annotate the full frame (large objects)
+TILE_MERGE_THRESHOLD = float(os.getenv("TILE_MERGE_THRESHOLD", "0.6"))  # overlap above which seam duplicates merge
+
+# Box post-processing between perception and YOLO conversion
+POSTPROCESS_METHOD = os.getenv("POSTPROCESS", "nms").lower()          # none | nms | soft_nms | wbf
+POSTPROCESS_IOU = float(os.getenv("POSTPROCESS_IOU", "0.55"))
+POSTPROCESS_SCORE_THRESHOLD = float(os.getenv("POSTPROCESS_SCORE_THRESHOLD", "0.001"))
+
+# Annotated previews in the UI (thumbnails rendered on a process pool)
+PREVIEW_MAX_SIDE = int(os.getenv("PREVIEW_MAX_SIDE", "768"))
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "80"))
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "0"))   # 0 = one per CPU, 1 = render in-process
+
+# Background annotation jobs in the app
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))                  # jobs running at the same time
+JOB_MAX_KEEP = int(os.getenv("JOB_MAX_KEEP", "50"))               # finished jobs kept for polling
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1000"))   # per-image results (content hash)
+
+# Packed perception: several small images per request (1 = off)
+PACK_SIZE = int(os.getenv("PACK_SIZE", "1"))
+PACK_MAX_SIDE = int(os.getenv("PACK_MAX_SIDE", "768"))   # only images this small (as uploaded) are packed
+
+# Video mode: agents run on keyframes only, boxes are tracked / interpolated in between
+VIDEO_STRIDE = int(os.getenv("VIDEO_STRIDE", "0"))                         # every Nth frame (0 = scene changes)
+VIDEO_SCENE_THRESHOLD = float(os.getenv("VIDEO_SCENE_THRESHOLD", "0.35"))  # histogram distance for a new scene
+VIDEO_MIN_GAP = int(os.getenv("VIDEO_MIN_GAP", "5"))                       # frames between keyframes, at least
+VIDEO_MAX_GAP = int(os.getenv("VIDEO_MAX_GAP", "150"))                     # ... and at most
+VIDEO_TRACK_IOU = float(os.getenv("VIDEO_TRACK_IOU", "0.3"))               # same-object match between keyframes
+VIDEO_JPEG_QUALITY = int(os.getenv("VIDEO_JPEG_QUALITY", "90"))
+
+# Near-duplicate dedup in front of the agents (perceptual hash)
+DEDUP_ENABLED = os.getenv("DEDUP", "0") != "0"
+DEDUP_DISTANCE = int(os.getenv("DEDUP_DISTANCE", "6"))   # max Hamming distance between 64-bit pHashes
+
+# Perception cascade: a cheap model first, the strong one only when local checks fail
+CASCADE_ENABLED = os.getenv("CASCADE", "0") != "0"
+CASCADE_CHEAP_MODEL = os.getenv("CASCADE_CHEAP_MODEL", "gemini-2.5-flash-lite")
+CASCADE_STRONG_MODEL = os.getenv("CASCADE_STRONG_MODEL", "gemini-2.5-flash")
+CASCADE_SAMPLES = int(os.getenv("CASCADE_SAMPLES", "2"))                  # cheap candidates compared
+CASCADE_TEMPERATURE = float(os.getenv("CASCADE_TEMPERATURE", "0.7"))      # so the samples can disagree
+CASCADE_MIN_AGREEMENT = float(os.getenv("CASCADE_MIN_AGREEMENT", "0.7"))  # F1 between the samples
+CASCADE_AGREEMENT_IOU = float(os.getenv("CASCADE_AGREEMENT_IOU", "0.5"))
+CASCADE_MIN_BOXES = int(os.getenv("CASCADE_MIN_BOXES", "0"))              # >0 escalates empty images (and tiles)
+CASCADE_MAX_BOXES = int(os.getenv("CASCADE_MAX_BOXES", "50"))
+CASCADE_MIN_AREA = float(os.getenv("CASCADE_MIN_AREA", "1e-4"))           # smallest plausible box (normalized)
@@ -0,0 +1,192 @@
+# dedup.py
+#
+# Near-duplicate detection in front of the agents:
+#
+#   perceptual hash (64-bit DCT pHash) -> multi-index hash lookup
+#     -> representative (annotated) | duplicate (reuses its boxes)
+#
+# Boxes are normalized, so a duplicate at another resolution or JPEG
+# quality can take the representative's annotation as is.
+import io
+from itertools import combinations
+
+import numpy as np
+from PIL import Image
+
+from src.config import DEDUP_DISTANCE
+from src.image_handle import as_handle
+
+HASH_BITS = 64
+_HASH_SIDE = 8          # 8 x 8 low-frequency DCT coefficients -> 64 bits
+_DCT_SIDE = 32          # image is reduced to 32 x 32 before the DCT
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+
+
+_DCT = _dct_matrix(_DCT_SIDE)
+_WEIGHTS = 1 << np.arange(HASH_BITS - 1, -1, -1, dtype=np.uint64)
+
+
+def phash(image):
+    """
+    64-bit perceptual hash as an int: grayscale 32 x 32 -> 2D DCT ->
+    top-left 8 x 8 block -> bit set where the coefficient is above the
+    block median. JPEGs are decoded in draft mode (reduced scale).
+    image: path or ImageHandle.
+    """
+    handle = as_handle(image)
+    with Image.open(io.BytesIO(handle.bytes)) as img:
+        img.draft("L", (4 * _DCT_SIDE, 4 * _DCT_SIDE))
+        small = img.convert("L").resize((_DCT_SIDE, _DCT_SIDE), Image.LANCZOS)
+    pixels = np.asarray(small, dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:_HASH_SIDE, :_HASH_SIDE].ravel()
+    bits = (low > np.median(low)).astype(np.uint64)
+    return int((bits * _WEIGHTS).sum())
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class HashIndex:
+    """
+    Multi-index hashing for Hamming range queries over 64-bit hashes.
+
+    The hash is split into `chunks` substrings with one dict each. Two
+    hashes within distance r differ by at most r // chunks bits in at
+    least one substring (pigeonhole), so a query only probes, per
+    substring, the buckets within that small radius and verifies the
+    few candidates with a popcount. Lookups stay near-constant instead
+    of growing with the number of indexed images.
+    """
+
+    def __init__(self, max_distance=DEDUP_DISTANCE, chunks=4):
+        self.max_distance = max_distance
+        self.chunks = chunks
+        self.chunk_bits = HASH_BITS // chunks
+        self._mask = (1 << self.chunk_bits) - 1
+        self._tables = [{} for _ in range(chunks)]
+        self._hashes = {}   # key -> hash
+        # every bit pattern with at most r // chunks bits set
+        radius = max_distance // chunks
+        self._flips = [
+            sum(1 << b for b in bits)
+            for d in range(radius + 1)
+            for bits in combinations(range(self.chunk_bits), d)
+        ]
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def _parts(self, h):
+        return [(h >> (i * self.chunk_bits)) & self._mask for i in range(self.chunks)]
+
+    def add(self, key, h):
+        self._hashes[key] = h
+        for table, part in zip(self._tables, self._parts(h)):
+            table.setdefault(part, []).append(key)
+
+    def query(self, h):
+        """Nearest indexed (key, distance) within max_distance, or (None, None)."""
+        best, best_d = None, None
+        seen = set()
+        for table, part in zip(self._tables, self._parts(h)):
+            for flip in self._flips:
+                for key in table.get(part ^ flip, ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    d = hamming(h, self._hashes[key])
+                    if d <= self.max_distance and (best_d is None or d < best_d):
+                        best, best_d = key, d
+        return best, best_d
+
+
+class Deduper:
+    """
+    Dedup gate for iter_batch (src/batch_runner.py). hash(image) computes
+    the perceptual hash (thread-safe, run off the event loop); admit(handle,
+    h) looks it up and lets only representatives through to the agents,
+    holding their near-duplicates. resolve(result) turns a representative's
+    result into results for its duplicates. Duplicates of representatives
+    that already finished are answered right away and collected in .ready.
+    admit / resolve / drain share state and belong on one thread.
+
+    Duplicate results carry "duplicate_of" (the representative's path)
+    and "hash_distance"; they reuse "raw" / "corrected" and never touch
+    the model. If the representative failed, its duplicates fail with it
+    (a resumed run retries them).
+    """
+
+    def __init__(self, max_distance=DEDUP_DISTANCE):
+        self.index = HashIndex(max_distance)
+        self.ready = []
+        self._group_of = {}     # id(representative handle) -> group id
+        self._groups = []       # group id -> {"image", "followers", "result"}
+        self.duplicates = 0
+
+    @staticmethod
+    def hash(handle):
+        """phash of the handle, or None when unreadable. Its bytes are released."""
+        try:
+            h = phash(handle)
+        except Exception:
+            h = None
+        handle.release()  # re-read when annotated, not held while hashing on
+        return h
+
+    def admit(self, handle, h):
+        """The handle when it must be annotated, or None when it's held as a duplicate."""
+        if h is None:
+            return handle  # unreadable: the agents report the error for it
+
+        gid, distance = self.index.query(h)
+        if gid is None:
+            gid = len(self._groups)
+            self._groups.append({"image": handle.path or handle.name, "followers": [], "result": None})
+            self._group_of[id(handle)] = gid
+            self.index.add(gid, h)
+            return handle
+
+        self.duplicates += 1
+        group = self._groups[gid]
+        if group["result"] is None:
+            group["followers"].append((handle, distance))
+        else:
+            self.ready.append(self._duplicate(group, handle, distance))
+        return None
+
+    def resolve(self, result):
+        """Results for the duplicates held back for this representative result."""
+        gid = self._group_of.pop(id(result.get("handle")), None)
+        if gid is None:
+            return []
+        group = self._groups[gid]
+        if "error" in result:
+            group["result"] = {"error": result["error"]}
+        else:
+            group["result"] = {"raw": result["raw"], "corrected": result["corrected"]}
+        followers, group["followers"] = group["followers"], []
+        return [self._duplicate(group, handle, distance) for handle, distance in followers]
+
+    def drain(self):
+        ready, self.ready = self.ready, []
+        return ready
+
+    @staticmethod
+    def _duplicate(group, handle, distance):
+        result = {
+            "image": handle.path,
+            "handle": handle,
+            "duplicate_of": group["image"],
+            "hash_distance": distance,
+        }
+        if "error" in group["result"]:
+            result["error"] = f"duplicate of failed image {group['image']}: {group['result']['error']}"
+        else:
+            result.update(group["result"], slow_path=False, upload=None)
+        return result
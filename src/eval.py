@@ -1,4 +1,6 @@
 # eval.py
+import numpy as np
+
 
 def iou(boxA, boxB):
     """
@@ -29,3 +31,331 @@ def iou(boxA, boxB):
 
     iou_result = inter_area / float(areaA + areaB - inter_area)
     return round(iou_result, 4)
+
+
+def _as_xyxy(boxes):
+    """[x, y, w, h] rows -> float array of [x1, y1, x2, y2] rows."""
+    b = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    return np.concatenate([b[:, :2], b[:, :2] + b[:, 2:]], axis=1)
+
+
+def iou_matrix(boxesA, boxesB):
+    """
+    Vectorized IoU between every pair of boxes.
+    boxesA: N x [x, y, w, h], boxesB: M x [x, y, w, h] -> N x M array
+    """
+    a = _as_xyxy(boxesA)
+    b = _as_xyxy(boxesB)
+
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    wh = np.clip(rb - lt, 0.0, None)
+    inter = wh[..., 0] * wh[..., 1]
+
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+
+    out = np.zeros_like(inter)
+    np.divide(inter, union, out=out, where=union > 0)
+    return out
+
+
+def label_mask(labelsA, labelsB):
+    """N x M bool array, True where labels are equal (case-insensitive)."""
+    a = np.array([str(l).strip().lower() for l in labelsA], dtype=object)
+    b = np.array([str(l).strip().lower() for l in labelsB], dtype=object)
+    return a[:, None] == b[None, :]
+
+
+def match_greedy(ious, iou_threshold=0.5):
+    """
+    Greedy one-to-one matching: highest IoU pairs first.
+    Returns a list of (pred_idx, gt_idx, iou).
+    """
+    ious = np.asarray(ious, dtype=np.float64)
+    rows, cols = np.nonzero(ious >= iou_threshold)
+    if rows.size == 0:
+        return []
+
+    order = np.argsort(-ious[rows, cols], kind="stable")
+    used_r = np.zeros(ious.shape[0], dtype=bool)
+    used_c = np.zeros(ious.shape[1], dtype=bool)
+    matches = []
+    for r, c in zip(rows[order], cols[order]):
+        if used_r[r] or used_c[c]:
+            continue
+        used_r[r] = used_c[c] = True
+        matches.append((int(r), int(c), float(ious[r, c])))
+    return matches
+
+
+def linear_assignment(cost):
+    """
+    Minimum-cost assignment (Hungarian algorithm with potentials, O(n^2 m)).
+    Works on rectangular matrices; returns (row_idx, col_idx) arrays.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0 or m == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    # 1-indexed potentials; p[j] = row assigned to column j
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        # Augment along the alternating path
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = np.nonzero(p[1:])[0]
+    rows = p[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def match_hungarian(ious, iou_threshold=0.5):
+    """
+    Optimal one-to-one matching maximizing total IoU over the pairs
+    with IoU >= iou_threshold.
+    Returns a list of (pred_idx, gt_idx, iou).
+    """
+    ious = np.asarray(ious, dtype=np.float64)
+    valid = ious >= iou_threshold
+
+    # Only rows/columns with at least one valid pair can be matched
+    r_idx = np.nonzero(valid.any(axis=1))[0]
+    c_idx = np.nonzero(valid.any(axis=0))[0]
+    if r_idx.size == 0:
+        return []
+
+    sub = np.where(valid, ious, 0.0)[np.ix_(r_idx, c_idx)]
+    rows, cols = linear_assignment(-sub)
+    return [
+        (int(r_idx[r]), int(c_idx[c]), float(sub[r, c]))
+        for r, c in zip(rows, cols)
+        if sub[r, c] >= iou_threshold
+    ]
+
+
+MATCHERS = {"greedy": match_greedy, "hungarian": match_hungarian}
+
+
+def evaluate_boxes(pred_boxes, gt_boxes, pred_labels=None, gt_labels=None,
+                   iou_threshold=0.5, method="hungarian"):
+    """
+    Per-image precision / recall / mean IoU for N predictions vs M GT boxes.
+    Boxes are [x, y, w, h] in the same units (pixels or normalized).
+    When both label lists are given, only same-label pairs can match.
+    """
+    n, m = len(pred_boxes), len(gt_boxes)
+    ious = iou_matrix(pred_boxes, gt_boxes)
+    if pred_labels is not None and gt_labels is not None and n and m:
+        ious = np.where(label_mask(pred_labels, gt_labels), ious, 0.0)
+
+    matches = MATCHERS[method](ious, iou_threshold)
+    tp = len(matches)
+
+    return {
+        "tp": tp,
+        "fp": n - tp,
+        "fn": m - tp,
+        "precision": round(tp / n, 4) if n else (1.0 if m == 0 else 0.0),
+        "recall": round(tp / m, 4) if m else 1.0,
+        "mean_iou": round(float(np.mean([iou for _, _, iou in matches])), 4) if matches else 0.0,
+        "matches": matches,
+    }
+
+
+def evaluate_annotation(pred_json, gt_json, image_size, iou_threshold=0.5,
+                        method="hungarian", class_aware=True):
+    """
+    Compares every predicted object against every GT object.
+
+    pred_json: {"objects": [{"label", "bbox_norm": [x, y, w, h]}]}  (normalized)
+    gt_json:   {"objects": [{"label", "bbox": [x, y, w, h]}]}       (pixels)
+               GT objects with "bbox_norm" instead are accepted too.
+    image_size: (W, H) used to convert normalized boxes to pixels.
+    """
+    W, H = image_size
+    scale = np.array([W, H, W, H], dtype=np.float64)
+
+    preds = [o for o in pred_json.get("objects", []) if "bbox_norm" in o]
+    gts = [o for o in gt_json.get("objects", []) if "bbox" in o or "bbox_norm" in o]
+
+    pred_boxes = np.asarray([o["bbox_norm"] for o in preds], dtype=np.float64).reshape(-1, 4) * scale
+    gt_boxes = np.asarray(
+        [o["bbox"] if "bbox" in o else np.asarray(o["bbox_norm"]) * scale for o in gts],
+        dtype=np.float64,
+    ).reshape(-1, 4)
+
+    labels = class_aware and all("label" in o for o in preds + gts)
+    return evaluate_boxes(
+        pred_boxes,
+        gt_boxes,
+        [o["label"] for o in preds] if labels else None,
+        [o["label"] for o in gts] if labels else None,
+        iou_threshold=iou_threshold,
+        method=method,
+    )
+
+
+# Dataset-level mAP
+
+IOU_THRESHOLDS = np.round(np.arange(0.5, 0.96, 0.05), 2)
+
+
+def _norm_label(label):
+    return str(label).strip().lower()
+
+
+def _match_by_score(ious, thresholds):
+    """
+    COCO-style matching for one class of one image: predictions (rows,
+    already sorted by descending score) take the best unmatched GT.
+    Returns a k x T bool array of true positives, one column per threshold.
+    """
+    k, m = ious.shape
+    tp = np.zeros((k, len(thresholds)), dtype=bool)
+    for t, thr in enumerate(thresholds):
+        taken = np.zeros(m, dtype=bool)
+        for i in range(k):
+            cand = np.where(taken, -1.0, ious[i])
+            j = int(np.argmax(cand))
+            if cand[j] >= thr:
+                taken[j] = True
+                tp[i, t] = True
+    return tp
+
+
+def average_precision(tp, scores, n_gt):
+    """
+    All-point interpolated AP for one class and one IoU threshold.
+    tp: bool array per detection, scores: confidence per detection.
+    """
+    if n_gt == 0:
+        return None
+    if len(scores) == 0:
+        return 0.0
+
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    tp = np.asarray(tp, dtype=np.float64)[order]
+    tp_cum = np.cumsum(tp)
+    fp_cum = np.cumsum(1.0 - tp)
+
+    recall = tp_cum / n_gt
+    precision = tp_cum / np.maximum(tp_cum + fp_cum, np.finfo(np.float64).eps)
+
+    # Precision envelope, then area under the step curve
+    mrec = np.concatenate([[0.0], recall, [1.0]])
+    mpre = np.concatenate([[0.0], precision, [0.0]])
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
+    idx = np.nonzero(mrec[1:] != mrec[:-1])[0]
+    return float(np.sum((mrec[idx + 1] - mrec[idx]) * mpre[idx + 1]))
+
+
+class MAPAccumulator:
+    """
+    Streams images one at a time and keeps only per-detection
+    (score, TP flags) per class, so memory does not depend on image count
+    beyond those small arrays.
+    """
+
+    def __init__(self, iou_thresholds=IOU_THRESHOLDS):
+        self.iou_thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+        self.scores = {}   # label -> list of score arrays
+        self.tps = {}      # label -> list of k x T bool arrays
+        self.n_gt = {}     # label -> GT count
+        self.images = 0
+
+    def add_image(self, pred_boxes, pred_labels, pred_scores, gt_boxes, gt_labels):
+        """Boxes are [x, y, w, h] in the same units for preds and GT."""
+        self.images += 1
+        pred_boxes = np.asarray(pred_boxes, dtype=np.float64).reshape(-1, 4)
+        gt_boxes = np.asarray(gt_boxes, dtype=np.float64).reshape(-1, 4)
+        pred_scores = np.asarray(pred_scores, dtype=np.float64).reshape(-1)
+        pred_labels = np.array([_norm_label(l) for l in pred_labels], dtype=object)
+        gt_labels = np.array([_norm_label(l) for l in gt_labels], dtype=object)
+
+        for label in set(pred_labels.tolist()) | set(gt_labels.tolist()):
+            p = np.nonzero(pred_labels == label)[0]
+            g = np.nonzero(gt_labels == label)[0]
+            self.n_gt[label] = self.n_gt.get(label, 0) + len(g)
+            if len(p) == 0:
+                continue
+
+            p = p[np.argsort(-pred_scores[p], kind="stable")]
+            if len(g):
+                tp = _match_by_score(iou_matrix(pred_boxes[p], gt_boxes[g]), self.iou_thresholds)
+            else:
+                tp = np.zeros((len(p), len(self.iou_thresholds)), dtype=bool)
+
+            self.scores.setdefault(label, []).append(pred_scores[p])
+            self.tps.setdefault(label, []).append(tp)
+
+    def summary(self):
+        """
+        {"map50", "map50_95", "per_class": {label: {"ap50", "ap50_95", "gt", "pred"}}}
+        Classes without GT are reported but excluded from the means.
+        """
+        per_class = {}
+        ap50s, ap_all = [], []
+        t50 = int(np.argmin(np.abs(self.iou_thresholds - 0.5)))
+
+        for label in sorted(set(self.n_gt) | set(self.scores)):
+            scores = np.concatenate(self.scores[label]) if label in self.scores else np.zeros(0)
+            tps = (np.concatenate(self.tps[label]) if label in self.tps
+                   else np.zeros((0, len(self.iou_thresholds)), dtype=bool))
+            n_gt = self.n_gt.get(label, 0)
+
+            aps = [average_precision(tps[:, t], scores, n_gt) for t in range(len(self.iou_thresholds))]
+            entry = {"gt": n_gt, "pred": int(len(scores)), "ap50": None, "ap50_95": None}
+            if n_gt:
+                entry["ap50"] = round(aps[t50], 4)
+                entry["ap50_95"] = round(float(np.mean(aps)), 4)
+                ap50s.append(aps[t50])
+                ap_all.append(np.mean(aps))
+            per_class[label] = entry
+
+        return {
+            "images": self.images,
+            "map50": round(float(np.mean(ap50s)), 4) if ap50s else 0.0,
+            "map50_95": round(float(np.mean(ap_all)), 4) if ap_all else 0.0,
+            "per_class": per_class,
+        }
@@ -0,0 +1,105 @@
+# image_handle.py
+import io
+import os
+import threading
+
+from PIL import Image
+
+from src.preprocess import encode_for_upload, upload_size
+
+
+class ImageHandle:
+    """
+    One image shared by every pipeline stage.
+
+    Everything is lazy and computed at most once:
+      .bytes   file contents (one disk read)
+      .size    (W, H) from the header, no pixel decode (nor full read)
+      .image   decoded RGB pixels (one JPEG decode)
+      .upload() preprocessed blob for Gemini + byte stats
+    """
+
+    def __init__(self, path=None, data=None):
+        if path is None and data is None:
+            raise ValueError("ImageHandle needs a path or bytes.")
+        self.path = path
+        self._bytes = data
+        self._size = None
+        self._image = None
+        self._upload = None
+        self._upload_stats = None
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f"ImageHandle({self.path!r})"
+
+    @property
+    def name(self):
+        return os.path.basename(self.path) if self.path else "image"
+
+    @property
+    def bytes(self):
+        if self._bytes is None:
+            with self._lock:
+                if self._bytes is None:
+                    with open(self.path, "rb") as f:
+                        self._bytes = f.read()
+        return self._bytes
+
+    @property
+    def size(self):
+        if self._size is None:
+            if self._image is not None:
+                self._size = self._image.size
+            elif self._bytes is None and self.path is not None:
+                # Header only: PIL reads the first few KB, the bytes aren't kept
+                with Image.open(self.path) as img:
+                    self._size = img.size
+            else:
+                with Image.open(io.BytesIO(self.bytes)) as img:
+                    self._size = img.size
+        return self._size
+
+    @property
+    def upload_size(self):
+        """Size of the image as sent to Gemini (after preprocessing)."""
+        return upload_size(self.size)
+
+    @property
+    def image(self):
+        """Decoded RGB image. Treat as read-only; .copy() before drawing on it."""
+        if self._image is None:
+            with self._lock:
+                if self._image is None:
+                    img = Image.open(io.BytesIO(self.bytes))
+                    self._image = img.convert("RGB")
+                    self._size = self._image.size
+        return self._image
+
+    def upload(self):
+        """(blob, stats) for generate_content; encoded once per handle."""
+        if self._upload is None:
+            with self._lock:
+                if self._upload is None:
+                    self._upload = encode_for_upload(self.bytes)
+                    self._upload_stats = self._upload[1]
+        return self._upload
+
+    @property
+    def upload_stats(self):
+        return self._upload_stats
+
+    def release(self):
+        """Drops bytes, pixels and upload blob; size and stats are kept."""
+        with self._lock:
+            if self.path is not None:
+                self._bytes = None
+            self._image = None
+            self._upload = None
+
+
+def as_handle(image):
+    """Accepts an ImageHandle or a path."""
+    if isinstance(image, ImageHandle):
+        return image
+    return ImageHandle(image)
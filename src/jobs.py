@@ -0,0 +1,188 @@
+# jobs.py
+#
+# Background annotation jobs for the Streamlit app. A job runs on a worker
+# thread, outside the script run, so reruns and browser refreshes don't
+# interrupt it; the page only polls Job.snapshot() for progress.
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from src.batch_runner import stream_batch
+from src.config import JOB_WORKERS, JOB_MAX_KEEP, RESULT_CACHE_SIZE
+from src.image_handle import as_handle
+
+
+class Job:
+    __slots__ = ("id", "status", "total", "done", "slow", "cached", "duplicates", "results",
+                 "live", "error", "created", "finished", "_cancel")
+
+    def __init__(self, total):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "queued"      # queued | running | done | failed | cancelled
+        self.total = total
+        self.done = 0
+        self.slow = 0               # images that needed the LLM correction agent
+        self.cached = 0             # images served from the result cache
+        self.duplicates = 0         # near-duplicates that reused another image's boxes
+        self.results = []           # (image_path, result dict) in completion order
+        self.live = {}              # image name -> boxes streamed in so far (in flight only)
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def snapshot(self):
+        """Copy that is safe to read while the worker keeps appending."""
+        return {
+            "id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "done": self.done,
+            "slow": self.slow,
+            "cached": self.cached,
+            "duplicates": self.duplicates,
+            "error": self.error,
+            "results": list(self.results),
+            "live": {name: list(boxes) for name, boxes in list(self.live.items())},
+            "elapsed": round((self.finished or time.time()) - self.created, 1),
+        }
+
+
+class JobManager:
+    """
+    Runs jobs on a small thread pool and keeps the last JOB_MAX_KEEP of them.
+    Finished per-image results are kept in an LRU keyed by
+    (content hash, settings key), so re-running the same image with the
+    same settings costs nothing.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_jobs=JOB_MAX_KEEP, cache_size=RESULT_CACHE_SIZE):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="annotate-job")
+        self._jobs = OrderedDict()
+        self._results = OrderedDict()
+        self.max_jobs = max_jobs
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def content_hash(handle):
+        return hashlib.sha256(handle.bytes).hexdigest()
+
+    def _cache_get(self, key):
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+        return None
+
+    def _cache_put(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+
+    def submit(self, images, finish, settings_key="", concurrency=None, save=None, settings=None):
+        """
+        images: paths or ImageHandles. finish(handle, raw, corrected) -> dict
+        runs the local stages for each image (on the worker thread).
+        save(handle, result) writes the outputs of every successful image,
+        including results served from the cache (finish doesn't run for those).
+        settings: src/run_settings.snapshot taken when the job is submitted;
+        the agents run under it, whatever other sessions change meanwhile.
+        settings_key must describe it. Returns the job id.
+        """
+        handles = [as_handle(image) for image in images]
+        job = Job(len(handles))
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.active:
+                    break
+                self._jobs.popitem(last=False)
+        self._pool.submit(self._run, job, handles, finish, settings_key, concurrency, save, settings)
+        return job.id
+
+    def _run(self, job, handles, finish, settings_key, concurrency, save, settings):
+        job.status = "running"
+        try:
+            keys, todo = {}, []
+            for handle in handles:
+                key = (self.content_hash(handle), settings_key)
+                cached = self._cache_get(key)
+                if cached is not None:
+                    if save is not None:
+                        save(handle, cached)
+                    job.results.append((handle.path, cached))
+                    job.cached += 1
+                    job.done += 1
+                    handle.release()
+                else:
+                    keys[id(handle)] = key
+                    todo.append(handle)
+                    handle.release()  # re-read when its turn comes, not held while queued
+
+            def on_object(handle, obj):
+                if obj is None:   # broken stream: its retry sends the boxes again
+                    job.live.pop(handle.name, None)
+                else:
+                    job.live.setdefault(handle.name, []).append(obj)
+
+            for res in stream_batch(todo, concurrency, on_object=on_object, cancel=job._cancel,
+                                    settings=settings):
+                if res.get("handle") is None:
+                    # The runner itself failed (no image): a job error, not a result
+                    job.error = res["error"]
+                    continue
+                job.live.pop(res["handle"].name, None)
+                if "error" in res:
+                    out = {"error": res["error"]}
+                else:
+                    out = finish(res["handle"], res["raw"], res["corrected"])
+                    out["upload"] = res.get("upload")
+                    if res.get("duplicate_of"):
+                        out["duplicate_of"] = res["duplicate_of"]
+                        job.duplicates += 1
+                    job.slow += bool(res.get("slow_path"))
+                    self._cache_put(keys[id(res["handle"])], out)
+                    if save is not None:
+                        save(res["handle"], out)
+                res["handle"].release()
+                job.results.append((res["image"], out))
+                job.done += 1
+                if job._cancel.is_set():
+                    break
+            if job.error is not None:
+                job.status = "failed"
+            else:
+                job.status = "cancelled" if job._cancel.is_set() else "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+        finally:
+            job.finished = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job._cancel.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "jobs": len(self._jobs),
+                "active": sum(job.active for job in self._jobs.values()),
+                "cached_results": len(self._results),
+            }
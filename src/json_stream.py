@@ -0,0 +1,167 @@
+# json_stream.py
+#
+# JSON out of model text without regexes:
+#
+#   parse_json(text)   first balanced {...} / [...] span that parses
+#                      (chatter, code fences and stray braces are skipped)
+#   ObjectStream       incremental scanner for streamed responses; hands
+#                      out every completed box object as soon as its
+#                      closing brace arrives
+#
+# A greedy \{[\s\S]*\} regex spans from the first "{" to the last "}",
+# so any brace in the surrounding chatter breaks it. Balancing brackets
+# (outside string literals) finds each candidate span exactly.
+import json
+
+BOX_KEYS = ("bbox_norm", "bbox", "box")
+
+_CLOSE = {"}": "{", "]": "["}
+
+
+class _Scanner:
+    """
+    Bracket balancer that can be fed text piece by piece. Quotes only
+    open a string inside a container, so apostrophes and quotes in prose
+    around the JSON don't throw it off. Calls on_close(start, end, char)
+    for every balanced container; end is exclusive.
+    """
+
+    def __init__(self, on_close):
+        self.text = ""
+        self._pos = 0
+        self._stack = []          # (opening char, offset)
+        self._in_string = False
+        self._escape = False
+        self._on_close = on_close
+
+    @property
+    def parent(self):
+        """Opening char of the innermost open container, or None."""
+        return self._stack[-1][0] if self._stack else None
+
+    def feed(self, chunk):
+        self.text += chunk
+        text, stack = self.text, self._stack
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = bool(stack)
+            elif c == "{" or c == "[":
+                stack.append((c, i))
+            elif c in _CLOSE:
+                if stack and stack[-1][0] == _CLOSE[c]:
+                    _, start = stack.pop()
+                    self._on_close(start, i + 1, c)
+                else:
+                    stack.clear()  # stray bracket in prose: start over
+        self._pos = len(text)
+
+
+def json_spans(text):
+    """
+    (start, end) of every balanced {...} / [...] span, outermost first.
+    Nested spans are included, so JSON after an unclosed brace in the
+    prose is still found.
+    """
+    spans = []
+    _Scanner(lambda start, end, c: spans.append((start, end))).feed(text)
+    spans.sort()
+    return spans
+
+
+def parse_json(text, default=None, accept=None):
+    """
+    The first span of text that is valid JSON (an object or array, or
+    whatever accept(value) allows). Candidates are tried in order, so a
+    failing one doesn't hide a later one.
+    """
+    if not isinstance(text, str):
+        return default
+    accept = accept or (lambda value: isinstance(value, (dict, list)))
+    try:
+        data = json.loads(text)
+        if accept(data):
+            return data
+    except ValueError:
+        pass
+    for start, end in json_spans(text):
+        try:
+            data = json.loads(text[start:end])
+        except ValueError:
+            continue
+        if accept(data):
+            return data
+    return default
+
+
+def _is_box(item):
+    return isinstance(item, dict) and any(k in item for k in BOX_KEYS)
+
+
+def _is_annotation(value):
+    """A whole answer: a dict that is not itself one box, or a list of boxes."""
+    if isinstance(value, dict):
+        return not _is_box(value)
+    return isinstance(value, list) and bool(value) and all(_is_box(item) for item in value)
+
+
+class ObjectStream:
+    """
+    Parses a streamed annotation as it arrives. feed(chunk) returns the
+    box objects (dicts with a bbox key, inside a list) completed by that
+    chunk; result() returns the whole answer once the stream is done,
+    falling back to {"objects": <completed boxes>} when the final JSON
+    never closes (truncated or malformed output). .salvaged tells the
+    two apart: a salvaged answer is partial and must not be cached.
+    """
+
+    def __init__(self):
+        self.objects = []
+        self.salvaged = False
+        self._new = []
+        self._scanner = _Scanner(self._closed)
+
+    def _closed(self, start, end, c):
+        if c != "}" or self._scanner.parent != "[":
+            return
+        try:
+            item = json.loads(self._scanner.text[start:end])
+        except ValueError:
+            return
+        if _is_box(item):
+            self._new.append(item)
+
+    @property
+    def text(self):
+        return self._scanner.text
+
+    def feed(self, chunk):
+        self._scanner.feed(chunk)
+        new, self._new = self._new, []
+        self.objects.extend(new)
+        return new
+
+    def result(self):
+        # Nested spans are candidates too: a lone box or a bbox list is the
+        # first complete value of a truncated answer, so only whole answers count
+        data = parse_json(self.text, accept=_is_annotation)
+        if data is None and self.text.strip() == "[]":
+            data = []
+        self.salvaged = data is None and bool(self.objects)
+        if self.salvaged:
+            data = {"objects": list(self.objects)}
+        return data
+
+
+def parse_annotation(text):
+    """Whole-text counterpart of ObjectStream: annotation dict or None."""
+    stream = ObjectStream()
+    stream.feed(text or "")
+    return stream.result()
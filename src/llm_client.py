@@ -0,0 +1,269 @@
+# llm_client.py
+#
+# Shared call layer for every model request made by the agents
+# (sent to the backend from src/backends.py):
+#   - token buckets for requests/min and tokens/min
+#   - AIMD concurrency: halve the in-flight limit on throttling,
+#     grow it by ~1 per window of successful calls
+#   - retries with full-jitter exponential backoff on 429 / 5xx
+import random
+import threading
+import time
+
+from src.backends import get_backend
+from src.telemetry import telemetry
+from src.config import (
+    GEMINI_RPM, GEMINI_TPM, GEMINI_MAX_RETRIES, GEMINI_BACKOFF_BASE,
+    GEMINI_BACKOFF_MAX, GEMINI_MAX_CONCURRENCY,
+)
+
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+IMAGE_TOKENS = 258          # Gemini bills images per 768px tile
+EXPECTED_OUTPUT_TOKENS = 512
+
+
+class TokenBucket:
+    """Blocking token bucket refilled continuously at rate_per_min."""
+
+    def __init__(self, rate_per_min, capacity=None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity or rate_per_min
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, n=1):
+        """Blocks until n tokens are available, then takes them."""
+        if self.rate <= 0:
+            return
+        n = min(n, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            time.sleep(min(wait, 1.0))
+
+    def adjust(self, delta):
+        """Corrects an estimate once the real usage is known (may go negative)."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class AIMDLimiter:
+    """
+    Adaptive concurrency limit (additive increase, multiplicative decrease).
+    One success adds 1/limit, so the limit grows by ~1 per full window;
+    a throttle halves it (at most once per cooldown, since concurrent
+    calls usually fail together).
+    """
+
+    def __init__(self, initial, max_limit, min_limit=1, cooldown=2.0):
+        self.limit = float(initial)
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease > self.cooldown:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+
+def error_code(exc):
+    """HTTP-ish status of an API error, or None."""
+    code = getattr(exc, "code", None)
+    if callable(code):  # grpc errors expose code() -> StatusCode
+        code = None
+    if isinstance(code, int):
+        return code
+    name = type(exc).__name__
+    return {
+        "ResourceExhausted": 429, "TooManyRequests": 429,
+        "InternalServerError": 500, "BadGateway": 502,
+        "ServiceUnavailable": 503, "DeadlineExceeded": 504,
+    }.get(name)
+
+
+def estimate_tokens(contents):
+    """Rough prompt-size estimate used to charge the tokens/min bucket."""
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    total = EXPECTED_OUTPUT_TOKENS
+    for part in contents:
+        if isinstance(part, str):
+            total += len(part) // 4
+        elif isinstance(part, dict) and "data" in part:
+            total += IMAGE_TOKENS * 4  # upper bound for a downscaled image
+        else:
+            total += IMAGE_TOKENS
+    return total
+
+
+class LLMClient:
+    def __init__(self, rpm=GEMINI_RPM, tpm=GEMINI_TPM, max_retries=GEMINI_MAX_RETRIES,
+                 backoff_base=GEMINI_BACKOFF_BASE, backoff_max=GEMINI_BACKOFF_MAX,
+                 max_concurrency=GEMINI_MAX_CONCURRENCY):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.limiter = AIMDLimiter(initial=max(1, max_concurrency // 2), max_limit=max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _backoff(self, attempt, exc):
+        # Server-provided retry delay wins when present
+        delay = getattr(exc, "retry_delay", None)
+        seconds = getattr(delay, "total_seconds", lambda: None)() if delay is not None else None
+        if seconds:
+            return seconds + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def generate(self, model_name, contents, **kwargs):
+        """
+        backend.generate(model_name, contents, **kwargs) behind the rate limits.
+        Retries 429/5xx with backoff; other errors are raised at once.
+        """
+        estimate = estimate_tokens(contents)
+        attempt = 0
+        while True:
+            self.requests.acquire(1)
+            self.tokens.acquire(estimate)
+            self.limiter.acquire()
+            try:
+                response = get_backend().generate(model_name, contents, **kwargs)
+            except Exception as e:
+                code = error_code(e)
+                self.limiter.release(throttled=code == 429)
+                with self._lock:
+                    self.throttled += code == 429
+                if code not in RETRYABLE_CODES or attempt >= self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                telemetry.add("retries")
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+                continue
+
+            if kwargs.get("stream"):
+                # Slot and token charge are settled once the body is consumed
+                return StreamedResponse(self, response, model_name, estimate)
+            self.limiter.release()
+            self._charge(model_name, getattr(response, "usage_metadata", None), estimate)
+            return response
+
+    def _charge(self, model_name, usage, estimate):
+        with self._lock:
+            self.calls += 1
+
+        # Charge the real token usage instead of the estimate
+        total = getattr(usage, "total_token_count", None) if usage is not None else None
+        if total:
+            self.tokens.adjust(total - estimate)
+
+        # Token counts go on the caller's span (perception, correction, ...)
+        telemetry.annotate(model=model_name)
+        telemetry.add("llm_calls")
+        if usage is not None:
+            telemetry.add("prompt_tokens", getattr(usage, "prompt_token_count", 0) or 0)
+            telemetry.add("response_tokens", getattr(usage, "candidates_token_count", 0) or 0)
+
+    def _stream_failed(self, exc):
+        """Mid-stream error: throttle / back off like a failed call, then let the caller decide."""
+        code = error_code(exc)
+        self.limiter.release(throttled=code == 429)
+        with self._lock:
+            self.throttled += code == 429
+        if code in RETRYABLE_CODES:
+            with self._lock:
+                self.retries += 1
+            telemetry.add("retries")
+            time.sleep(self._backoff(0, exc))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "throttled": self.throttled,
+                "concurrency_limit": round(self.limiter.limit, 2),
+            }
+
+
+class StreamedResponse:
+    """
+    A stream=True response that holds its concurrency slot until it has
+    been iterated to the end. Usage is read from the last chunk that
+    carries it (the final one has the totals), so the token bucket and
+    counters see the whole answer, not the first chunk. A 429 / 5xx
+    raised mid-stream releases the slot as throttled and backs off before
+    it propagates; chunks already yielded can't be retried here, so the
+    caller falls back. Other attributes come from the wrapped response.
+    """
+
+    def __init__(self, client, response, model_name, estimate):
+        self._client = client
+        self._response = response
+        self._model_name = model_name
+        self._estimate = estimate
+        self._done = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __iter__(self):
+        if self._done:
+            return
+        usage = getattr(self._response, "usage_metadata", None)
+        try:
+            for chunk in self._response:
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                yield chunk
+        except Exception as e:
+            self._done = True
+            self._client._stream_failed(e)
+            raise
+        finally:
+            if not self._done:  # finished, or the caller stopped early
+                self._done = True
+                self._client.limiter.release()
+                self._client._charge(self._model_name, usage, self._estimate)
+
+
+# Shared by perception, correction and planner agents
+client = LLMClient()
+
+
+def generate(model_name, contents, **kwargs):
+    return client.generate(model_name, contents, **kwargs)
@@ -1,22 +1,145 @@
 # memory_bank.py
-import json, os
+#
+# Append-only SQLite store behind the old remember/recall API.
+# Every remember() is one INSERT (constant cost as history grows);
+# recall() reads the newest value through an index. WAL mode lets
+# several Streamlit sessions / processes write without losing updates.
+import json, os, sqlite3, threading
+from time import time
 
-MEM_FILE = "data/memory_bank.json"
+MEM_DB = "data/memory_bank.sqlite3"
+MEM_FILE = "data/memory_bank.json"   # legacy file, imported once
 
-def remember(key, value):
-    os.makedirs(os.path.dirname(MEM_FILE), exist_ok=True)
-    if os.path.exists(MEM_FILE):
-        with open(MEM_FILE,"r",encoding="utf-8") as f:
+MAX_HISTORY = 100        # values kept per key by automatic compaction
+COMPACT_EVERY = 500      # rows inserted (by any process) between automatic compactions
+
+_local = threading.local()
+_opened = set()          # databases checked for compaction by this process
+_opened_lock = threading.Lock()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memory (
+    id    INTEGER PRIMARY KEY AUTOINCREMENT,
+    key   TEXT NOT NULL,
+    ts    REAL NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_memory_key ON memory(key, id);
+"""
+
+
+def _connect():
+    """One connection per thread (sqlite3 connections are not thread-safe)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == MEM_DB:
+        return conn
+
+    os.makedirs(os.path.dirname(MEM_DB) or ".", exist_ok=True)
+    conn = sqlite3.connect(MEM_DB, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _import_legacy(conn)
+
+    # Short runs never reach COMPACT_EVERY inserts themselves, so the
+    # bank is also trimmed when a process first opens it
+    with _opened_lock:
+        first_open = MEM_DB not in _opened
+        _opened.add(MEM_DB)
+    if first_open and _over_history(conn):
+        _compact(conn, MAX_HISTORY)
+
+    _local.conn = conn
+    _local.path = MEM_DB
+    return conn
+
+
+def _import_legacy(conn):
+    """Moves data/memory_bank.json into the database the first time."""
+    if not os.path.exists(MEM_FILE):
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if not os.path.exists(MEM_FILE):  # another process won the race
+            conn.execute("COMMIT")
+            return
+        with open(MEM_FILE, "r", encoding="utf-8") as f:
             db = json.load(f)
-    else:
-        db = {}
-    db[key] = value
-    with open(MEM_FILE,"w",encoding="utf-8") as f:
-        json.dump(db, f, indent=2)
+        now = time()
+        conn.executemany(
+            "INSERT INTO memory (key, ts, value) VALUES (?, ?, ?)",
+            [(k, now, json.dumps(v)) for k, v in db.items()],
+        )
+        os.replace(MEM_FILE, MEM_FILE + ".migrated")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _over_history(conn):
+    """True when some key holds more than MAX_HISTORY values (index-only scan)."""
+    row = conn.execute(
+        "SELECT EXISTS (SELECT 1 FROM memory GROUP BY key HAVING COUNT(*) > ?)", (MAX_HISTORY,)
+    ).fetchone()
+    return bool(row[0])
+
+
+def remember(key, value):
+    conn = _connect()
+    cur = conn.execute(
+        "INSERT INTO memory (key, ts, value) VALUES (?, ?, ?)",
+        (key, time(), json.dumps(value)),
+    )
+    # AUTOINCREMENT ids are shared by every writer, so this counts the
+    # rows of all processes, not just this one's
+    if cur.lastrowid % COMPACT_EVERY == 0:
+        _compact(conn, MAX_HISTORY)
+
 
 def recall(key):
-    if not os.path.exists(MEM_FILE):
-        return None
-    with open(MEM_FILE,"r",encoding="utf-8") as f:
-        db = json.load(f)
-    return db.get(key)
+    row = _connect().execute(
+        "SELECT value FROM memory WHERE key = ? ORDER BY id DESC LIMIT 1", (key,)
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def history(key, limit=20, since=None):
+    """Newest-first list of {"ts", "value"} for key, optionally since a timestamp."""
+    sql = "SELECT ts, value FROM memory WHERE key = ?"
+    args = [key]
+    if since is not None:
+        sql += " AND ts >= ?"
+        args.append(since)
+    sql += " ORDER BY id DESC LIMIT ?"
+    args.append(limit)
+    return [{"ts": ts, "value": json.loads(v)} for ts, v in _connect().execute(sql, args)]
+
+
+def keys():
+    return [k for (k,) in _connect().execute("SELECT DISTINCT key FROM memory ORDER BY key")]
+
+
+def compact(keep_last=1, vacuum=False):
+    """
+    Keeps only the newest keep_last values per key. Returns deleted row count.
+    vacuum=True also gives the freed pages back to the filesystem.
+    """
+    return _compact(_connect(), keep_last, vacuum)
+
+
+def _compact(conn, keep_last, vacuum=False):
+    cur = conn.execute(
+        """
+        DELETE FROM memory WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY key ORDER BY id DESC) AS rn
+                FROM memory
+            ) WHERE rn > ?
+        )
+        """,
+        (keep_last,),
+    )
+    if vacuum:
+        conn.execute("VACUUM")
+    return cur.rowcount
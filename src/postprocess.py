@@ -0,0 +1,305 @@
+# postprocess.py
+#
+# Box post-processing on normalized annotations
+# ({"objects": [{"label", "bbox_norm": [x, y, w, h], "score"?}]}):
+#
+#   nms                  greedy per-class NMS
+#   soft_nms             Gaussian / linear score decay instead of removal
+#   weighted_box_fusion  averages overlapping boxes, also across several
+#                        prompts / models (fuse_annotations)
+#
+# Everything works on N x 4 arrays. Overlaps are computed one row at a time
+# against the remaining boxes (O(N) memory), so thousands of boxes per
+# image don't need an N x N matrix.
+import numpy as np
+
+from src.config import POSTPROCESS_METHOD, POSTPROCESS_IOU, POSTPROCESS_SCORE_THRESHOLD
+
+METHODS = ("none", "nms", "soft_nms", "wbf")
+
+
+def _xyxy(boxes):
+    b = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    return np.concatenate([b[:, :2], b[:, :2] + b[:, 2:]], axis=1)
+
+
+def _xywh(boxes):
+    return np.concatenate([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]], axis=1)
+
+
+def _overlap(box, boxes, metric="iou"):
+    """
+    Overlap of one xyxy box with M xyxy boxes -> (M,).
+    metric: "iou" (intersection / union) or "ios" (intersection / smaller
+    area, which also catches a box truncated at a tile seam lying inside
+    the full box).
+    """
+    return _pairwise(box[None, :], boxes, metric)[0]
+
+
+def _pairwise(a, b, metric="iou"):
+    """N x M overlap between two sets of xyxy boxes."""
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    wh = np.clip(rb - lt, 0.0, None)
+    inter = wh[..., 0] * wh[..., 1]
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    if metric == "ios":
+        denom = np.minimum(area_a[:, None], area_b[None, :])
+    else:
+        denom = area_a[:, None] + area_b[None, :] - inter
+    out = np.zeros_like(inter)
+    np.divide(inter, denom, out=out, where=denom > 0)
+    return out
+
+
+def _groups(classes, n):
+    """Index arrays of boxes per class (one group when classes is None)."""
+    if classes is None:
+        return [np.arange(n)]
+    _, ids = np.unique(np.asarray(classes, dtype=object).astype(str), return_inverse=True)
+    order = np.argsort(ids, kind="stable")
+    return np.split(order, np.flatnonzero(np.diff(ids[order])) + 1)
+
+
+def nms(boxes, scores, iou_threshold=0.5, metric="iou", classes=None, block=256):
+    """
+    Greedy NMS over [x, y, w, h] rows. classes: optional per-box labels
+    (suppression only within a class). Returns kept indices, best first.
+    """
+    b = _xyxy(boxes)
+    s = np.asarray(scores, dtype=np.float64).reshape(-1)
+    keep = np.concatenate([np.zeros(0, dtype=np.int64)] + [
+        idx[_nms_sorted(b[idx], s[idx], iou_threshold, metric, block)]
+        for idx in _groups(classes, len(b)) if len(idx)
+    ])
+    return keep[np.argsort(-s[keep], kind="stable")]
+
+
+def _nms_sorted(b, scores, iou_threshold, metric, block):
+    """
+    Class-agnostic greedy NMS on xyxy boxes. Overlaps are computed a block
+    of rows at a time against all lower-scored boxes; only rows that
+    actually overlap something need the sequential greedy step, so sparse
+    scenes cost ~N^2 / block vector ops.
+    """
+    order = np.argsort(-scores, kind="stable")
+    b = b[order]
+    n = len(b)
+    suppressed = np.zeros(n, dtype=bool)
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        over = _pairwise(b[start:stop], b[start:], metric) > iou_threshold
+        # only lower-scored boxes (to the right of the diagonal) can be suppressed
+        over[:, :stop - start] &= np.triu(np.ones((stop - start, stop - start), dtype=bool), k=1)
+        for r in np.flatnonzero(over.any(axis=1)):
+            if not suppressed[start + r]:
+                suppressed[start:] |= over[r]
+    return order[~suppressed]
+
+
+def soft_nms(boxes, scores, iou_threshold=0.3, sigma=0.5, score_threshold=0.001,
+             method="gaussian", classes=None):
+    """
+    Soft-NMS (Bodla et al.): overlapping boxes have their score decayed
+    instead of being removed, so nearby distinct objects survive.
+      gaussian: s *= exp(-iou^2 / sigma)
+      linear:   s *= 1 - iou   (only where iou > iou_threshold)
+    Returns (kept indices, decayed scores of those indices), best first.
+    """
+    b = _xyxy(boxes)
+    s = np.asarray(scores, dtype=np.float64).reshape(-1).copy()
+    keep, kept_scores = [], []
+    for group in _groups(classes, len(b)):
+        _soft_nms_group(b, s, group, iou_threshold, sigma, score_threshold, method, keep, kept_scores)
+    keep, kept_scores = np.asarray(keep, dtype=np.int64), np.asarray(kept_scores)
+    order = np.argsort(-kept_scores, kind="stable")
+    return keep[order], kept_scores[order]
+
+
+def _soft_nms_group(b, s, idx, iou_threshold, sigma, score_threshold, method, keep, kept_scores):
+    while idx.size:
+        top = np.argmax(s[idx])
+        i = idx[top]
+        keep.append(i)
+        kept_scores.append(s[i])
+        idx = np.delete(idx, top)
+        if not idx.size:
+            break
+        ov = _overlap(b[i], b[idx])
+        if method == "linear":
+            s[idx] *= np.where(ov > iou_threshold, 1.0 - ov, 1.0)
+        else:
+            s[idx] *= np.exp(-(ov ** 2) / sigma)
+        idx = idx[s[idx] >= score_threshold]
+
+
+def weighted_box_fusion(boxes_list, scores_list, labels_list, weights=None,
+                        iou_threshold=0.55, skip_threshold=0.0):
+    """
+    Weighted box fusion (Solovyev et al.) over one or more sources
+    (prompts, models, tiles). Boxes of the same label that overlap a
+    cluster's fused box by more than iou_threshold join it; the fused box
+    is the score-weighted mean of its members, and its score is the mean
+    member score scaled down when fewer sources than available agree.
+
+    Returns (boxes [x, y, w, h], scores, labels) as arrays.
+    """
+    n_sources = len(boxes_list)
+    weights = np.ones(n_sources) if weights is None else np.asarray(weights, dtype=np.float64)
+    weights = weights / weights.mean()
+
+    all_boxes, all_scores, all_labels, all_src = [], [], [], []
+    for src, (boxes, scores, labels) in enumerate(zip(boxes_list, scores_list, labels_list)):
+        b = _xyxy(boxes)
+        s = np.asarray(scores, dtype=np.float64).reshape(-1) * weights[src]
+        ok = s >= skip_threshold
+        all_boxes.append(b[ok])
+        all_scores.append(s[ok])
+        all_labels.extend(np.asarray(labels, dtype=object)[ok])
+        all_src.append(np.full(ok.sum(), src))
+
+    if not all_labels:
+        return np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=object)
+    boxes = np.concatenate(all_boxes)
+    scores = np.concatenate(all_scores)
+    labels = np.asarray(all_labels, dtype=object).astype(str)
+    sources = np.concatenate(all_src)
+
+    out_boxes, out_scores, out_labels = [], [], []
+    for label in np.unique(labels):
+        idx = np.flatnonzero(labels == label)
+        idx = idx[np.argsort(-scores[idx], kind="stable")]
+
+        fused = np.zeros((len(idx), 4))        # fused xyxy per cluster
+        weight = np.zeros(len(idx))            # sum of member scores
+        acc = np.zeros((len(idx), 4))          # score-weighted coordinate sums
+        members = np.zeros(len(idx), dtype=np.int64)
+        seen = np.zeros((len(idx), n_sources), dtype=bool)
+        n = 0
+        for i in idx:
+            c = -1
+            if n:
+                ov = _overlap(boxes[i], fused[:n])
+                best = int(np.argmax(ov))
+                if ov[best] > iou_threshold:
+                    c = best
+            if c < 0:
+                c, n = n, n + 1
+            acc[c] += scores[i] * boxes[i]
+            weight[c] += scores[i]
+            members[c] += 1
+            seen[c, sources[i]] = True
+            fused[c] = acc[c] / weight[c]
+
+        mean_score = weight[:n] / members[:n]
+        agreeing = seen[:n].sum(axis=1)
+        out_boxes.append(fused[:n])
+        out_scores.append(mean_score * agreeing / n_sources)
+        out_labels.extend([label] * n)
+
+    return _xywh(np.concatenate(out_boxes)), np.concatenate(out_scores), np.asarray(out_labels, dtype=object)
+
+
+# Annotation-level helpers
+
+def object_scores(objects, default=None):
+    """Model confidence when present, else `default` (None -> box area: bigger box wins)."""
+    return np.asarray([
+        float(o.get("score", o.get("confidence",
+              o["bbox_norm"][2] * o["bbox_norm"][3] if default is None else default)))
+        for o in objects
+    ], dtype=np.float64)
+
+
+def _labels(objects):
+    return [str(o.get("label", "")).strip().lower() for o in objects]
+
+
+def merge_objects(objects, iou_threshold=0.5, metric="iou", class_aware=True):
+    """
+    Removes duplicate objects with NMS (per label when class_aware).
+    Objects without bbox_norm are dropped; the survivors keep their order
+    of appearance.
+    """
+    objects = [o for o in objects if "bbox_norm" in o]
+    if not objects:
+        return []
+    keep = nms(
+        [o["bbox_norm"] for o in objects],
+        object_scores(objects),
+        iou_threshold,
+        metric,
+        classes=_labels(objects) if class_aware else None,
+    )
+    return [objects[i] for i in sorted(keep)]
+
+
+def postprocess_objects(objects, method=POSTPROCESS_METHOD, iou_threshold=POSTPROCESS_IOU,
+                        score_threshold=POSTPROCESS_SCORE_THRESHOLD):
+    """
+    Duplicate removal for one model output (between perception and YOLO).
+    method: "none" | "nms" | "soft_nms" | "wbf". Scores are only written
+    back when the input had scores (or fusion produced them).
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown post-processing method: {method}")
+    objects = [o for o in objects if "bbox_norm" in o]
+    if method == "none" or len(objects) < 2:
+        return objects
+
+    has_scores = any("score" in o or "confidence" in o for o in objects)
+    boxes = [o["bbox_norm"] for o in objects]
+    labels = _labels(objects)
+
+    if method == "nms":
+        keep = nms(boxes, object_scores(objects), iou_threshold, classes=labels)
+        return [objects[i] for i in sorted(keep)]
+
+    if method == "soft_nms":
+        keep, scores = soft_nms(boxes, object_scores(objects, default=1.0), iou_threshold,
+                                score_threshold=score_threshold, classes=labels)
+        out = []
+        for i, s in sorted(zip(keep, scores)):
+            obj = dict(objects[i])
+            if has_scores:
+                obj["score"] = round(float(s), 4)
+            out.append(obj)
+        return out
+
+    return fuse_objects([objects], iou_threshold=iou_threshold, score_threshold=score_threshold)
+
+
+def fuse_objects(sources, weights=None, iou_threshold=POSTPROCESS_IOU,
+                 score_threshold=POSTPROCESS_SCORE_THRESHOLD):
+    """
+    Weighted box fusion of several object lists (one per prompt / model).
+    Returns fused objects with a "score" (agreement-weighted confidence),
+    using the label spelling of the first member seen.
+    """
+    sources = [[o for o in objs if "bbox_norm" in o] for objs in sources]
+    spelling = {}
+    for objs in sources:
+        for o in objs:
+            spelling.setdefault(str(o.get("label", "")).strip().lower(), o.get("label", ""))
+
+    boxes, scores, labels = weighted_box_fusion(
+        [[o["bbox_norm"] for o in objs] for objs in sources],
+        [object_scores(objs, default=1.0) for objs in sources],
+        [_labels(objs) for objs in sources],
+        weights=weights,
+        iou_threshold=iou_threshold,
+    )
+    return [
+        {"label": spelling.get(label, label),
+         "bbox_norm": [round(float(v), 6) for v in box],
+         "score": round(float(score), 4)}
+        for box, score, label in zip(boxes, scores, labels)
+        if score >= score_threshold
+    ]
+
+
+def fuse_annotations(annotations, weights=None, iou_threshold=POSTPROCESS_IOU):
+    """annotations: list of {"objects": [...]} dicts -> one fused annotation dict."""
+    return {"objects": fuse_objects([a.get("objects", []) for a in annotations], weights, iou_threshold)}
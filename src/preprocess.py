@@ -0,0 +1,81 @@
+# preprocess.py
+import io
+
+from PIL import Image
+
+from src.config import PREPROCESS_ENABLED, PREPROCESS_MAX_SIDE, PREPROCESS_FORMAT, PREPROCESS_QUALITY
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def settings_tag():
+    """Short string describing the upload settings (part of the cache key)."""
+    if not PREPROCESS_ENABLED:
+        return "original"
+    return f"{PREPROCESS_FORMAT}:{PREPROCESS_MAX_SIDE}:{PREPROCESS_QUALITY}"
+
+
+def upload_size(size):
+    """
+    (W, H) of the image as uploaded to Gemini for an original of `size`.
+    Scaling keeps the aspect ratio, so normalized boxes stay valid;
+    pixel boxes returned by the model must be divided by THIS size.
+    """
+    W, H = size
+    if not PREPROCESS_ENABLED or not PREPROCESS_MAX_SIDE or max(W, H) <= PREPROCESS_MAX_SIDE:
+        return W, H
+    scale = PREPROCESS_MAX_SIDE / max(W, H)
+    return max(1, round(W * scale)), max(1, round(H * scale))
+
+
+def encode_for_upload(image_bytes):
+    """
+    Resizes to PREPROCESS_MAX_SIDE and re-encodes to PREPROCESS_FORMAT without
+    EXIF/ICC metadata. Returns (blob, stats) where blob is the
+    {"mime_type", "data"} part accepted by generate_content.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    orig_size = img.size
+    stats = {
+        "orig_bytes": len(image_bytes),
+        "orig_size": list(orig_size),
+    }
+
+    # Disabled: send the original file untouched
+    if not PREPROCESS_ENABLED and img.format in MIME_TYPES:
+        stats.update(sent_bytes=len(image_bytes), sent_size=list(orig_size), saved_bytes=0)
+        return {"mime_type": MIME_TYPES[img.format], "data": image_bytes}, stats
+
+    new_size = upload_size(orig_size)
+    if new_size != orig_size:
+        img.draft("RGB", new_size)  # lets JPEG decode at reduced scale
+        img = img.resize(new_size, Image.LANCZOS)
+
+    data = _encode(img, PREPROCESS_FORMAT, PREPROCESS_QUALITY)
+    mime = MIME_TYPES[PREPROCESS_FORMAT]
+
+    # Nothing to gain: keep the original file as-is
+    if new_size == orig_size and len(data) >= len(image_bytes) and img.format in MIME_TYPES:
+        data, mime = image_bytes, MIME_TYPES[img.format]
+
+    stats.update(
+        sent_bytes=len(data),
+        sent_size=list(new_size),
+        saved_bytes=len(image_bytes) - len(data),
+    )
+    return {"mime_type": mime, "data": data}, stats
+
+
+def _encode(img, fmt, quality):
+    if fmt == "JPEG" and img.mode != "RGB":
+        img = img.convert("RGB")
+    elif img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+    buf = io.BytesIO()
+    # No exif= / icc_profile= -> metadata is dropped
+    if fmt == "PNG":
+        img.save(buf, format=fmt, optimize=True)
+    else:
+        img.save(buf, format=fmt, quality=quality)
+    return buf.getvalue()
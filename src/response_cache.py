@@ -0,0 +1,176 @@
+# response_cache.py
+import hashlib
+import json
+import os
+import threading
+from time import time
+
+from src import run_settings
+from src.config import RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_MB, RESPONSE_CACHE_MAX_AGE_DAYS
+
+CACHE_DIR = "data/cache/responses"
+
+
+class ResponseCache:
+    """
+    Content-addressed disk cache for Gemini responses.
+
+    key = sha256(image bytes, prompt, model name, input annotation)
+    One small JSON file per entry, sharded by the first two hex chars.
+    Entries older than max_age are dropped on read; when the cache grows
+    past max_bytes the least recently used entries (by mtime) are evicted.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=None, max_age=None, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # computed lazily on first write
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(image_bytes, prompt, model_name, annotation=None):
+        h = hashlib.sha256()
+        h.update(hashlib.sha256(image_bytes).digest())
+        for part in (prompt, model_name, annotation or ""):
+            data = part.encode("utf-8")
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+        return h.hexdigest()
+
+    @property
+    def active(self):
+        """enabled, unless the current run (src/run_settings.py) says otherwise."""
+        return run_settings.get("use_cache", self.enabled)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached text or None. Counts a hit or a miss."""
+        if not self.active:
+            return None
+
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            if self.max_age and time() - st.st_mtime > self.max_age:
+                self._remove(path, st.st_size)
+                raise FileNotFoundError(path)
+            with open(path, "r", encoding="utf-8") as f:
+                text = json.load(f)["text"]
+            os.utime(path)  # refresh LRU position
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, key, text):
+        if not self.active:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"ts": time(), "text": text}, f)
+        size = os.path.getsize(tmp)
+        try:
+            old_size = os.path.getsize(path)  # overwriting a key replaces its file
+        except OSError:
+            old_size = 0
+        os.replace(tmp, path)  # atomic, safe with concurrent writers
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += size - old_size
+            over = self.max_bytes and self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Drops expired entries, then oldest entries until the cache is
+        at 90% of max_bytes. Returns the number of removed files.
+        """
+        entries = list(self._entries())
+        now = time()
+        removed = 0
+        keep = []
+        for path, size, mtime in entries:
+            if self.max_age and now - mtime > self.max_age:
+                self._remove(path, size)
+                removed += 1
+            else:
+                keep.append((mtime, path, size))
+
+        total = sum(size for _, _, size in keep)
+        if self.max_bytes and total > self.max_bytes:
+            target = 0.9 * self.max_bytes
+            for _, path, size in sorted(keep):
+                if total <= target:
+                    break
+                self._remove(path, size)
+                total -= size
+                removed += 1
+
+        with self._lock:
+            self._size = total
+        return removed
+
+    def clear(self):
+        for path, size, _ in list(self._entries()):
+            self._remove(path, size)
+        with self._lock:
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size_bytes": self._size,
+            }
+
+
+# Shared instance used by the agents
+cache = ResponseCache(
+    max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+    max_age=RESPONSE_CACHE_MAX_AGE_DAYS * 86400,
+    enabled=RESPONSE_CACHE_ENABLED,
+)
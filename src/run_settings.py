@@ -0,0 +1,49 @@
+# run_settings.py
+#
+# Per-run pipeline settings: tiling, cascade, duplicate box removal and
+# the response cache. The module globals (perception_agent.TILING, ...,
+# cache.enabled) stay the process defaults that CLI flags set; a job
+# snapshots its settings at submit time and runs under them, so one app
+# session's sidebar never changes another session's running job.
+#
+# The snapshot travels in a ContextVar: iter_batch installs it around
+# every agent call on the worker threads, and the tile pool copies the
+# context on to its own threads.
+import contextvars
+from contextlib import contextmanager
+
+FIELDS = ("tiling", "cascade", "postprocess", "use_cache")
+
+_current = contextvars.ContextVar("run_settings", default=None)
+
+
+def snapshot(**settings):
+    """A copy of the given settings for submit(); unknown names are an error."""
+    unknown = set(settings) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown run settings: {sorted(unknown)}")
+    return dict(settings)
+
+
+def get(name, default):
+    """The active run's value for name, or default outside a run (or when unset)."""
+    settings = _current.get()
+    if settings is None:
+        return default
+    return settings.get(name, default)
+
+
+@contextmanager
+def use(settings):
+    """Runs the block under settings (None: process defaults)."""
+    token = _current.set(settings)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def call(settings, fn, *args):
+    """fn(*args) under settings; for executor threads, which don't inherit the context."""
+    with use(settings):
+        return fn(*args)
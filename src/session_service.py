@@ -1,18 +1,149 @@
 # session_service.py
+import json
+import os
+import threading
 import uuid
+from collections import OrderedDict, deque
 from time import time
 
+from src.config import SESSION_MAX_EVENTS, SESSION_TTL, SESSION_MAX_SESSIONS, SESSION_FLUSH_DIR
+
+
+class Event:
+    """Compact event record (no per-instance __dict__)."""
+    __slots__ = ("ts", "event")
+
+    def __init__(self, ts, event):
+        self.ts = ts
+        self.event = event
+
+    # e["ts"] / e["event"] keep working for old callers
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def to_dict(self):
+        return {"ts": self.ts, "event": self.event}
+
+
+class Session:
+    __slots__ = ("sid", "user", "start", "last_active", "events")
+
+    def __init__(self, sid, user, max_events):
+        self.sid = sid
+        self.user = user
+        self.start = self.last_active = time()
+        self.events = deque(maxlen=max_events)  # ring buffer: oldest events drop off
+
+
 class InMemorySessionService:
-    def __init__(self):
-        self.sessions = {}
+    """
+    Bounded session store for long-lived processes:
+      - each session keeps at most max_events events (ring buffer)
+      - sessions idle longer than ttl seconds are evicted
+      - at most max_sessions sessions, least recently active evicted first
+      - evicted sessions are appended to flush_dir/<sid>.jsonl when set
+    """
+
+    def __init__(self, max_events=SESSION_MAX_EVENTS, ttl=SESSION_TTL,
+                 max_sessions=SESSION_MAX_SESSIONS, flush_dir=SESSION_FLUSH_DIR):
+        self.sessions = OrderedDict()  # sid -> Session, least recently active first
+        self.max_events = max_events
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.flush_dir = flush_dir or None
+        self._lock = threading.Lock()
+        self._last_sweep = time()
 
     def create_session(self, user="default"):
         sid = str(uuid.uuid4())
-        self.sessions[sid] = {"user": user, "start": time(), "events": []}
+        with self._lock:
+            self.sessions[sid] = Session(sid, user, self.max_events)
+            self._evict_locked()
         return sid
 
     def add_event(self, sid, event):
-        self.sessions[sid]["events"].append({"ts": time(), "event": event})
+        now = time()
+        with self._lock:
+            session = self.sessions.get(sid)
+            if session is None:
+                # evicted (or unknown) session: start a fresh record
+                session = self.sessions[sid] = Session(sid, "default", self.max_events)
+            session.events.append(Event(now, event))
+            session.last_active = now
+            self.sessions.move_to_end(sid)
+
+            # idle sweep at most every ttl/10 seconds
+            if self.ttl and now - self._last_sweep > self.ttl / 10:
+                self._evict_locked(now)
 
     def get_session(self, sid):
-        return self.sessions.get(sid)
+        """Snapshot dict: {"user", "start", "events": [{"ts", "event"}, ...]}"""
+        with self._lock:
+            session = self.sessions.get(sid)
+            if session is None:
+                return None
+            return {
+                "user": session.user,
+                "start": session.start,
+                "events": [e.to_dict() for e in session.events],
+            }
+
+    def end_session(self, sid):
+        """Removes a session, flushing it to disk when flush_dir is set."""
+        with self._lock:
+            session = self.sessions.pop(sid, None)
+        if session is not None:
+            self._flush(session)
+
+    def evict_idle(self):
+        with self._lock:
+            return self._evict_locked()
+
+    def _evict_locked(self, now=None):
+        now = now or time()
+        self._last_sweep = now
+        evicted = []
+
+        if self.ttl:
+            # sessions are ordered by activity: stop at the first active one
+            for sid, session in self.sessions.items():
+                if now - session.last_active <= self.ttl:
+                    break
+                evicted.append(sid)
+        excess = len(self.sessions) - len(evicted) - self.max_sessions
+        if self.max_sessions and excess > 0:
+            evicted.extend(list(self.sessions)[len(evicted):len(evicted) + excess])
+
+        for sid in evicted:
+            self._flush(self.sessions.pop(sid))
+        return len(evicted)
+
+    def _flush(self, session):
+        if not self.flush_dir or not session.events:
+            return
+        os.makedirs(self.flush_dir, exist_ok=True)
+        path = os.path.join(self.flush_dir, f"{session.sid}.jsonl")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("".join(
+                json.dumps({"user": session.user, **e.to_dict()}) + "\n" for e in session.events
+            ))
+        session.events.clear()
+
+    def flush_all(self):
+        """Writes every live session to flush_dir and clears its events (e.g. on shutdown)."""
+        with self._lock:
+            for session in self.sessions.values():
+                self._flush(session)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_session_service():
+    """Process-wide service, so app reruns reuse one bounded store."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = InMemorySessionService()
+        return _shared
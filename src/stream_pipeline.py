@@ -0,0 +1,159 @@
+# stream_pipeline.py
+#
+# Generator stages for large directory runs:
+#   iter_images -> skip_done (manifest) -> stream_batch (agents) -> write_outputs
+# Only a bounded window of images is in memory at any time, and every
+# finished image is recorded in a JSONL manifest so an interrupted job
+# resumes without calling Gemini again for completed images.
+import glob
+import json
+import os
+
+from src.batch_runner import stream_batch
+from src.telemetry import telemetry
+from src.tools import save_text
+from src.yolo_formatter import convert_to_yolo
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def iter_images(source):
+    """
+    Yields (image_path, relative_path) for a directory (recursive, sorted
+    per directory) or a glob pattern such as "data/**/*.jpg".
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTS):
+                    path = os.path.join(root, name)
+                    yield path, os.path.relpath(path, source)
+        return
+
+    # relative paths are taken from the non-wildcard prefix of the pattern
+    parts = []
+    for part in source.split(os.sep):
+        if any(c in part for c in "*?["):
+            break
+        parts.append(part)
+    base = os.sep.join(parts) or "."
+    if base == source:
+        base = os.path.dirname(source) or "."
+
+    for path in sorted(glob.iglob(source, recursive=True)):
+        if path.lower().endswith(IMAGE_EXTS) and os.path.isfile(path):
+            yield path, os.path.relpath(path, base)
+
+
+def _fingerprint(path):
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+class Manifest:
+    """
+    Append-only JSONL checkpoint: one line per finished image.
+    An image counts as done when its last record is "ok" and the file's
+    size/mtime fingerprint has not changed since.
+    """
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        self.done = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if resume and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line after a crash
+                    if rec.get("status") == "ok":
+                        self.done[rec["rel"]] = rec.get("fingerprint")
+                    else:
+                        self.done.pop(rec.get("rel"), None)
+        elif not resume and os.path.exists(path):
+            os.remove(path)
+        self._f = open(path, "a", encoding="utf-8")
+
+    def is_done(self, rel, path):
+        fp = self.done.get(rel)
+        return fp is not None and fp == _fingerprint(path)
+
+    def add(self, record):
+        self._f.write(json.dumps(record) + "\n")
+        self._f.flush()  # a crash loses at most the line being written
+        if record.get("status") == "ok":
+            self.done[record["rel"]] = record.get("fingerprint")
+
+    def close(self):
+        self._f.close()
+
+
+def skip_done(items, manifest):
+    """Drops images already recorded as done."""
+    for path, rel in items:
+        if not manifest.is_done(rel, path):
+            yield path, rel
+
+
+def write_outputs(results, rel_paths, out_dir):
+    """
+    Last stage: YOLO conversion + per-image files under out_dir, mirroring
+    the input tree. Yields one manifest record per image.
+    """
+    for res in results:
+        path = res["image"]
+        rel = rel_paths.pop(path, None) or os.path.basename(path or "")
+        record = {"rel": rel, "image": path}
+
+        if "error" in res:
+            record.update(status="error", error=res["error"])
+        else:
+            try:
+                corrected_json = json.loads(res["corrected"])
+                if res.get("duplicate_of"):
+                    # boxes reused from a near-identical image (src/dedup.py)
+                    corrected_json["duplicate_of"] = res["duplicate_of"]
+                with telemetry.span("yolo", image=rel):
+                    yolo_txt = convert_to_yolo(json.dumps(corrected_json))
+
+                with telemetry.span("save", image=rel):
+                    stem = os.path.join(out_dir, os.path.splitext(rel)[0])
+                    os.makedirs(os.path.dirname(stem), exist_ok=True)
+                    save_text(f"{stem}_raw.json", res["raw"])
+                    save_text(f"{stem}_corrected.json", json.dumps(corrected_json, indent=2))
+                    save_text(f"{stem}.txt", yolo_txt)
+
+                record.update(
+                    status="ok",
+                    fingerprint=_fingerprint(path),
+                    objects=len(corrected_json.get("objects", [])),
+                    slow_path=res.get("slow_path", False),
+                )
+                if res.get("duplicate_of"):
+                    record["duplicate_of"] = res["duplicate_of"]
+            except Exception as e:
+                record.update(status="error", error=f"{type(e).__name__}: {e}")
+
+        if res.get("handle") is not None:
+            res["handle"].release()
+        yield record
+
+
+def run_stream(items, out_dir, manifest, concurrency=None, pack=None, dedup=None):
+    """
+    Wires the stages together. items: iterable of (path, rel) still to do.
+    Yields manifest records as images finish (completion order).
+    """
+    rel_paths = {}
+
+    def _paths():
+        for path, rel in items:
+            rel_paths[path] = rel
+            yield path
+
+    for record in write_outputs(stream_batch(_paths(), concurrency, pack=pack, dedup=dedup), rel_paths, out_dir):
+        manifest.add(record)
+        yield record
@@ -0,0 +1,263 @@
+# telemetry.py
+#
+# Structured timing spans and counters for the hot path.
+#
+#   with telemetry.span("perception", image=handle.name):
+#       ...                          # nested calls may telemetry.annotate(...)
+#
+# Every finished span is appended to a JSON-lines file (one record per
+# stage per image: duration, tokens, bytes uploaded, cache hit, retries);
+# aggregated counters and duration histograms are exposed in Prometheus
+# text format as a file and/or a small HTTP endpoint.
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.config import (
+    TELEMETRY_ENABLED, TELEMETRY_JSONL, TELEMETRY_JSONL_MAX_MB, TELEMETRY_PROM_FILE, TELEMETRY_PROM_INTERVAL, TELEMETRY_PORT,
+)
+
+# Seconds; upper bounds of the stage duration histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Span attributes summed into counters: attr -> (metric, help)
+COUNTED_ATTRS = {
+    "prompt_tokens": ("annotator_llm_prompt_tokens_total", "Prompt tokens reported by the model"),
+    "response_tokens": ("annotator_llm_response_tokens_total", "Response tokens reported by the model"),
+    "upload_bytes": ("annotator_upload_bytes_total", "Image bytes sent to the model"),
+    "retries": ("annotator_llm_retries_total", "Retried model calls (429 / 5xx)"),
+    "llm_calls": ("annotator_llm_calls_total", "Successful model calls"),
+}
+
+_current = contextvars.ContextVar("telemetry_span", default=None)
+
+
+class Span:
+    """One timed stage. Attributes set while open end up in its JSONL record."""
+    __slots__ = ("stage", "image", "attrs", "start", "wall")
+
+    def __init__(self, stage, image=None, **attrs):
+        self.stage = stage
+        self.image = image
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.wall = time.time()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, name, value):
+        self.attrs[name] = self.attrs.get(name, 0) + value
+
+
+class Telemetry:
+    def __init__(self, jsonl_path=TELEMETRY_JSONL, prom_path=TELEMETRY_PROM_FILE,
+                 prom_interval=TELEMETRY_PROM_INTERVAL, enabled=TELEMETRY_ENABLED, keep=1000,
+                 jsonl_max_bytes=int(TELEMETRY_JSONL_MAX_MB * 1024 * 1024)):
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.jsonl_max_bytes = jsonl_max_bytes
+        self.prom_path = prom_path
+        self.prom_interval = prom_interval
+        self.recent = deque(maxlen=keep)   # last finished spans, for the UI
+        self._counters = {}                # (name, labels) -> value
+        self._help = {}
+        self._hist = {}                    # stage -> [bucket counts..., +Inf, sum]
+        self._jsonl = None
+        self._last_prom = 0.0
+        self._lock = threading.Lock()
+
+    # Spans
+
+    @contextmanager
+    def span(self, stage, image=None, **attrs):
+        if not self.enabled:
+            yield Span(stage, image, **attrs)
+            return
+        parent = _current.get()
+        if image is None and parent is not None:
+            image = parent.image
+        span = Span(stage, image, **attrs)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(status="error", error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(span, time.perf_counter() - span.start)
+
+    def annotate(self, **attrs):
+        """Sets attributes on the innermost open span (no-op outside a span)."""
+        span = _current.get()
+        if span is not None:
+            span.set(**attrs)
+
+    def add(self, name, value=1):
+        """Adds to a numeric attribute of the innermost open span."""
+        span = _current.get()
+        if span is not None:
+            span.add(name, value)
+
+    def _finish(self, span, duration):
+        record = {
+            "ts": round(span.wall, 6),
+            "stage": span.stage,
+            "image": span.image,
+            "duration_ms": round(duration * 1000, 3),
+            "status": "ok",
+        }
+        record.update(span.attrs)
+
+        with self._lock:
+            self.recent.append(record)
+            self._observe(span.stage, duration)
+            if record["status"] != "ok":
+                self._incr("annotator_stage_errors_total", "Failed stages", stage=span.stage)
+            for attr, (metric, help_text) in COUNTED_ATTRS.items():
+                if attr in span.attrs:
+                    self._incr(metric, help_text, value=span.attrs[attr], stage=span.stage)
+            if "cache" in span.attrs:
+                self._incr("annotator_cache_requests_total", "Response cache lookups",
+                           stage=span.stage, result=span.attrs["cache"])
+            self._write_jsonl(record)
+
+        self._maybe_write_prometheus()
+
+    # Metrics
+
+    def incr(self, name, help_text="", value=1, **labels):
+        with self._lock:
+            self._incr(name, help_text, value, **labels)
+
+    def _incr(self, name, help_text="", value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+        if help_text:
+            self._help.setdefault(name, help_text)
+
+    def _observe(self, stage, seconds):
+        hist = self._hist.setdefault(stage, [0] * (len(BUCKETS) + 2))
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += 1          # +Inf / count
+        hist[-1] += seconds    # sum
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            name = "annotator_stage_duration_seconds"
+            lines += [f"# HELP {name} Duration of pipeline stages", f"# TYPE {name} histogram"]
+            for stage, hist in sorted(self._hist.items()):
+                for bound, count in zip(BUCKETS, hist):
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {hist[-2]}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {hist[-1]:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {hist[-2]}')
+
+            seen = set()
+            for (metric, labels), value in sorted(self._counters.items()):
+                if metric not in seen:
+                    seen.add(metric)
+                    lines.append(f"# HELP {metric} {self._help.get(metric, metric)}")
+                    lines.append(f"# TYPE {metric} counter")
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{metric}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    # Exporters
+
+    def _write_jsonl(self, record):
+        if not self.jsonl_path:
+            return
+        if self._jsonl is None:
+            os.makedirs(os.path.dirname(self.jsonl_path) or ".", exist_ok=True)
+            self._jsonl = open(self.jsonl_path, "a", encoding="utf-8", buffering=1)
+        self._jsonl.write(json.dumps(record, default=str) + "\n")
+        # Size-based rotation: one previous file is kept as <path>.1
+        if self.jsonl_max_bytes and self._jsonl.tell() >= self.jsonl_max_bytes:
+            self._jsonl.close()
+            self._jsonl = None
+            os.replace(self.jsonl_path, self.jsonl_path + ".1")
+
+    def _maybe_write_prometheus(self):
+        if not self.prom_path:
+            return
+        now = time.monotonic()
+        if now - self._last_prom < self.prom_interval:
+            return
+        self._last_prom = now
+        self.write_prometheus()
+
+    def write_prometheus(self, path=None):
+        """Atomically rewrites the Prometheus text file (node_exporter textfile format)."""
+        path = path or self.prom_path
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+    def summary(self):
+        """Totals for the UI: per-stage count / mean ms and counter sums."""
+        with self._lock:
+            stages = {
+                stage: {"count": hist[-2], "mean_ms": round(hist[-1] / hist[-2] * 1000, 3) if hist[-2] else 0.0}
+                for stage, hist in self._hist.items()
+            }
+            totals = {}
+            for (metric, _), value in self._counters.items():
+                totals[metric] = totals.get(metric, 0) + value
+        return {"stages": stages, "totals": totals}
+
+    def close(self):
+        self.write_prometheus()
+        with self._lock:
+            if self._jsonl is not None:
+                self._jsonl.close()
+                self._jsonl = None
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("/metrics", ""):
+            self.send_error(404)
+            return
+        body = telemetry.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(port=TELEMETRY_PORT):
+    """Starts the /metrics endpoint once per process (daemon thread)."""
+    global _server
+    with _server_lock:
+        if _server is None and port:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+# Shared by the agents, the LLM client and the pipeline stages
+telemetry = Telemetry()
+atexit.register(telemetry.close)
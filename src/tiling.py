@@ -0,0 +1,57 @@
+# tiling.py
+#
+# Overlapping tiles for sliced inference on high-resolution images:
+# small objects that vanish when the full frame is downscaled for upload
+# stay visible at tile resolution.
+import io
+import math
+
+from src.image_handle import ImageHandle
+
+
+def tile_grid(size, tile=1024, overlap=0.2):
+    """
+    (x0, y0, x1, y1) pixel windows covering an image of size (W, H).
+    Neighbouring tiles overlap by `overlap` (fraction of the tile side);
+    the last row/column is shifted inwards so every tile is full size.
+    """
+    W, H = size
+    step = max(1, int(tile * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile:
+            return [0]
+        n = math.ceil((length - tile) / step) + 1
+        return sorted({min(i * step, length - tile) for i in range(n)})
+
+    return [
+        (x, y, min(x + tile, W), min(y + tile, H))
+        for y in starts(H)
+        for x in starts(W)
+    ]
+
+
+def crop_tile(handle, window, quality=95):
+    """
+    JPEG-encoded crop of the shared decoded image as an in-memory
+    ImageHandle (the full image is decoded once for all tiles).
+    """
+    buf = io.BytesIO()
+    handle.image.crop(window).save(buf, format="JPEG", quality=quality)
+    return ImageHandle(data=buf.getvalue())
+
+
+def to_global(obj, window, size):
+    """Maps a tile-local bbox_norm to the full image's normalized coordinates."""
+    x0, y0, x1, y1 = window
+    W, H = size
+    tw, th = x1 - x0, y1 - y0
+    x, y, w, h = obj["bbox_norm"]
+    out = dict(obj)
+    out["bbox_norm"] = [
+        round((x0 + x * tw) / W, 6),
+        round((y0 + y * th) / H, 6),
+        round(w * tw / W, 6),
+        round(h * th / H, 6),
+    ]
+    return out
@@ -0,0 +1,288 @@
+# video.py
+#
+# Video annotation with keyframes:
+#
+#   decode (streamed) -> keyframe selection (stride | scene change)
+#     -> agents on keyframes only (stream_batch)
+#     -> IoU tracking between consecutive keyframes
+#     -> linear interpolation for the frames in between -> per-frame YOLO
+#
+# Only keyframes are encoded and kept until annotated; frames in between
+# are counted, never stored, so memory and model calls scale with the
+# number of keyframes rather than with the frame count.
+import json
+import os
+
+import cv2
+import numpy as np
+
+from src.batch_runner import stream_batch
+from src.config import (
+    VIDEO_STRIDE, VIDEO_SCENE_THRESHOLD, VIDEO_MIN_GAP, VIDEO_MAX_GAP,
+    VIDEO_TRACK_IOU, VIDEO_JPEG_QUALITY,
+)
+from src.eval import iou_matrix, label_mask, match_hungarian
+from src.image_handle import ImageHandle
+from src.yolo_export import ClassMap
+from src.yolo_formatter import convert_to_yolo
+
+
+class SceneDetector:
+    """
+    Keyframe when the HSV histogram of a downscaled frame moves far enough
+    (Bhattacharyya distance) from the last keyframe's histogram.
+    min_gap suppresses bursts of keyframes on flicker; max_gap forces a
+    keyframe now and then so boxes of moving objects stay fresh.
+    .reason says why the last keyframe was taken: "first", "scene" or
+    "max_gap" (interpolation must not cross a scene cut).
+    """
+
+    def __init__(self, threshold=VIDEO_SCENE_THRESHOLD, min_gap=VIDEO_MIN_GAP,
+                 max_gap=VIDEO_MAX_GAP, width=160):
+        self.threshold = threshold
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.width = width
+        self._last_hist = None
+        self._last_key = None
+        self.reason = None
+
+    def _hist(self, frame):
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, int(h * self.width / w))), interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv], [0, 1], None, [32, 32], [0, 180, 0, 256])
+        return cv2.normalize(hist, hist).flatten()
+
+    def is_keyframe(self, index, frame):
+        if self._last_key is not None and index - self._last_key < self.min_gap:
+            return False
+        hist = self._hist(frame)
+        if self._last_hist is None:
+            reason = "first"
+        elif cv2.compareHist(self._last_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > self.threshold:
+            reason = "scene"
+        elif index - self._last_key >= self.max_gap:
+            reason = "max_gap"
+        else:
+            return False
+        self._last_hist, self._last_key, self.reason = hist, index, reason
+        return True
+
+
+def video_info(path):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video: {path}")
+    info = {
+        "frames": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        "fps": cap.get(cv2.CAP_PROP_FPS) or 0.0,
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    }
+    cap.release()
+    return info
+
+
+def iter_keyframes(path, stride=VIDEO_STRIDE, detector=None, quality=VIDEO_JPEG_QUALITY, stats=None):
+    """
+    Streams the video once and yields (frame_index, ImageHandle) for
+    keyframes only (JPEG-encoded in memory).
+      stride:   every `stride`-th frame; other frames are only grabbed,
+                not decoded (0 = scene-change detection)
+      detector: SceneDetector (used when stride is 0)
+    stats (dict) receives the total frame count ("frames") when the
+    stream ends, and the keyframes that start a new scene ("cuts").
+    """
+    detector = detector or SceneDetector()
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"Cannot open video: {path}")
+    index = 0
+    cuts = []
+    try:
+        while True:
+            if stride and index % stride:
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if stride or detector.is_keyframe(index, frame):
+                if not stride and detector.reason == "scene":
+                    cuts.append(index)
+                ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                if ok:
+                    yield index, ImageHandle(data=buf.tobytes())
+            index += 1
+    finally:
+        cap.release()
+        if stats is not None:
+            stats["frames"] = index
+            stats["cuts"] = cuts
+
+
+def annotate_keyframes(keyframes, concurrency=None):
+    """
+    Runs the agents on keyframes (completion order from stream_batch,
+    re-sorted by frame). Returns ({frame: [objects]}, {frame: error});
+    errors not tied to a keyframe (e.g. a broken stream) are keyed None.
+    """
+    frame_of = {}
+
+    def _handles():
+        for index, handle in keyframes:
+            frame_of[id(handle)] = index
+            yield handle
+
+    annotations, errors = {}, {}
+    for res in stream_batch(_handles(), concurrency):
+        handle = res.get("handle")
+        index = frame_of.pop(id(handle), None) if handle is not None else None
+        if "error" in res:
+            errors[index] = res["error"]
+        else:
+            try:
+                annotations[index] = json.loads(res["corrected"]).get("objects", [])
+            except Exception as e:
+                errors[index] = f"{type(e).__name__}: {e}"
+        if handle is not None:
+            handle.release()
+    return dict(sorted(annotations.items())), errors
+
+
+def match_tracks(objs_a, objs_b, iou_threshold=VIDEO_TRACK_IOU):
+    """Same-label, one-to-one IoU matching of two keyframes' objects -> [(i, j)]."""
+    if not objs_a or not objs_b:
+        return []
+    ious = iou_matrix([o["bbox_norm"] for o in objs_a], [o["bbox_norm"] for o in objs_b])
+    ious = np.where(label_mask([o.get("label", "") for o in objs_a],
+                               [o.get("label", "") for o in objs_b]), ious, 0.0)
+    return [(i, j) for i, j, _ in match_hungarian(ious, iou_threshold)]
+
+
+def interpolate_frames(keyframes, total_frames, iou_threshold=VIDEO_TRACK_IOU, cuts=()):
+    """
+    keyframes: {frame: [objects]} sorted by frame. Yields (frame, objects)
+    for every frame 0..total_frames-1:
+      - matched objects get a linearly interpolated box and a shared track id
+      - unmatched objects are held until the midpoint between the two
+        keyframes (they appear / disappear there)
+      - frames before the first / after the last keyframe hold its boxes
+    cuts: keyframes that start a new scene. The frames before a cut still
+    show the old scene, so they hold the previous keyframe's boxes as is,
+    and no track continues across the cut.
+    """
+    cuts = set(cuts)
+    frames = list(keyframes)
+    if not frames:
+        for f in range(total_frames):
+            yield f, []
+        return
+
+    next_id = 0
+    tracks = {}
+
+    def assign(frame, objs, inherited=None):
+        nonlocal next_id
+        ids = []
+        for i, _ in enumerate(objs):
+            if inherited and i in inherited:
+                ids.append(inherited[i])
+            else:
+                ids.append(next_id)
+                next_id += 1
+        tracks[frame] = ids
+
+    assign(frames[0], keyframes[frames[0]])
+    for f in range(0, frames[0]):
+        yield f, _with_ids(keyframes[frames[0]], tracks[frames[0]])
+
+    for a, b in zip(frames, frames[1:]):
+        objs_a, objs_b = keyframes[a], keyframes[b]
+        if b in cuts:
+            assign(b, objs_b)
+            for f in range(a, b):
+                yield f, _with_ids(objs_a, tracks[a])
+            continue
+        pairs = match_tracks(objs_a, objs_b, iou_threshold)
+        assign(b, objs_b, {j: tracks[a][i] for i, j in pairs})
+        matched_a = {i for i, _ in pairs}
+        matched_b = {j for _, j in pairs}
+        box_a = np.asarray([o["bbox_norm"] for o in objs_a], dtype=np.float64).reshape(-1, 4)
+        box_b = np.asarray([o["bbox_norm"] for o in objs_b], dtype=np.float64).reshape(-1, 4)
+        mid = (a + b) / 2
+
+        yield a, _with_ids(objs_a, tracks[a])
+        for f in range(a + 1, b):
+            t = (f - a) / (b - a)
+            objs = []
+            for i, j in pairs:
+                box = (1 - t) * box_a[i] + t * box_b[j]
+                objs.append({**objs_a[i], "bbox_norm": [round(float(v), 6) for v in box],
+                             "track": tracks[a][i], "interpolated": True})
+            if f < mid:
+                source, ids, matched = objs_a, tracks[a], matched_a
+            else:
+                source, ids, matched = objs_b, tracks[b], matched_b
+            for k, obj in enumerate(source):
+                if k not in matched:
+                    objs.append({**obj, "track": ids[k], "interpolated": True})
+            yield f, objs
+
+    last = frames[-1]
+    for f in range(last, total_frames):
+        yield f, _with_ids(keyframes[last], tracks[last])
+
+
+def _with_ids(objs, ids):
+    return [{**o, "track": t} for o, t in zip(objs, ids)]
+
+
+def annotate_video(path, out_dir, stride=VIDEO_STRIDE, detector=None, concurrency=None,
+                   iou_threshold=VIDEO_TRACK_IOU, class_map=None):
+    """
+    Full video run. Writes:
+      <out>/labels/<stem>_<frame>.txt   YOLO labels for every frame
+      <out>/classes.txt                 class names in id order
+      <out>/keyframes.json              keyframe annotations + errors
+      <out>/tracks.jsonl                one line per frame with track ids
+    Returns a summary dict.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    labels_dir = os.path.join(out_dir, "labels")
+    os.makedirs(labels_dir, exist_ok=True)
+    class_map = class_map if class_map is not None else ClassMap()
+
+    stats = {}
+    keyframes, errors = annotate_keyframes(
+        iter_keyframes(path, stride=stride, detector=detector, stats=stats), concurrency
+    )
+    total = stats.get("frames", 0)
+    cuts = stats.get("cuts", [])
+
+    with open(os.path.join(out_dir, "keyframes.json"), "w", encoding="utf-8") as f:
+        json.dump({"keyframes": {str(k): v for k, v in keyframes.items()},
+                   "cuts": cuts,
+                   "errors": {str(k): v for k, v in errors.items()}}, f, indent=2)
+
+    track_ids = set()
+    with open(os.path.join(out_dir, "tracks.jsonl"), "w", encoding="utf-8") as tracks_file:
+        for frame, objs in interpolate_frames(keyframes, total, iou_threshold, cuts):
+            yolo_txt = convert_to_yolo(json.dumps({"objects": objs}), class_map=class_map)
+            with open(os.path.join(labels_dir, f"{stem}_{frame:06d}.txt"), "w", encoding="utf-8") as f:
+                f.write(yolo_txt + "\n" if yolo_txt else "")
+            tracks_file.write(json.dumps({"frame": frame, "objects": objs}) + "\n")
+            track_ids.update(o["track"] for o in objs)
+
+    class_map.save(os.path.join(out_dir, "classes.txt"))
+    return {
+        "video": path,
+        "frames": total,
+        "keyframes": len(keyframes),
+        "failed_keyframes": len(errors),
+        "tracks": len(track_ids),
+        "classes": list(class_map.names),
+    }
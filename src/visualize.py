@@ -1,26 +1,41 @@
 from PIL import Image, ImageDraw, ImageFont
+import io
+import multiprocessing
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 
-def draw_boxes(image_path, annotation_json):
-    """
-    annotation_json: { "objects": [ {"label": "cat", "bbox_norm": [x,y,w,h]}, ... ] }
-    Converts normalized boxes (0–1) → pixel coordinates, then draws them.
-    """
+from src.config import PREVIEW_MAX_SIDE, PREVIEW_QUALITY, RENDER_WORKERS
+from src.image_handle import as_handle
 
-    img = Image.open(image_path).convert("RGB")
-    W, H = img.size
+FONT_NAMES = ("arial.ttf", "DejaVuSans.ttf")
 
-    draw = ImageDraw.Draw(img)
+# Below this many images, spawning worker processes costs more than it saves
+MIN_POOL_BATCH = 4
+
+
+@lru_cache(maxsize=16)
+def get_font(size=18):
+    """Loaded once per size and process (the lookup used to run on every call)."""
+    for name in FONT_NAMES:
+        try:
+            return ImageFont.truetype(name, size)
+        except Exception:
+            continue
+    return ImageFont.load_default()
 
-    # Try to load font, fallback if unavailable
-    try:
-        font = ImageFont.truetype("arial.ttf", 18)
-    except Exception:
-        font = ImageFont.load_default()
 
-    objs = annotation_json.get("objects", [])
+def _draw(img, annotation_json):
+    """Draws normalized boxes onto img in place; line width and font scale with the image."""
+    W, H = img.size
+    scale = max(W, H) / 1000.0
+    width = max(1, round(3 * scale))
+    font_size = max(10, round(18 * scale))
+    font = get_font(font_size)
 
-    for obj in objs:
+    draw = ImageDraw.Draw(img)
+    for obj in annotation_json.get("objects", []):
         # Check for normalized bbox
         if "bbox_norm" not in obj:
             continue
@@ -28,19 +43,82 @@ def draw_boxes(image_path, annotation_json):
         x_norm, y_norm, w_norm, h_norm = obj["bbox_norm"]
 
         # Convert normalized → pixel
-        x = int(x_norm * W)
-        y = int(y_norm * H)
-        w = int(w_norm * W)
-        h = int(h_norm * H)
+        x1, y1 = int(x_norm * W), int(y_norm * H)
+        x2, y2 = x1 + int(w_norm * W), y1 + int(h_norm * H)
+
+        draw.rectangle([x1, y1, x2, y2], outline="red", width=width)
+        draw.text((x1 + 4, max(0, y1 - font_size - 2)), obj.get("label", ""), fill="red", font=font)
+    return img
+
+
+def draw_boxes(image, annotation_json):
+    """
+    image: path or ImageHandle (the shared decoded pixels are copied, not reopened)
+    annotation_json: { "objects": [ {"label": "cat", "bbox_norm": [x,y,w,h]}, ... ] }
+    Converts normalized boxes (0–1) → pixel coordinates, then draws them
+    on a full-size copy.
+    """
+    return _draw(as_handle(image).image.copy(), annotation_json)
 
-        x1, y1 = x, y
-        x2, y2 = x + w, y + h
 
-        # Draw rectangle
-        draw.rectangle([x1, y1, x2, y2], outline="red", width=3)
+def render_preview(source, annotation_json, max_side=PREVIEW_MAX_SIDE, quality=PREVIEW_QUALITY):
+    """
+    Annotated thumbnail as JPEG bytes. source: path or encoded image bytes.
+    JPEGs are decoded at reduced scale (draft mode), so a 24 MP photo never
+    exists in memory at full size. Module-level so it can run in a worker
+    process.
+    """
+    fp = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    with Image.open(fp) as img:
+        img.draft("RGB", (max_side, max_side))
+        img = img.convert("RGB")
+    img.thumbnail((max_side, max_side), Image.BILINEAR)
+    _draw(img, annotation_json)
 
-        # Draw label
-        label = obj.get("label", "")
-        draw.text((x1 + 4, max(0, y1 - 20)), label, fill="red", font=font)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
 
-    return img
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool(workers=RENDER_WORKERS):
+    """Process pool shared by all render_batch calls (spawned once per process)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, workers or os.cpu_count() or 1),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def render_batch(jobs, max_side=PREVIEW_MAX_SIDE, quality=PREVIEW_QUALITY):
+    """
+    jobs: iterable of (key, source, annotation_json) with source a path or
+    image bytes. Yields (key, jpeg_bytes | None, error | None) in completion
+    order, so a UI can show each preview as soon as it is ready. Only
+    thumbnails cross the process boundary.
+    """
+    jobs = list(jobs)
+    if len(jobs) < MIN_POOL_BATCH or RENDER_WORKERS == 1:
+        for key, source, annotation in jobs:
+            try:
+                yield key, render_preview(source, annotation, max_side, quality), None
+            except Exception as e:
+                yield key, None, f"{type(e).__name__}: {e}"
+        return
+
+    pool = get_render_pool()
+    futures = {
+        pool.submit(render_preview, source, annotation, max_side, quality): key
+        for key, source, annotation in jobs
+    }
+    for fut in as_completed(futures):
+        try:
+            yield futures[fut], fut.result(), None
+        except Exception as e:
+            yield futures[fut], None, f"{type(e).__name__}: {e}"
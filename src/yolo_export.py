@@ -0,0 +1,162 @@
+# yolo_export.py
+#
+# One-pass exporter from annotated images to a YOLO training dataset:
+#
+#   <out>/images/{train,val}/<name>.jpg
+#   <out>/labels/{train,val}/<name>.txt
+#   <out>/classes.txt
+#   <out>/data.yaml
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from src.stream_pipeline import iter_images
+from src.yolo_formatter import convert_to_yolo
+
+
+class ClassMap:
+    """
+    Stable label -> class id map. Labels are normalized (strip + lower);
+    new labels get the next id in order of first appearance. Loading an
+    existing classes.txt keeps ids stable across exports.
+    """
+
+    def __init__(self, names=None):
+        self.names = []
+        self._ids = {}
+        for name in names or []:
+            self[name]
+
+    @staticmethod
+    def normalize(label):
+        return str(label).strip().lower() or "object"
+
+    def __getitem__(self, label):
+        key = self.normalize(label)
+        if key not in self._ids:
+            self._ids[key] = len(self.names)
+            self.names.append(key)
+        return self._ids[key]
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            return cls([line.strip() for line in f if line.strip()])
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.names) + "\n")
+
+
+def split_for(name, val_fraction):
+    """Deterministic train/val split from a hash of the file name."""
+    h = int(hashlib.sha1(name.encode("utf-8")).hexdigest()[:8], 16)
+    return "val" if h / 0xFFFFFFFF < val_fraction else "train"
+
+
+def _place_image(src, dst):
+    """Hard link when possible (no data copied), else copy."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _write_batch(jobs):
+    for image_src, image_dst, label_path, text in jobs:
+        _place_image(image_src, image_dst)
+        with open(label_path, "w", encoding="utf-8") as f:
+            f.write(text + "\n" if text else "")
+    return len(jobs)
+
+
+def iter_annotated(images_dir, annotations_dir):
+    """
+    Pairs every image under images_dir with <stem>_corrected.json at the
+    same relative path under annotations_dir (the layout written by
+    main.py --input / the app). Yields (image_path, rel_path, annotation).
+    """
+    for path, rel in iter_images(images_dir):
+        ann_path = os.path.join(annotations_dir, os.path.splitext(rel)[0] + "_corrected.json")
+        if not os.path.exists(ann_path):
+            continue
+        with open(ann_path, "r", encoding="utf-8") as f:
+            yield path, rel, json.load(f)
+
+
+def export_dataset(items, out_dir, val_fraction=0.2, class_map=None, batch_size=256, workers=8):
+    """
+    items: iterable of (image_path, rel_path, annotation_dict).
+    Label text is built in memory and written in batches on a thread pool,
+    so file-system latency overlaps instead of one open/write per image on
+    the main thread. Returns a summary dict.
+    """
+    if class_map is None:  # an empty ClassMap is falsy (__len__) but still the caller's
+        class_map = ClassMap.load(os.path.join(out_dir, "classes.txt"))
+    for split in ("train", "val"):
+        os.makedirs(os.path.join(out_dir, "images", split), exist_ok=True)
+        os.makedirs(os.path.join(out_dir, "labels", split), exist_ok=True)
+
+    counts = {"train": 0, "val": 0}
+    objects = 0
+    batch, futures = [], []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for image_path, rel, annotation in items:
+            # flat, collision-free name: sub/dir/img.jpg -> sub__dir__img.jpg
+            name = rel.replace(os.sep, "__").replace("/", "__")
+            stem, ext = os.path.splitext(name)
+            split = split_for(stem, val_fraction)
+
+            text = convert_to_yolo(json.dumps(annotation), class_map=class_map)
+            objects += len(annotation.get("objects", []))
+            counts[split] += 1
+
+            batch.append((
+                image_path,
+                os.path.join(out_dir, "images", split, stem + ext.lower()),
+                os.path.join(out_dir, "labels", split, stem + ".txt"),
+                text,
+            ))
+            if len(batch) >= batch_size:
+                futures.append(pool.submit(_write_batch, batch))
+                batch = []
+
+        if batch:
+            futures.append(pool.submit(_write_batch, batch))
+        for fut in futures:
+            fut.result()  # re-raise write errors
+
+    class_map.save(os.path.join(out_dir, "classes.txt"))
+    write_data_yaml(out_dir, class_map)
+
+    return {
+        "out_dir": out_dir,
+        "train": counts["train"],
+        "val": counts["val"],
+        "objects": objects,
+        "classes": class_map.names,
+    }
+
+
+def write_data_yaml(out_dir, class_map):
+    """Ultralytics-style data.yaml (written by hand, no YAML dependency)."""
+    lines = [
+        f"path: {os.path.abspath(out_dir)}",
+        "train: images/train",
+        "val: images/val",
+        f"nc: {len(class_map)}",
+        "names:",
+    ]
+    lines += [f"  {i}: {json.dumps(name)}" for i, name in enumerate(class_map.names)]
+    with open(os.path.join(out_dir, "data.yaml"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
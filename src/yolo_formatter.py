@@ -1,32 +1,58 @@
 import json
-import re
-from PIL import Image
+import math
+
+from src.json_stream import parse_annotation
+
 
 def extract_json(text):
-    # Extract JSON-like text: { ... } OR [ ... ]
-    match = re.search(r"(\{[\s\S]*\}|\[[\s\S]*\])", text)
-    if match:
-        return match.group(0)
+    # Extract the JSON part of text: { ... } OR [ ... ] (bracket-balanced)
+    data = parse_annotation(text)
+    if data is not None:
+        return json.dumps(data)
     return '{"objects": []}'
 
 
+BOX_KEYS = ("bbox_norm", "bbox", "box")
+
+# Normalized boxes that overshoot the edge a little (e.g. x + w = 1.02)
+# are clamped; only values beyond this are read as pixels
+NORM_SLACK = 0.05
+
+
+def _has_box(item):
+    return isinstance(item, dict) and any(k in item for k in BOX_KEYS)
+
+
+def _raw_items(data):
+    """The items the model answered with, before any are dropped (None: no list at all)."""
+    if isinstance(data, dict) and isinstance(data.get("objects"), list):
+        return data["objects"]
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        if _has_box(data):
+            return [data]
+        return next((val for val in data.values() if isinstance(val, list)), None)
+    return None
+
+
 def normalize_annotation_structure(data):
     """
     Normalize ANY Gemini output to:
     {
-        "objects": [ {"label": ..., "bbox": [...]}, ... ]
+        "objects": [ {"label": ..., "bbox_norm" | "bbox": [...]}, ... ]
     }
     """
 
     
-    if isinstance(data, dict) and "objects" in data:
+    if isinstance(data, dict) and isinstance(data.get("objects"), list):
         return data
 
     
     if isinstance(data, list):
         new_list = []
         for item in data:
-            if isinstance(item, dict) and "bbox" in item:
+            if _has_box(item):
                 new_list.append(item)
             else:
                 # ignore bad items
@@ -35,11 +61,14 @@ def normalize_annotation_structure(data):
 
     
     if isinstance(data, dict):
+        # a single object at top level
+        if _has_box(data):
+            return {"objects": [data]}
         for key, val in data.items():
             if isinstance(val, list):
                 new_list = []
                 for item in val:
-                    if isinstance(item, dict) and "bbox" in item:
+                    if _has_box(item):
                         new_list.append(item)
                 return {"objects": new_list}
 
@@ -47,19 +76,96 @@ def normalize_annotation_structure(data):
     return {"objects": []}
 
 
+def repair_annotation(text, image_size=None, min_size=1e-3):
+    """
+    Local, deterministic replacement for the LLM correction pass.
+
+    - parses JSON (bracket-balanced, chatter skipped) and repairs the structure
+    - reads bbox_norm, or bbox/box when bbox_norm is missing
+    - converts pixel boxes to normalized using image_size (W, H); values
+      up to 1 + NORM_SLACK are normalized boxes past the edge, not pixels
+    - clamps to [0, 1] and drops degenerate (w or h < min_size) and
+      non-finite (NaN / inf) boxes
+
+    Returns {"objects": [{"label": str, "bbox_norm": [x, y, w, h]}]},
+    or None when the input can't be repaired locally (no JSON answer,
+    items but no usable box among them, non-numeric boxes, pixel boxes
+    without image size). An answer with no items is a valid empty result.
+    """
+    if isinstance(text, (dict, list)):
+        data = text
+    else:
+        try:
+            data = json.loads(text)
+        except (TypeError, ValueError):
+            data = parse_annotation(text)
+
+    items = _raw_items(data)
+    if items is None:
+        return None
+    data = normalize_annotation_structure(data)
+
+    objects = []
+    for obj in data["objects"]:
+        if not isinstance(obj, dict):
+            return None
+        box = next((obj[k] for k in BOX_KEYS if k in obj), None)
+        if not isinstance(box, (list, tuple)) or len(box) != 4:
+            return None
+        try:
+            x, y, w, h = (float(v) for v in box)
+        except (TypeError, ValueError):
+            return None
+        if not all(math.isfinite(v) for v in (x, y, w, h)):
+            continue    # NaN / inf pass the clamp and would be written as invalid JSON
+
+        # Pixel coordinates -> normalized
+        if max(x, y, w, h) > 1.0 + NORM_SLACK:
+            if not image_size:
+                return None
+            W, H = image_size
+            x, y, w, h = x / W, y / H, w / W, h / H
+
+        # Clamp to the image
+        x = min(max(x, 0.0), 1.0)
+        y = min(max(y, 0.0), 1.0)
+        w = min(max(w, 0.0), 1.0 - x)
+        h = min(max(h, 0.0), 1.0 - y)
+
+        if w < min_size or h < min_size:
+            continue
+
+        label = obj.get("label")
+        label = str(label).strip() if label is not None else ""
+        fixed = {
+            "label": label or "object",
+            "bbox_norm": [round(x, 6), round(y, 6), round(w, 6), round(h, 6)],
+        }
+        # Keep a model confidence when there is one (used by NMS / box fusion)
+        score = obj.get("score", obj.get("confidence"))
+        if isinstance(score, (int, float)) and not isinstance(score, bool):
+            fixed["score"] = float(score)
+        objects.append(fixed)
+
+    if items and not objects:
+        return None     # e.g. a bare coordinate list, or only degenerate boxes
+    return {"objects": objects}
+
+
 
 
 # tanishqq00/agentic-annotator/agentic-annotator-279ab10d37512c5a77327e16f824b84faa7b35ec/src/yolo_formatter.py
 
 ...
-def convert_to_yolo(normalized_json_str, image_path):
+def convert_to_yolo(normalized_json_str, image_path=None, class_map=None):
+    """
+    YOLO lines from normalized boxes. Works on normalized coordinates only,
+    so the image is never needed (image_path is kept for old callers).
+    class_map: label -> class id (e.g. src.yolo_export.ClassMap); without
+    it every object gets class 0.
+    """
     data = json.loads(normalized_json_str)
 
-    # Note: W, H are only needed here for image opening, but not for calculation below 
-    # since we work with normalized coordinates directly.
-    img = Image.open(image_path)
-    # W, H = img.size # No longer needed for calculation
-
     yolo_lines = []
 
     for obj in data["objects"]:
@@ -82,6 +188,7 @@ def convert_to_yolo(normalized_json_str, image_path):
         #    = ((x_norm * W) + (w_norm * W) / 2) / W
         #    = x_norm + w_norm / 2  <-- New simplified formula
 
-        yolo_lines.append(f"0 {cx:.6f} {cy:.6f} {ww:.6f} {hh:.6f}")
+        class_id = class_map[obj.get("label", "")] if class_map is not None else 0
+        yolo_lines.append(f"{class_id} {cx:.6f} {cy:.6f} {ww:.6f} {hh:.6f}")
 
     return "\n".join(yolo_lines)
@@ -0,0 +1,44 @@
+import random
+
+import numpy as np
+from PIL import Image
+
+from src.dedup import HASH_BITS, HashIndex, hamming, phash
+from src.image_handle import ImageHandle
+
+
+def _flip(h, bits, rng):
+    for b in rng.sample(range(HASH_BITS), bits):
+        h ^= 1 << b
+    return h
+
+
+def _linear_scan(hashes, h, max_distance):
+    found = [(hamming(h, other), key) for key, other in hashes.items() if hamming(h, other) <= max_distance]
+    return min(found)[0] if found else None
+
+
+def test_hash_index_matches_linear_scan_at_radius_limit():
+    rng = random.Random(0)
+    index, hashes = HashIndex(max_distance=6), {}
+    for key in range(200):
+        hashes[key] = rng.getrandbits(HASH_BITS)
+        index.add(key, hashes[key])
+    for key in range(0, 200, 5):
+        # exactly at the limit (found), and one bit past it (not found, unless another is close)
+        for bits in (6, 7):
+            h = _flip(hashes[key], bits, rng)
+            _, distance = index.query(h)
+            assert distance == _linear_scan(hashes, h, 6)
+    assert index.query(_flip(hashes[3], 6, rng))[0] == 3
+
+
+def test_phash_stable_under_recompression(tmp_path):
+    pixels = (np.random.RandomState(1).rand(120, 160, 3) * 255).astype("uint8")
+    a, b, c = tmp_path / "a.jpg", tmp_path / "b.jpg", tmp_path / "c.jpg"
+    Image.fromarray(pixels).save(a, quality=95)
+    Image.fromarray(pixels).resize((80, 60)).save(b, quality=60)
+    Image.fromarray(255 - pixels).save(c, quality=95)
+    ha, hb, hc = (phash(ImageHandle(str(p))) for p in (a, b, c))
+    assert hamming(ha, hb) <= 6
+    assert hamming(ha, hc) > 6
@@ -0,0 +1,49 @@
+from itertools import permutations
+
+import numpy as np
+import pytest
+
+from src.eval import MAPAccumulator, average_precision, linear_assignment, match_hungarian
+
+
+def _brute_force(cost):
+    n, m = cost.shape
+    if n <= m:
+        return min(sum(cost[i, j] for i, j in enumerate(cols)) for cols in permutations(range(m), n))
+    return _brute_force(cost.T)
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (3, 3), (4, 4), (2, 5), (5, 3)])
+def test_linear_assignment_matches_brute_force(shape):
+    rng = np.random.default_rng(sum(shape))
+    for _ in range(20):
+        cost = rng.integers(0, 10, size=shape).astype(float)
+        rows, cols = linear_assignment(cost)
+        assert len(rows) == min(shape)
+        assert len(set(rows)) == len(rows) and len(set(cols)) == len(cols)
+        assert cost[rows, cols].sum() == pytest.approx(_brute_force(cost))
+
+
+def test_hungarian_beats_greedy_choice():
+    # greedy takes the 0.9 pair and strands row 1 (0.1 < 0.5); optimal is 0.8 + 0.7
+    ious = np.array([[0.9, 0.8], [0.7, 0.1]])
+    assert sorted(match_hungarian(ious, 0.5)) == [(0, 1, 0.8), (1, 0, 0.7)]
+
+
+def test_average_precision_hand_computed():
+    # TP, FP, TP over 2 GT: P/R = (1, .5), (.5, .5), (.667, 1) -> 0.5 * 1 + 0.5 * 2/3
+    assert average_precision([True, False, True], [0.9, 0.8, 0.7], 2) == pytest.approx(5 / 6)
+
+
+def test_map_accumulator_hand_computed():
+    acc = MAPAccumulator()
+    gt = [[0, 0, 10, 10], [20, 20, 10, 10]]
+    preds = [[0, 0, 10, 10], [50, 50, 10, 10], [20, 20, 10, 10]]
+    acc.add_image(preds, ["car"] * 3, [0.9, 0.8, 0.7], gt, ["car", "car"])
+    acc.add_image([], [], [], [[0, 0, 5, 5]], ["Dog "])   # missed class: AP 0
+
+    summary = acc.summary()
+    assert summary["per_class"]["car"]["ap50"] == pytest.approx(0.8333, abs=1e-4)
+    assert summary["per_class"]["car"]["ap50_95"] == pytest.approx(0.8333, abs=1e-4)
+    assert summary["per_class"]["dog"]["ap50"] == 0.0
+    assert summary["map50"] == pytest.approx(0.4167, abs=1e-4)
@@ -0,0 +1,66 @@
+import json
+
+from src.json_stream import ObjectStream, parse_annotation, parse_json
+
+BOX_CAR = {"label": "car", "bbox_norm": [0.1, 0.2, 0.3, 0.4]}
+BOX_DOG = {"label": "dog", "bbox_norm": [0.5, 0.5, 0.1, 0.1]}
+
+
+def test_parse_json_plain():
+    assert parse_json('{"plan": ["a", "b"]}') == {"plan": ["a", "b"]}
+
+
+def test_parse_json_skips_chatter_and_fences():
+    text = 'Sure! {note} here it is:\n```json\n' + json.dumps({"objects": [BOX_CAR]}) + "\n```\nHope it's ok }"
+    assert parse_json(text, accept=lambda v: isinstance(v, dict) and "objects" in v) == {"objects": [BOX_CAR]}
+
+
+def test_parse_json_after_unclosed_brace_in_prose():
+    text = 'Use {x: the json ' + json.dumps({"objects": [BOX_DOG]})
+    assert parse_json(text) == {"objects": [BOX_DOG]}
+
+
+def test_parse_json_braces_inside_strings():
+    text = 'ok {"objects": [{"label": "b}]", "bbox_norm": [0, 0, 1, 1]}]}'
+    assert parse_json(text)["objects"][0]["label"] == "b}]"
+
+
+def test_parse_json_nothing():
+    assert parse_json("I cannot help with that.") is None
+    assert parse_json("no json", default={}) == {}
+
+
+def test_truncated_answer_keeps_completed_boxes():
+    text = '{"objects": [' + json.dumps(BOX_CAR) + ', {"label": "dog", "bbox_n'
+    stream = ObjectStream()
+    stream.feed(text)
+    assert stream.result() == {"objects": [BOX_CAR]}
+    assert stream.salvaged
+    assert parse_annotation(text) == {"objects": [BOX_CAR]}
+
+
+def test_truncated_without_boxes_is_none():
+    assert parse_annotation('{"objects": [{"label": "car", "bbox_norm": [0.1, 0.2') is None
+
+
+def test_complete_answer_is_not_salvaged():
+    stream = ObjectStream()
+    stream.feed('Here: {"objects": [' + json.dumps(BOX_CAR) + "]} done")
+    assert stream.result() == {"objects": [BOX_CAR]}
+    assert not stream.salvaged
+
+
+def test_list_answer():
+    assert parse_annotation(json.dumps([BOX_CAR, BOX_DOG])) == [BOX_CAR, BOX_DOG]
+    assert parse_annotation("[]") == []
+
+
+def test_stream_yields_boxes_as_they_close():
+    text = 'Here you go: {"objects": [' + json.dumps({"label": 'c"at', "bbox_norm": [0.1, 0.2, 0.3, 0.4]}) \
+        + ", " + json.dumps(BOX_DOG) + "]}"
+    stream = ObjectStream()
+    seen = []
+    for i in range(0, len(text), 7):
+        seen.extend(stream.feed(text[i:i + 7]))
+    assert [o["label"] for o in seen] == ['c"at', "dog"]
+    assert stream.result()["objects"] == seen
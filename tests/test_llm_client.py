@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src import backends
+from src.backends import FakeAPIError, set_backend
+from src.llm_client import LLMClient
+
+
+class ChunkBackend:
+    """Streams fixed chunks; the last one carries the usage totals, like Gemini."""
+
+    def __init__(self, chunks, fail_after=None, code=503):
+        self.chunks = chunks
+        self.fail_after = fail_after
+        self.code = code
+
+    def generate(self, model_name, contents, **kwargs):
+        def body():
+            for i, chunk in enumerate(self.chunks):
+                if i == self.fail_after:
+                    raise FakeAPIError(self.code, "stream reset")
+                yield chunk
+        return body()
+
+
+def _chunk(text, usage=None):
+    return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+@pytest.fixture
+def backend():
+    previous = backends._backend
+    yield lambda b: set_backend(b)
+    set_backend(previous)
+
+
+def test_stream_holds_slot_until_consumed(backend):
+    backend(ChunkBackend([_chunk("{"), _chunk("}")]))
+    client = LLMClient(backoff_base=0.0)
+    response = client.generate("m", ["hi"], stream=True)
+    assert client.limiter.in_flight == 1 and client.calls == 0
+    assert "".join(c.text for c in response) == "{}"
+    assert client.limiter.in_flight == 0 and client.calls == 1
+
+
+def test_stream_charges_final_usage(backend):
+    usage = SimpleNamespace(total_token_count=900, prompt_token_count=300, candidates_token_count=600)
+    backend(ChunkBackend([_chunk("{", SimpleNamespace(total_token_count=310)), _chunk("}", usage)]))
+    client = LLMClient(tpm=10_000, backoff_base=0.0)
+    before = client.tokens.tokens
+    list(client.generate("m", ["hi"], stream=True))
+    # estimate charged up front, corrected to the final total afterwards
+    assert client.tokens.tokens == pytest.approx(before - 900, abs=5)
+
+
+def test_stream_error_mid_body_releases_throttled(backend):
+    backend(ChunkBackend([_chunk("{"), _chunk("}")], fail_after=1, code=429))
+    client = LLMClient(backoff_base=0.0, max_concurrency=8)
+    limit = client.limiter.limit
+    with pytest.raises(FakeAPIError):
+        list(client.generate("m", ["hi"], stream=True))
+    assert client.limiter.in_flight == 0
+    assert client.throttled == 1 and client.retries == 1 and client.calls == 0
+    assert client.limiter.limit < limit
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from src.postprocess import nms, soft_nms, weighted_box_fusion
+
+A = [0, 0, 10, 10]
+B = [1, 0, 10, 10]      # IoU with A = 90 / 110
+C = [50, 50, 10, 10]
+IOU_AB = 90 / 110
+
+
+def _naive_nms(boxes, scores, thr):
+    xyxy = [(x, y, x + w, y + h) for x, y, w, h in boxes]
+
+    def iou(a, b):
+        iw = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+        ih = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+        inter = iw * ih
+        return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+    keep = []
+    for i in sorted(range(len(boxes)), key=lambda i: -scores[i]):
+        if all(iou(xyxy[i], xyxy[k]) <= thr for k in keep):
+            keep.append(i)
+    return keep
+
+
+def test_nms_suppresses_overlap_within_class():
+    assert nms([A, B, C], [0.9, 0.8, 0.7], 0.5).tolist() == [0, 2]
+    assert nms([A, B, C], [0.9, 0.8, 0.7], 0.5, classes=["car", "dog", "car"]).tolist() == [0, 1, 2]
+
+
+def test_blocked_nms_matches_naive():
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(0, 80, size=(60, 2))
+    wh = rng.uniform(5, 30, size=(60, 2))
+    boxes = np.hstack([xy, wh])
+    scores = rng.uniform(size=60)
+    assert nms(boxes, scores, 0.4, block=7).tolist() == _naive_nms(boxes.tolist(), scores.tolist(), 0.4)
+
+
+def test_soft_nms_decays_instead_of_removing():
+    keep, scores = soft_nms([A, B, C], [0.9, 0.8, 0.7], sigma=0.5)
+    assert keep.tolist() == [0, 2, 1]
+    assert scores == pytest.approx([0.9, 0.7, 0.8 * np.exp(-IOU_AB ** 2 / 0.5)])
+
+
+def test_wbf_fuses_overlapping_boxes_across_sources():
+    boxes, scores, labels = weighted_box_fusion(
+        [[A, C], [[2, 0, 10, 10]]], [[0.8, 0.9], [0.4]], [["car", "car"], ["car"]], iou_threshold=0.55,
+    )
+    order = np.argsort(boxes[:, 0])
+    boxes, scores = boxes[order], scores[order]
+    # A and its shifted copy (IoU 80 / 120): score-weighted mean box, both sources agree
+    assert boxes[0] == pytest.approx([0.8 / 1.2, 0, 10, 10])
+    assert scores[0] == pytest.approx(0.6)
+    # C is seen by one source of two: its score is halved
+    assert boxes[1] == pytest.approx(C)
+    assert scores[1] == pytest.approx(0.45)
+    assert labels.tolist() == ["car", "car"]
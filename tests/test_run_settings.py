@@ -0,0 +1,31 @@
+import json
+import threading
+
+from src import batch_runner, run_settings
+from src.image_handle import ImageHandle
+
+
+def test_get_defaults_outside_a_run():
+    assert run_settings.get("tiling", "default") == "default"
+    with run_settings.use(run_settings.snapshot(tiling=True)):
+        assert run_settings.get("tiling", False) is True
+        assert run_settings.get("cascade", "default") == "default"
+    assert run_settings.get("tiling", "default") == "default"
+
+
+def test_batch_runs_agents_under_job_settings(monkeypatch):
+    seen = []
+
+    def fake_annotate(handle, on_object=None):
+        seen.append((threading.current_thread().name, run_settings.get("postprocess", "global")))
+        return json.dumps({"objects": []})
+
+    monkeypatch.setattr(batch_runner, "annotate_image", fake_annotate)
+    monkeypatch.setattr(batch_runner, "local_correct", lambda handle, raw: raw)
+    images = [ImageHandle(path=f"img{i}.jpg", data=b"") for i in range(4)]
+    settings = run_settings.snapshot(postprocess="wbf")
+
+    results = list(batch_runner.stream_batch(images, 2, pack=1, dedup=False, settings=settings))
+    assert len(results) == 4 and not any("error" in r for r in results)
+    assert {value for _, value in seen} == {"wbf"}
+    assert all(name != threading.current_thread().name for name, _ in seen)
@@ -0,0 +1,35 @@
+import numpy as np
+
+from src.video import SceneDetector, interpolate_frames
+
+CAR_A = {"label": "car", "bbox_norm": [0.1, 0.1, 0.2, 0.2]}
+CAR_B = {"label": "car", "bbox_norm": [0.2, 0.1, 0.2, 0.2]}
+DOG = {"label": "dog", "bbox_norm": [0.6, 0.6, 0.2, 0.2]}
+
+
+def test_interpolates_between_stride_keyframes():
+    frames = dict(interpolate_frames({0: [CAR_A], 10: [CAR_B]}, 11))
+    assert frames[5][0]["bbox_norm"] == [0.15, 0.1, 0.2, 0.2]
+    assert frames[5][0]["track"] == frames[10][0]["track"] == frames[0][0]["track"]
+
+
+def test_scene_cut_holds_previous_boxes():
+    keyframes = {0: [CAR_A], 60: [CAR_B, DOG]}
+    frames = dict(interpolate_frames(keyframes, 90, cuts=[60]))
+    for f in range(60):
+        assert [o["bbox_norm"] for o in frames[f]] == [CAR_A["bbox_norm"]]
+        assert not any(o.get("interpolated") for o in frames[f])
+    assert {o["label"] for o in frames[60]} == {"car", "dog"}
+    # no track continues across the cut
+    assert frames[59][0]["track"] not in {o["track"] for o in frames[60]}
+
+
+def test_scene_detector_reports_cut_reason():
+    detector = SceneDetector(threshold=0.3, min_gap=1, max_gap=100)
+    red = np.zeros((90, 160, 3), np.uint8)
+    red[:] = (0, 0, 255)
+    blue = np.zeros((90, 160, 3), np.uint8)
+    blue[:] = (255, 0, 0)
+    assert detector.is_keyframe(0, red) and detector.reason == "first"
+    assert not detector.is_keyframe(1, red)
+    assert detector.is_keyframe(2, blue) and detector.reason == "scene"
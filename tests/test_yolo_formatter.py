@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from src.yolo_formatter import repair_annotation
+
+
+@pytest.mark.parametrize("text", [
+    "I cannot help with that.",
+    "[0.1, 0.2, 0.3, 0.4]",
+    '{"objects": [{"label": "car", "bbox_norm": [0.5, 0.5, 0.0, 0.0]}]}',
+    '{"objects": [{"label": "car", "bbox_norm": [NaN, 0.5, 0.2, 0.2]}]}',
+])
+def test_repair_rejects_answers_without_usable_boxes(text):
+    assert repair_annotation(text, (100, 100)) is None
+
+
+def test_repair_keeps_empty_answer():
+    assert repair_annotation('{"objects": []}') == {"objects": []}
+
+
+def test_repair_clamps_slight_overshoot():
+    fixed = repair_annotation('{"objects": [{"label": "car", "bbox_norm": [0.5, 0.5, 0.52, 0.3]}]}')
+    assert fixed == {"objects": [{"label": "car", "bbox_norm": [0.5, 0.5, 0.5, 0.3]}]}
+
+
+def test_repair_converts_pixels():
+    fixed = repair_annotation('Here: [{"label": "car", "bbox": [10, 20, 50, 30]}]', (100, 200))
+    assert fixed["objects"][0]["bbox_norm"] == [0.1, 0.1, 0.5, 0.15]
+
+
+def test_repair_drops_non_finite_boxes():
+    text = ('{"objects": [{"label": "car", "bbox_norm": [0.1, 0.1, Infinity, 0.2]}, '
+            '{"label": "dog", "bbox_norm": [0.5, 0.5, 0.2, 0.2]}]}')
+    fixed = repair_annotation(text)
+    assert [o["label"] for o in fixed["objects"]] == ["dog"]
+    json.loads(json.dumps(fixed), parse_constant=lambda c: pytest.fail(f"{c} in output"))